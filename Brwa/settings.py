@@ -1,6 +1,7 @@
 from pathlib import Path
 import os
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -35,15 +36,19 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.middleware.RequestTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
+    "api.middleware.ReplicaRoutingMiddleware",
+    "api.middleware.DataVersionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "api.middleware.ProfilingMiddleware",
 ]
 
 ROOT_URLCONF = "Brwa.urls"
@@ -85,9 +90,55 @@ DATABASES = {
         "PASSWORD": os.environ.get("DB_PASSWORD"),
         "HOST": os.environ.get("DB_HOST", "localhost"),
         "PORT": os.environ.get("DB_PORT", "5432"),
+        # Persistent connections; gunicorn.conf.py turns them on for sync
+        # workers, whose requests reuse the connection opened at boot. Keep 0
+        # under ASGI, which would hold one per request thread.
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", "0")),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Optional read replica for list/report/export reads (see api.db_routers).
+if os.environ.get("REPLICA_DB_HOST"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": os.environ.get("REPLICA_DB_NAME", DATABASES["default"]["NAME"]),
+        "USER": os.environ.get("REPLICA_DB_USER", DATABASES["default"]["USER"]),
+        "PASSWORD": os.environ.get(
+            "REPLICA_DB_PASSWORD", DATABASES["default"]["PASSWORD"]
+        ),
+        "HOST": os.environ["REPLICA_DB_HOST"],
+        "PORT": os.environ.get("REPLICA_DB_PORT", DATABASES["default"]["PORT"]),
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["api.db_routers.ReplicaRouter"]
+REPLICA_DATABASE_ALIAS = "replica"
+# Seconds a client reads from the primary after its own write.
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", "5"))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# "reference" holds SafeType/Partner rows (api.cache). Entries are keyed on
+# the DataVersion of their table, so a per-process LocMemCache stays correct
+# with several workers; a shared backend (Redis, Memcached) only saves memory.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "reference": {
+        "BACKEND": os.environ.get(
+            "REFERENCE_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.environ.get("REFERENCE_CACHE_LOCATION", "reference"),
+        "TIMEOUT": int(os.environ.get("REFERENCE_CACHE_TIMEOUT", "300")),
+    },
+}
+REFERENCE_CACHE_ALIAS = "reference"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -129,6 +180,22 @@ CORS_ALLOWED_ORIGINS = [
     "https://www.brwa-exchange.com",  # Changed from http to https
 ]
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = list(default_headers) + [
+    "if-none-match",
+    "if-modified-since",
+    "if-match",
+    "idempotency-key",
+    "primary-pin",
+]
+CORS_EXPOSE_HEADERS = [
+    "ETag",
+    "Last-Modified",
+    "Server-Timing",
+    "X-Profile-Id",
+    "X-Profile-Url",
+    "Idempotent-Replayed",
+    "Primary-Pin",
+]
 
 CSRF_TRUSTED_ORIGINS = [
     "https://brwa-exchange.com",  # Changed from http to https
@@ -140,6 +207,91 @@ REST_FRAMEWORK = {
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
+    "DEFAULT_RENDERER_CLASSES": (
+        "api.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+}
+
+# Serve list actions from api.fastpath unless a request passes ?fast=0.
+FAST_LIST_PATH = os.environ.get("FAST_LIST_PATH", "False") == "True"
+
+# Threads that run the concurrent queries of the /api/async/ reports; each
+# keeps a database connection (closed after CONN_MAX_AGE).
+ASYNC_QUERY_THREADS = int(os.environ.get("ASYNC_QUERY_THREADS", "4"))
+
+# Server-Sent Events change feed (/api/events/); serve it through the ASGI app.
+# Under WSGI each request returns one batch and the client reconnects.
+SSE_POLL_INTERVAL = float(os.environ.get("SSE_POLL_INTERVAL", "1.0"))
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get("SSE_HEARTBEAT_INTERVAL", "15"))
+SSE_RETRY_MS = 3000
+# Seconds a ticket from /api/events/ticket/ stays valid (used once).
+SSE_TICKET_TTL = int(os.environ.get("SSE_TICKET_TTL", "30"))
+# Seconds an event id may stay invisible (inserted, not yet committed).
+SSE_COMMIT_WINDOW = float(os.environ.get("SSE_COMMIT_WINDOW", "5"))
+CHANGE_EVENT_RETENTION_HOURS = float(os.environ.get("CHANGE_EVENT_RETENTION_HOURS", "24"))
+
+# Per-request timing (api.middleware.RequestTimingMiddleware).
+SERVER_TIMING_HEADER = os.environ.get("SERVER_TIMING_HEADER", "True") == "True"
+SLOW_REQUEST_MS = int(os.environ.get("SLOW_REQUEST_MS", "1000"))
+
+# Prometheus metrics at /metrics (api.metrics). Set METRICS_DIR to a
+# directory shared by the gunicorn workers so the scrape covers all of them.
+# The endpoint answers only scrapes that send "Bearer <METRICS_TOKEN>".
+METRICS_DIR = os.environ.get("METRICS_DIR") or None
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Staff can profile a single request with ?profile=1 (or =memory); the
+# files land here (api.profiling). Unset disables profiling.
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or None
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "100"))
+
+# How long a stored Idempotency-Key response is replayed (api.idempotency);
+# prune_idempotency_keys deletes the expired ones.
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.environ.get("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+
+# Background jobs (api.jobs, run_jobs command): where export jobs write their
+# files, how often a running job's worker reports in, how long a job may go
+# without a heartbeat before another worker takes it back, and the first
+# retry delay (doubled on each further attempt).
+JOB_OUTPUT_DIR = os.environ.get("JOB_OUTPUT_DIR", str(BASE_DIR / "jobs"))
+JOB_HEARTBEAT_SECONDS = int(os.environ.get("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", "120"))
+JOB_RETRY_DELAY_SECONDS = int(os.environ.get("JOB_RETRY_DELAY_SECONDS", "30"))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+        "slow_requests": (
+            {
+                "class": "logging.FileHandler",
+                "filename": os.environ["SLOW_REQUEST_LOG"],
+                "delay": True,
+            }
+            if os.environ.get("SLOW_REQUEST_LOG")
+            else {"class": "logging.StreamHandler"}
+        ),
+    },
+    "loggers": {
+        "api.timing": {
+            "handlers": ["console"],
+            "level": os.environ.get("REQUEST_TIMING_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+        "api.timing.slow": {
+            "handlers": ["slow_requests"],
+            "level": "WARNING",
+            "propagate": False,
+        },
+        "api.warmup": {
+            "handlers": ["console"],
+            "level": "INFO",
+            "propagate": False,
+        },
+    },
 }
 
 USE_X_FORWARDED_HOST = True
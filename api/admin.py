@@ -1,4 +1,7 @@
+from decimal import Decimal
 from django.contrib import admin
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from .models import (
     Partner,
     SafeType,
@@ -11,6 +14,80 @@ from .models import (
     OutgoingMoney,
     SafeTransaction,
 )
+from .pagination import EstimatedCountPaginator
+
+# Changelists render each row's foreign keys through __str__: SafePartner's
+# needs its partner and safe_type, Debt's its repayments. Every admin below
+# selects those up front, so a page costs the same number of queries on any
+# table size, and SafePartner/Debt foreign keys use autocomplete widgets
+# instead of a <select> of every row.
+
+CENT = Decimal("0.01")
+AMOUNT = DecimalField(max_digits=20, decimal_places=2)
+
+
+def safe_partner_paths(*fields):
+    """select_related paths for rendering SafePartner foreign keys."""
+    return tuple(
+        f"{field}__{related}"
+        for field in fields
+        for related in ("partner", "safe_type")
+    )
+
+
+def repaid(debt):
+    """
+    Sum of the repayments of ``debt`` (an OuterRef) in the debt's currency,
+    converted like DebtRepayment.converted_amount.
+    """
+    converted = Case(
+        When(
+            debt__currency="USD",
+            currency="IQD",
+            then=F("amount") / F("conversion_rate"),
+        ),
+        default=F("amount") * F("conversion_rate"),
+        output_field=AMOUNT,
+    )
+    total = (
+        DebtRepayment.objects.filter(debt=debt)
+        .order_by()
+        .values("debt")
+        .annotate(total=Sum(converted))
+        .values("total")
+    )
+    return Coalesce(Subquery(total), Value(Decimal("0")), output_field=AMOUNT)
+
+
+class SafePartnerFilter(admin.RelatedFieldListFilter):
+    """RelatedFieldListFilter that loads the SafePartner labels in one query."""
+
+    def field_choices(self, field, request, model_admin):
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        safe_partners = SafePartner.objects.select_related("partner", "safe_type")
+        return [(obj.pk, str(obj)) for obj in safe_partners.order_by(*ordering)]
+
+
+class SafePartnerLabelsMixin:
+    """Autocomplete widgets render their selected SafePartners with __str__."""
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if formfield is not None and db_field.related_model is SafePartner:
+            formfield.queryset = formfield.queryset.select_related(
+                "partner", "safe_type"
+            )
+        return formfield
+
+
+class LargeTableAdmin(SafePartnerLabelsMixin, admin.ModelAdmin):
+    """
+    Transaction tables: an unfiltered changelist shows PostgreSQL's row
+    estimate, and a filtered one skips the extra COUNT(*) of the whole table.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(Partner)
@@ -48,10 +125,15 @@ class SafePartnerAdmin(admin.ModelAdmin):
     )
     list_filter = ("safe_type", "partner")
     search_fields = ("partner__name", "safe_type__name")
+    ordering = ("partner__name", "safe_type__name")
+
+    def get_queryset(self, request):
+        # Also used by the autocomplete views, which render __str__.
+        return super().get_queryset(request).select_related("partner", "safe_type")
 
 
 @admin.register(CryptoTransaction)
-class CryptoTransactionAdmin(admin.ModelAdmin):
+class CryptoTransactionAdmin(LargeTableAdmin):
     list_display = (
         "partner",
         "transaction_type",
@@ -66,33 +148,52 @@ class CryptoTransactionAdmin(admin.ModelAdmin):
     list_filter = ("transaction_type", "status", "payment_safe")
     search_fields = ("partner_client__partner__name", "client_name")
     list_per_page = 25
+    list_select_related = safe_partner_paths("partner", "partner_client") + (
+        "payment_safe",
+        "crypto_safe",
+    )
+    autocomplete_fields = ("partner", "partner_client")
 
 
 @admin.register(Debt)
-class DebtAdmin(admin.ModelAdmin):
+class DebtAdmin(SafePartnerLabelsMixin, admin.ModelAdmin):
     list_display = (
         "debtor_name",
         "safe_partner",
         "total_amount",
         "currency",
         "remaining_amount_display",
-        "is_fully_paid",
+        "fully_paid",
         "created_at",
     )
     list_filter = ("currency",)
     search_fields = ("debtor_name", "debtor_phone", "safe_partner__partner__name")
+    list_select_related = safe_partner_paths("safe_partner")
+    autocomplete_fields = ("safe_partner",)
+    ordering = ("-created_at",)
+
+    def get_queryset(self, request):
+        # The repayments are still prefetched for Debt.__str__ (autocomplete).
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(remaining=F("total_amount") - repaid(OuterRef("pk")))
+            .prefetch_related("repayments")
+        )
 
+    @admin.display(description="Remaining Amount", ordering="remaining")
     def remaining_amount_display(self, obj):
-        return f"{obj.remaining_amount} {obj.currency}"
+        return f"{obj.remaining.quantize(CENT)} {obj.currency}"
 
-    remaining_amount_display.short_description = "Remaining Amount"
-    remaining_amount_display.admin_order_field = "total_amount"
+    @admin.display(boolean=True, description="Is fully paid", ordering="remaining")
+    def fully_paid(self, obj):
+        return obj.remaining <= 0
 
 
 @admin.register(DebtRepayment)
-class DebtRepaymentAdmin(admin.ModelAdmin):
+class DebtRepaymentAdmin(LargeTableAdmin):
     list_display = (
-        "debt",
+        "debt_display",
         "amount",
         "currency",
         "safe_type",
@@ -100,10 +201,27 @@ class DebtRepaymentAdmin(admin.ModelAdmin):
     )
     list_filter = ("currency", "safe_type")
     search_fields = ("debt__debtor_name",)
+    list_select_related = ("debt", "safe_type")
+    autocomplete_fields = ("debt",)
+
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .annotate(
+                debt_remaining=F("debt__total_amount") - repaid(OuterRef("debt"))
+            )
+        )
+
+    @admin.display(description="Debt", ordering="debt")
+    def debt_display(self, obj):
+        # Debt.__str__, without its query for the repayments.
+        remaining = obj.debt_remaining.quantize(CENT)
+        return f"{obj.debt.debtor_name} owes {remaining} {obj.debt.currency}"
 
 
 @admin.register(TransferExchange)
-class TransferExchangeAdmin(admin.ModelAdmin):
+class TransferExchangeAdmin(LargeTableAdmin):
     list_display = (
         "exchange_type",
         "partner",
@@ -112,12 +230,14 @@ class TransferExchangeAdmin(admin.ModelAdmin):
         "exchange_rate",
         "created_at",
     )
-    list_filter = ("exchange_type", "partner")
+    list_filter = ("exchange_type", ("partner", SafePartnerFilter))
     search_fields = ("partner__partner__name",)
+    list_select_related = safe_partner_paths("partner")
+    autocomplete_fields = ("partner",)
 
 
 @admin.register(IncomingMoney)
-class IncomingMoneyAdmin(admin.ModelAdmin):
+class IncomingMoneyAdmin(LargeTableAdmin):
     list_display = (
         "from_partner",
         "to_partner",
@@ -133,10 +253,12 @@ class IncomingMoneyAdmin(admin.ModelAdmin):
         "to_partner__partner__name",
         "to_name",
     )
+    list_select_related = safe_partner_paths("from_partner", "to_partner")
+    autocomplete_fields = ("from_partner", "to_partner")
 
 
 @admin.register(OutgoingMoney)
-class OutgoingMoneyAdmin(admin.ModelAdmin):
+class OutgoingMoneyAdmin(LargeTableAdmin):
     list_display = (
         "from_partner",
         "to_partner",
@@ -153,10 +275,12 @@ class OutgoingMoneyAdmin(admin.ModelAdmin):
         "from_name",
         "taker_name",
     )
+    list_select_related = safe_partner_paths("from_partner", "to_partner")
+    autocomplete_fields = ("from_partner", "to_partner")
 
 
 @admin.register(SafeTransaction)
-class SafeTransactionAdmin(admin.ModelAdmin):
+class SafeTransactionAdmin(LargeTableAdmin):
     list_display = (
         "transaction_type",
         "partner",
@@ -172,3 +296,7 @@ class SafeTransactionAdmin(admin.ModelAdmin):
         "from_safepartner__partner__name",
         "to_safepartner__partner__name",
     )
+    list_select_related = safe_partner_paths(
+        "partner", "from_safepartner", "to_safepartner"
+    )
+    autocomplete_fields = ("partner", "from_safepartner", "to_safepartner")
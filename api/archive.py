@@ -0,0 +1,167 @@
+from collections import Counter, defaultdict
+from datetime import date, datetime, time
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .events import emit_events
+from .ledger import BALANCE_FIELDS, OwnerSafes, postings
+from .models import (
+    ArchivedTransaction,
+    CarryForward,
+    CryptoTransaction,
+    IncomingMoney,
+    OutgoingMoney,
+    SafeTransaction,
+)
+from .versions import bump_version
+
+# Completed rows older than a cutoff move from the hot tables to
+# ArchivedTransaction, and their balance effect (api.ledger postings) is
+# added to the SafePartner's CarryForward, so
+#     balance = carry-forward + postings of the live rows
+# still holds. The live rows are removed with raw deletes: the posting
+# handlers in api.signals must not reverse them. What the other delete
+# handlers record is written here instead: a "deleted" change event per row
+# (the SSE feed) and the DataVersion bump; the ArchivedTransaction row is the
+# audit record of the removal. SafePartner balances do not change, so there
+# is no SafePartner history row.
+
+ARCHIVED_MODELS = {
+    model._meta.model_name: model
+    for model in (CryptoTransaction, IncomingMoney, OutgoingMoney, SafeTransaction)
+}
+
+
+def _parties(model, row):
+    """``(partner, counterparty)`` SafePartner ids of a ``.values()`` row."""
+    if model is CryptoTransaction:
+        return row["partner_id"], row["partner_client_id"]
+    if model is SafeTransaction:
+        partner = row["partner_id"] or row["from_safepartner_id"]
+        return partner, row["to_safepartner_id"]
+    return row["from_partner_id"], row["to_partner_id"]
+
+
+def latest_allowed_cutoff():
+    """
+    Start of the current (TIME_ZONE, Baghdad) month. The bonus reports never
+    look further back, so they never need the archive.
+    """
+    first = timezone.localdate().replace(day=1)
+    return timezone.make_aware(datetime.combine(first, time.min))
+
+
+def archivable(model, before):
+    queryset = model.objects.filter(created_at__lt=before)
+    if any(field.name == "status" for field in model._meta.fields):
+        queryset = queryset.filter(status="Completed")
+    return queryset
+
+
+# -----------------------------
+# Row encoding
+# -----------------------------
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_row(row):
+    return {key: _encode(value) for key, value in row.items()}
+
+
+def decode_row(model_name, data):
+    """The archived row as ``model.objects.values()`` would have returned it."""
+    model = ARCHIVED_MODELS[model_name]
+    return {
+        field.attname: field.to_python(data.get(field.attname))
+        for field in model._meta.concrete_fields
+    }
+
+
+# -----------------------------
+# Archiving
+# -----------------------------
+def archive(before, batch_size=2000, dry_run=False):
+    """
+    Archive every archivable row created before ``before``; returns
+    ``{model_name: rows}``. Each batch (archive rows, carry-forward,
+    deletes) commits on its own, so an interrupted run can be repeated. Its
+    rows are locked (SELECT ... FOR UPDATE) until then: an edit or a second
+    run waits instead of changing a row after its postings were carried.
+    """
+    if before > latest_allowed_cutoff():
+        raise ValueError("The cutoff must not be after the start of this month.")
+    counts = Counter()
+    if dry_run:
+        for name, model in ARCHIVED_MODELS.items():
+            counts[name] = archivable(model, before).count()
+        return counts
+
+    owner = OwnerSafes.load()
+    for name, model in ARCHIVED_MODELS.items():
+        while True:
+            with transaction.atomic():
+                queryset = archivable(model, before).select_for_update()
+                rows = list(queryset.order_by("pk").values()[:batch_size])
+                if not rows:
+                    break
+                _archive_batch(name, model, rows, owner, before)
+            counts[name] += len(rows)
+        if counts[name]:
+            bump_version(model)
+    return counts
+
+
+def _archive_batch(name, model, rows, owner, before):
+    totals = defaultdict(lambda: defaultdict(Decimal))
+    touched = Counter()
+    archived, instances = [], []
+    for row in rows:
+        partner, counterparty = _parties(model, row)
+        archived.append(
+            ArchivedTransaction(
+                model=name,
+                original_id=row["id"],
+                created_at=row["created_at"],
+                partner_id=partner,
+                counterparty_id=counterparty,
+                data=encode_row(row),
+            )
+        )
+        instance = model(**row)
+        instances.append(instance)
+        safe_partners = set()
+        for safe_partner, currency, amount in postings(instance, owner):
+            totals[safe_partner][BALANCE_FIELDS[currency]] += Decimal(amount)
+            safe_partners.add(safe_partner)
+        touched.update(safe_partners)
+
+    ArchivedTransaction.objects.bulk_create(archived)
+    for safe_partner, fields in totals.items():
+        _carry_forward(safe_partner, fields, touched[safe_partner], before)
+    model.objects.filter(pk__in=[row["id"] for row in rows])._raw_delete(
+        model.objects.db
+    )
+    emit_events(instances, "deleted")
+
+
+def _carry_forward(safe_partner, fields, rows, before):
+    amounts = {
+        field: fields.get(field, Decimal("0")) for field in BALANCE_FIELDS.values()
+    }
+    amounts["total_iqd"] = int(amounts["total_iqd"])
+    updated = CarryForward.objects.filter(safe_partner_id=safe_partner).update(
+        through=Greatest(F("through"), Value(before)),
+        rows=F("rows") + rows,
+        **{field: F(field) + amount for field, amount in amounts.items()},
+    )
+    if not updated:
+        CarryForward.objects.create(
+            safe_partner_id=safe_partner, through=before, rows=rows, **amounts
+        )
@@ -0,0 +1,346 @@
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DatabaseError, connections
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from .authentication import authenticate_jwt, redeem_stream_ticket
+from .db_routers import replica_reads
+from .events import ready_events
+from .models import ChangeEvent, Partner
+from .renderers import FastJSONRenderer
+from .reports import (
+    bonus_querysets,
+    bonus_response,
+    get_today_range,
+    partner_report_querysets,
+    partner_report_response,
+    pending_total_querysets,
+    pending_total_response,
+    report_date_filter,
+)
+
+# *************************
+# Change feed (Server-Sent Events)
+# *************************
+SSE_BATCH_SIZE = 200
+# Batches a stream may fall behind the shared poller before it is dropped.
+SSE_FEED_BACKLOG = 100
+
+logger = logging.getLogger("api.events")
+
+
+def _sse_message(event):
+    data = json.dumps(
+        {"id": event.object_id, "action": event.action, **event.payload},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return f"id: {event.pk}\nevent: {event.topic}\ndata: {data}\n\n"
+
+
+async def _latest_event_id():
+    latest = await ChangeEvent.objects.order_by("-pk").only("pk").afirst()
+    return latest.pk if latest else 0
+
+
+async def _next_events(last_id):
+    """Up to SSE_BATCH_SIZE committed events after ``last_id``, all topics."""
+    queryset = ChangeEvent.objects.filter(pk__gt=last_id).order_by("pk")
+    return ready_events([event async for event in queryset[:SSE_BATCH_SIZE]], last_id)
+
+
+def _sse_messages(events, topics):
+    return "".join(
+        _sse_message(event) for event in events if not topics or event.topic in topics
+    )
+
+
+def _retry_line():
+    return f"retry: {int(getattr(settings, 'SSE_RETRY_MS', 3000))}\n\n"
+
+
+class _Feed:
+    """One open stream's view of the shared poller: batches of events."""
+
+    def __init__(self, start):
+        # Poller position at subscription; earlier events come from the log.
+        self.start = start
+        self.batches = asyncio.Queue(maxsize=SSE_FEED_BACKLOG)
+        # Set when the stream fell SSE_FEED_BACKLOG batches behind and was
+        # dropped; it ends, and the client resumes from Last-Event-ID.
+        self.lagging = False
+
+
+class _EventBroadcaster:
+    """
+    The single poll loop of a process: reads the event log every
+    SSE_POLL_INTERVAL and hands each batch to every open stream, so the
+    database sees one query per interval however many clients listen.
+    Runs only while there are streams.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.feeds = set()
+        self.last_id = None
+        self.task = None
+
+    async def subscribe(self):
+        if self.last_id is None:
+            latest = await _latest_event_id()
+            if self.last_id is None:
+                self.last_id = latest
+        feed = _Feed(self.last_id)
+        self.feeds.add(feed)
+        if self.task is None or self.task.done():
+            self.task = self.loop.create_task(self._poll())
+        return feed
+
+    def unsubscribe(self, feed):
+        self.feeds.discard(feed)
+
+    async def _poll(self):
+        poll_interval = getattr(settings, "SSE_POLL_INTERVAL", 1.0)
+        while self.feeds:
+            try:
+                events = await _next_events(self.last_id)
+            except DatabaseError:
+                logger.warning("Change feed poll failed", exc_info=True)
+                events = []
+            if events:
+                self.last_id = events[-1].pk
+                for feed in list(self.feeds):
+                    try:
+                        feed.batches.put_nowait(events)
+                    except asyncio.QueueFull:
+                        feed.lagging = True
+                        self.feeds.discard(feed)
+            if len(events) < SSE_BATCH_SIZE:
+                await asyncio.sleep(poll_interval)
+        # Idle: the next subscriber starts again from the end of the log.
+        self.last_id = None
+
+
+_broadcaster = None
+
+
+def _event_broadcaster():
+    global _broadcaster
+    loop = asyncio.get_running_loop()
+    if _broadcaster is None or _broadcaster.loop is not loop:
+        _broadcaster = _EventBroadcaster(loop)
+    return _broadcaster
+
+
+async def _logged_events(last_id, end):
+    """Up to SSE_BATCH_SIZE events after ``last_id``, up to ``end``."""
+    queryset = ChangeEvent.objects.filter(pk__gt=last_id, pk__lte=end).order_by("pk")
+    return [event async for event in queryset[:SSE_BATCH_SIZE]]
+
+
+async def _event_stream(last_id, topics):
+    heartbeat_interval = getattr(settings, "SSE_HEARTBEAT_INTERVAL", 15.0)
+
+    yield _retry_line()
+    broadcaster = _event_broadcaster()
+    feed = await broadcaster.subscribe()
+    try:
+        # Catch up from the log to where the poller stood when we joined;
+        # the poller has already settled those ids.
+        while last_id < feed.start:
+            events = await _logged_events(last_id, feed.start)
+            messages = _sse_messages(events, topics)
+            if messages:
+                yield messages
+            if len(events) < SSE_BATCH_SIZE:
+                last_id = feed.start
+            else:
+                last_id = events[-1].pk
+
+        last_beat = time.monotonic()
+        while not (feed.lagging and feed.batches.empty()):
+            timeout = max(heartbeat_interval - (time.monotonic() - last_beat), 0)
+            try:
+                events = await asyncio.wait_for(feed.batches.get(), timeout)
+            except asyncio.TimeoutError:
+                # Comment line: keeps proxies from closing an idle connection.
+                yield ": ping\n\n"
+                last_beat = time.monotonic()
+                continue
+            events = [event for event in events if event.pk > last_id]
+            messages = _sse_messages(events, topics)
+            if events:
+                last_id = events[-1].pk
+            if messages:
+                yield messages
+                last_beat = time.monotonic()
+    finally:
+        broadcaster.unsubscribe(feed)
+
+
+async def _event_batch(last_id, topics):
+    """
+    One batch and the end of the response, for WSGI workers: an endless
+    stream would hold a sync worker for good. EventSource reconnects after
+    the ``retry`` delay with Last-Event-ID, which turns the feed into polling.
+    """
+    events = await _next_events(last_id)
+    body = _retry_line() + _sse_messages(events, topics)
+    if events:
+        # An id-only block moves Last-Event-ID past events of other topics.
+        body += f"id: {events[-1].pk}\n\n"
+    return body
+
+
+async def change_events(request):
+    """
+    ``GET /api/events/`` — text/event-stream of committed changes to
+    transactions and SafePartner balances.
+
+    Each message has ``id`` (event log id), ``event`` (topic, e.g.
+    ``incomingmoney``) and a JSON ``data`` line. Reconnecting clients send
+    ``Last-Event-ID`` (EventSource does this automatically) and receive
+    everything after it; new clients start from the current end of the log.
+    ``?topics=incomingmoney,safepartner`` narrows the feed. Served by a
+    WSGI worker, the response ends after one batch (see ``_event_batch``).
+
+    Authenticate with an ``Authorization: Bearer`` header or, from
+    EventSource, with ``?ticket=`` from ``POST /api/events/ticket/``; a
+    ticket opens one stream, so reconnects need a new one.
+    """
+    if request.GET.get("ticket"):
+        user = await sync_to_async(redeem_stream_ticket)(request.GET["ticket"])
+    else:
+        user = await sync_to_async(authenticate_jwt)(request)
+    if user is None or not user.is_active:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."}, status=401
+        )
+
+    last_id = request.headers.get("Last-Event-ID") or request.GET.get("last_event_id")
+    try:
+        last_id = int(last_id) if last_id else await _latest_event_id()
+    except ValueError:
+        return JsonResponse({"error": "Last-Event-ID must be an integer"}, status=400)
+
+    topics = [t for t in request.GET.get("topics", "").split(",") if t]
+
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(
+            _event_stream(last_id, topics), content_type="text/event-stream"
+        )
+    else:
+        response = HttpResponse(
+            await _event_batch(last_id, topics), content_type="text/event-stream"
+        )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+# *************************
+# Reports (concurrent queries)
+# *************************
+# Async twins of the report views in api.views, mounted under /api/async/.
+# The independent queries of a report run at the same time, each on one of
+# ASYNC_QUERY_THREADS long-lived threads with its own database connection,
+# so the response takes about as long as the slowest query rather than the
+# sum of all of them. A thread keeps its connection between queries and is
+# closed like a request's: when broken or older than CONN_MAX_AGE.
+_query_pool = None
+
+
+def _query_executor():
+    global _query_pool
+    if _query_pool is None:
+        _query_pool = ThreadPoolExecutor(
+            max_workers=getattr(settings, "ASYNC_QUERY_THREADS", 4),
+            thread_name_prefix="api-query",
+        )
+    return _query_pool
+
+
+def _fetch(queryset):
+    connections[queryset.db].close_if_unusable_or_obsolete()
+    return list(queryset)
+
+
+async def gather_querysets(querysets):
+    loop = asyncio.get_running_loop()
+    executor = _query_executor()
+    # Each query runs in a copy of the request's context, so the replica
+    # routing and the request timings (api.instrumentation) reach the pool.
+    results = await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                executor, contextvars.copy_context().run, _fetch, queryset
+            )
+            for queryset in querysets.values()
+        )
+    )
+    return dict(zip(querysets, results))
+
+
+def _json_response(data, status=200):
+    # Same renderer as the DRF views, so both variants return identical bytes.
+    return HttpResponse(
+        FastJSONRenderer().render(data),
+        status=status,
+        content_type="application/json",
+    )
+
+
+async def _authenticated(request):
+    user = await sync_to_async(authenticate_jwt)(request)
+    return user is not None and user.is_active
+
+
+def _unauthorized():
+    return _json_response(
+        {"detail": "Authentication credentials were not provided."}, status=401
+    )
+
+
+@replica_reads
+async def today_bonus(request):
+    if not await _authenticated(request):
+        return _unauthorized()
+    start, end = get_today_range()
+    results = await gather_querysets(bonus_querysets(start, end))
+    return _json_response(bonus_response(results))
+
+
+@replica_reads
+async def month_bonus(request):
+    if not await _authenticated(request):
+        return _unauthorized()
+    start, end = get_today_range()
+    results = await gather_querysets(bonus_querysets(start, end))
+    return _json_response(bonus_response(results))
+
+
+@replica_reads
+async def partner_report(request, pk):
+    if not await _authenticated(request):
+        return _unauthorized()
+    try:
+        partner = await Partner.objects.aget(id=pk)
+    except Partner.DoesNotExist:
+        return _json_response({"error": "Partner not found"}, status=404)
+
+    date_filter = report_date_filter(request.GET.get("start"), request.GET.get("end"))
+    querysets = partner_report_querysets(partner.name, date_filter)
+    results = await gather_querysets(querysets)
+    return _json_response(partner_report_response(partner, results))
+
+
+@replica_reads
+async def pending_total(request):
+    results = await gather_querysets(pending_total_querysets())
+    return _json_response(pending_total_response(results))
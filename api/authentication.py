@@ -0,0 +1,66 @@
+import secrets
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from .models import StreamTicket
+
+
+def authenticate_jwt(request):
+    """
+    Resolve the user of a plain Django request from the access token in its
+    ``Authorization: Bearer`` header. Returns None when the token is missing
+    or invalid. Hits the database: call it through ``sync_to_async`` from
+    async views.
+    """
+    auth = JWTAuthentication()
+    header = auth.get_header(request)
+    raw_token = auth.get_raw_token(header) if header is not None else None
+    if not raw_token:
+        return None
+    try:
+        return auth.get_user(auth.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+# -----------------------------
+# Stream tickets
+# -----------------------------
+def issue_stream_ticket(user):
+    """
+    A new ticket for ``user`` to open the /events/ stream with, valid once
+    and for SSE_TICKET_TTL seconds. Clears out expired tickets on the way.
+    """
+    now = timezone.now()
+    StreamTicket.objects.filter(expires_at__lte=now).delete()
+    ttl = getattr(settings, "SSE_TICKET_TTL", 30)
+    ticket = StreamTicket.objects.create(
+        key=secrets.token_urlsafe(32),
+        user=user,
+        expires_at=now + timedelta(seconds=ttl),
+    )
+    return ticket.key
+
+
+def redeem_stream_ticket(key):
+    """
+    The active user ``key`` was issued to, or None when it is unknown,
+    expired or already used. Whoever deletes the row wins, so a ticket
+    opens one stream even when two requests race for it.
+    """
+    if not key:
+        return None
+    ticket = (
+        StreamTicket.objects.select_related("user")
+        .filter(key=key, expires_at__gt=timezone.now())
+        .first()
+    )
+    if ticket is None:
+        return None
+    deleted, _ = StreamTicket.objects.filter(pk=ticket.pk).delete()
+    if not deleted or not ticket.user.is_active:
+        return None
+    return ticket.user
@@ -0,0 +1,123 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework import serializers
+from .models import Partner, SafeType
+from .versions import model_label, version_token
+
+# Small, rarely changing tables that are cached whole. Entries are keyed on
+# the model's DataVersion token (api.versions), so a per-process cache
+# (LocMem) never serves rows another worker has changed. The token is read
+# once per request (api.middleware.DataVersionMiddleware).
+REFERENCE_MODELS = (SafeType, Partner)
+
+
+def reference_cache():
+    return caches[getattr(settings, "REFERENCE_CACHE_ALIAS", "default")]
+
+
+def _rows_key(model, token):
+    return f"ref:{model._meta.label_lower}:rows:{token}"
+
+
+class _Changed:
+    """on_commit marker: the open transaction has written ``label``'s rows."""
+
+    def __init__(self, label):
+        self.label = label
+        self.committed = False
+
+    def __call__(self):
+        self.committed = True
+
+
+def _changed_in_transaction(model):
+    # Django drops the on_commit callbacks of rolled back (savepoint)
+    # transactions, so the marker lives exactly as long as the writes.
+    connection = transaction.get_connection(DEFAULT_DB_ALIAS)
+    if not connection.in_atomic_block:
+        return False
+    label = model_label(model)
+    return any(
+        isinstance(func, _Changed) and func.label == label and not func.committed
+        for _, func, _ in connection.run_on_commit
+    )
+
+
+def _load_rows(model):
+    # Always from the primary: a lagging replica would be cached as current.
+    queryset = model.objects.using(DEFAULT_DB_ALIAS).order_by("pk")
+    return {obj.pk: obj for obj in queryset}
+
+
+# -----------------------------
+# Lookups
+# -----------------------------
+def get_rows(model):
+    """Return ``{pk: instance}`` for a reference model, ordered by pk."""
+    if _changed_in_transaction(model):
+        # Uncommitted rows: read them, but do not cache what may roll back.
+        return _load_rows(model)
+    key = _rows_key(model, version_token([model]))
+    rows = reference_cache().get(key)
+    if rows is None:
+        rows = _load_rows(model)
+        reference_cache().set(key, rows)
+    return rows
+
+
+def get_row(model, pk):
+    return get_rows(model).get(pk)
+
+
+def get_system_owner():
+    """Cached equivalent of ``Partner.objects.get(is_system_owner=True)``."""
+    owners = [p for p in get_rows(Partner).values() if p.is_system_owner]
+    if not owners:
+        raise Partner.DoesNotExist("No partner is marked as system owner.")
+    if len(owners) > 1:
+        raise Partner.MultipleObjectsReturned(
+            "More than one partner is marked as system owner."
+        )
+    return owners[0]
+
+
+# -----------------------------
+# Invalidation
+# -----------------------------
+def invalidate_rows(model):
+    """
+    Serve ``model`` from the database for the rest of the current
+    transaction. The version bump on commit moves every process, this one
+    included, to a new cache key; outside a transaction it already has.
+    """
+    if transaction.get_connection(DEFAULT_DB_ALIAS).in_atomic_block:
+        if not _changed_in_transaction(model):
+            transaction.on_commit(_Changed(model_label(model)))
+
+
+# -----------------------------
+# Serializer field
+# -----------------------------
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField that resolves SafeType/Partner ids from the
+    versioned reference cache. Ids it does not hold, and every other model,
+    fall back to the normal database lookup.
+    """
+
+    def to_internal_value(self, data):
+        queryset = self.get_queryset()
+        if (
+            queryset.model in REFERENCE_MODELS
+            and not queryset.query.has_filters()
+            and self.pk_field is None
+            and not isinstance(data, bool)
+        ):
+            try:
+                obj = get_row(queryset.model, int(data))
+            except (TypeError, ValueError):
+                obj = None
+            if obj is not None:
+                return obj
+        return super().to_internal_value(data)
@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+
+# Alias that reads are routed to for the current request (None = default).
+# Set by api.middleware.ReplicaRoutingMiddleware for replica-safe views.
+_read_alias = ContextVar("read_alias", default=None)
+
+
+def replica_alias():
+    """The configured replica alias, or None when no replica is set up."""
+    alias = getattr(settings, "REPLICA_DATABASE_ALIAS", "replica")
+    return alias if alias in connections.databases else None
+
+
+def current_read_alias():
+    return _read_alias.get()
+
+
+@contextmanager
+def read_from(alias):
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def replica_reads(view):
+    """Mark a function view (sync or async) as safe to serve from the replica."""
+    view.replica_reads = True
+    return view
+
+
+class ReplicaRouter:
+    """
+    Send reads to the replica only inside ``read_from(<replica>)``; every
+    write, and every read outside that context, goes to ``default``.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replica rows are the same rows as on the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == replica_alias():
+            return False
+        return None
@@ -0,0 +1,108 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import (
+    ChangeEvent,
+    CryptoTransaction,
+    IncomingMoney,
+    OutgoingMoney,
+    SafePartner,
+    SafeTransaction,
+)
+
+# Fields copied into each event; enough for a screen to patch its rows or
+# decide to refetch, without re-serializing the nested representation.
+EVENT_FIELDS = {
+    CryptoTransaction: (
+        "transaction_type",
+        "status",
+        "usdt_amount",
+        "usdt_price",
+        "currency",
+        "partner_id",
+        "partner_client_id",
+    ),
+    IncomingMoney: (
+        "status",
+        "money_amount",
+        "currency",
+        "from_partner_id",
+        "to_partner_id",
+    ),
+    OutgoingMoney: (
+        "status",
+        "money_amount",
+        "currency",
+        "from_partner_id",
+        "to_partner_id",
+    ),
+    SafeTransaction: (
+        "transaction_type",
+        "money_amount",
+        "currency",
+        "partner_id",
+        "from_safepartner_id",
+        "to_safepartner_id",
+    ),
+    SafePartner: (
+        "partner_id",
+        "safe_type_id",
+        "total_usd",
+        "total_usdt",
+        "total_iqd",
+    ),
+}
+
+
+def topic_for(model):
+    return model._meta.model_name
+
+
+def _event(instance, action):
+    model = type(instance)
+    return ChangeEvent(
+        topic=topic_for(model),
+        action=action,
+        object_id=instance.pk,
+        payload={name: getattr(instance, name) for name in EVENT_FIELDS[model]},
+    )
+
+
+def emit_event(instance, action):
+    """Record a change event for ``instance`` once the transaction commits."""
+    transaction.on_commit(_event(instance, action).save)
+
+
+def emit_events(instances, action):
+    """``emit_event`` for many rows, written in one INSERT."""
+    events = [_event(instance, action) for instance in instances]
+    if events:
+        transaction.on_commit(lambda: ChangeEvent.objects.bulk_create(events))
+
+
+def ready_events(events, last_id):
+    """
+    The leading run of ``events`` (all topics, ordered by pk, after
+    ``last_id``) that is safe to send. Ids are taken at INSERT but become
+    visible at COMMIT, so a missing id may belong to an event that is still
+    committing: stop before it until the event after it is older than
+    SSE_COMMIT_WINDOW, then take the gap for a rollback and move on.
+    """
+    window = timedelta(seconds=getattr(settings, "SSE_COMMIT_WINDOW", 5.0))
+    settled = timezone.now() - window
+    ready = []
+    for event in events:
+        if event.pk != last_id + 1 and event.created_at > settled:
+            break
+        ready.append(event)
+        last_id = event.pk
+    return ready
+
+
+def prune_events(older_than=timedelta(hours=24)):
+    """Delete events older than ``older_than``; returns the number removed."""
+    cutoff = timezone.now() - older_than
+    deleted, _ = ChangeEvent.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
@@ -0,0 +1,82 @@
+from rest_framework import serializers
+
+# Fields whose to_representation() is the identity for the values the
+# database driver returns, so the row builder can copy them as-is.
+_PASSTHROUGH_FIELDS = (
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.BooleanField,
+    serializers.IntegerField,
+)
+
+
+class ValuesRowBuilder:
+    """
+    Build serializer-shaped dicts from a single ``values_list()`` query.
+
+    The plan is compiled from a (Get) serializer instance: plain model
+    fields become one column each, nested ModelSerializers become joined
+    ``relation__field`` columns, and PrimaryKeyRelatedFields read the FK
+    column. Values are converted with the serializer fields' own
+    ``to_representation`` so the output is identical to ``serializer.data``
+    without instantiating models or serializers per row.
+    """
+
+    def __init__(self, serializer):
+        self.lookups = []
+        self.plan = self._compile(serializer.fields, "")
+
+    def _column(self, lookup):
+        self.lookups.append(lookup)
+        return len(self.lookups) - 1
+
+    def _compile(self, fields, prefix):
+        plan = []
+        for name, field in fields.items():
+            if field.write_only:
+                continue
+            source = field.source
+            if source == "*" or "." in source:
+                raise TypeError(f"{name!r}: dotted or '*' sources are not supported")
+
+            if isinstance(field, serializers.ModelSerializer):
+                pk_name = field.Meta.model._meta.pk.name
+                null_column = self._column(f"{prefix}{source}__{pk_name}")
+                children = self._compile(field.fields, f"{prefix}{source}__")
+                plan.append((name, null_column, None, children))
+            elif isinstance(field, serializers.PrimaryKeyRelatedField):
+                plan.append((name, self._column(prefix + source), None, None))
+            elif isinstance(field, (serializers.BaseSerializer, serializers.RelatedField)):
+                raise TypeError(f"{name!r}: {type(field).__name__} is not supported")
+            elif isinstance(field, serializers.SerializerMethodField):
+                raise TypeError(f"{name!r}: SerializerMethodField is not supported")
+            else:
+                convert = (
+                    None
+                    if isinstance(field, _PASSTHROUGH_FIELDS)
+                    else field.to_representation
+                )
+                plan.append((name, self._column(prefix + source), convert, None))
+        return plan
+
+    def values(self, queryset):
+        """Return the ``values_list`` queryset to paginate and pass to build()."""
+        return queryset.values_list(*self.lookups)
+
+    def build(self, rows):
+        plan = self.plan
+        return [self._build_row(plan, row) for row in rows]
+
+    def _build_row(self, plan, row):
+        out = {}
+        for name, column, convert, children in plan:
+            value = row[column]
+            if value is None:
+                out[name] = None
+            elif children is not None:
+                out[name] = self._build_row(children, row)
+            elif convert is None:
+                out[name] = value
+            else:
+                out[name] = convert(value)
+        return out
@@ -0,0 +1,113 @@
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http.request import RawPostDataException
+from django.utils import timezone
+from .models import IdempotencyKey
+from .renderers import FastJSONRenderer
+
+# Idempotency-Key support for the transaction write endpoints (see
+# api.mixins.IdempotencyMixin). The first request with a key claims it and
+# stores its response; a retry with the same key reads that row back (one
+# SELECT) instead of running the view, so the balance signals run once.
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+# A claimed key whose request never finished (worker killed mid-request;
+# its transaction rolled back) may be claimed again after this long.
+STALE_AFTER = timedelta(minutes=5)
+
+
+def key_ttl():
+    return timedelta(hours=getattr(settings, "IDEMPOTENCY_KEY_TTL_HOURS", 24))
+
+
+def request_scope(request):
+    """Keys are per user; anonymous clients share one scope."""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    return "anonymous"
+
+
+def fingerprint(request):
+    """SHA-256 of method, path and body; catches a key reused for another request."""
+    try:
+        body = request.body
+    except RawPostDataException:
+        body = json.dumps(request.data, sort_keys=True, default=str).encode()
+    digest = hashlib.sha256()
+    for part in (request.method.encode(), request.get_full_path().encode(), body):
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def claim(request, key):
+    """
+    Return ``(record, True)`` when this request claimed ``key`` and should
+    run, or ``(record, False)`` with the existing record otherwise.
+    """
+    scope = request_scope(request)
+    now = timezone.now()
+    values = {
+        "method": request.method,
+        "path": request.path[:255],
+        "fingerprint": fingerprint(request),
+        "response_status": None,
+        "response_body": None,
+        "expires_at": now + key_ttl(),
+    }
+    record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+    if record is None:
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(scope=scope, key=key, **values)
+            return record, True
+        except IntegrityError:
+            # A concurrent request claimed it first.
+            record = IdempotencyKey.objects.get(scope=scope, key=key)
+
+    abandoned = record.response_status is None and record.created_at < now - STALE_AFTER
+    if record.expires_at <= now or abandoned:
+        # Reuse the row; of several concurrent retries only one matches.
+        taken = IdempotencyKey.objects.filter(
+            pk=record.pk, created_at=record.created_at
+        ).update(created_at=now, **values)
+        if taken:
+            for field, value in values.items():
+                setattr(record, field, value)
+            record.created_at = now
+            return record, True
+        record.refresh_from_db()
+    return record, False
+
+
+def finish(record, response):
+    """Store the response a retry will get back."""
+    body = None
+    if response.data is not None:
+        body = FastJSONRenderer().render(response.data).decode()
+    IdempotencyKey.objects.filter(pk=record.pk).update(
+        response_status=response.status_code, response_body=body
+    )
+
+
+def stored_data(record):
+    """The stored response data, keys in their original order."""
+    if record.response_body is None:
+        return None
+    return json.loads(record.response_body)
+
+
+def release(record):
+    """Forget a claim whose request failed, so the client can retry it."""
+    IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+
+
+def prune_keys():
+    """Delete expired keys; returns the number removed."""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
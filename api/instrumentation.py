@@ -0,0 +1,142 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver as django_receiver
+
+# Timings of the request being served; None outside of
+# api.middleware.RequestTimingMiddleware (management commands, shell).
+_current = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """Counters collected for one request. Durations are in seconds."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.view_name = "unmatched"
+        self.action = ""
+        self.view_finished = None
+        self.queries = 0
+        self.sql = 0.0
+        self.signals = 0.0
+        self.signal_sql = 0.0
+        self.render = 0.0
+        self._signal_depth = 0
+        # Async reports run their queries on several threads at once.
+        self._lock = threading.Lock()
+
+    def as_dict(self, total):
+        view = 0.0
+        if self.view_started is not None:
+            view = (self.view_finished or self.started + total) - self.view_started
+        return {
+            "queries": self.queries,
+            "db": self.sql,
+            "signals": self.signals,
+            # Derived, not measured: view time minus SQL and signal time,
+            # i.e. serializer validation/to_representation and the view
+            # logic itself. ``signals`` includes the SQL the handlers ran.
+            "serialize": max(
+                view - self.sql - (self.signals - self.signal_sql), 0.0
+            ),
+            "render": self.render,
+            "total": total,
+        }
+
+
+def current_timings():
+    return _current.get()
+
+
+@contextmanager
+def collect_timings():
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+# -----------------------------
+# SQL
+# -----------------------------
+def _record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        with timings._lock:
+            timings.sql += elapsed
+            timings.queries += 1
+            if timings._signal_depth:
+                timings.signal_sql += elapsed
+
+
+@django_receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    # Connections are per thread, so hook each one as it opens; the wrapper
+    # is a no-op unless a request is being timed.
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+# -----------------------------
+# Signal handlers
+# -----------------------------
+def timed_handler(func):
+    """Count ``func``'s run time as signal time (outermost handler only)."""
+    if getattr(func, "_timed_handler", False):
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        timings = _current.get()
+        if timings is None:
+            return func(*args, **kwargs)
+        timings._signal_depth += 1
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings._signal_depth -= 1
+            # Handlers save models that fire further handlers; count the
+            # nested ones only through their outermost caller.
+            if timings._signal_depth == 0:
+                timings.signals += time.perf_counter() - start
+
+    wrapper._timed_handler = True
+    return wrapper
+
+
+def receiver(signal, **kwargs):
+    """``django.dispatch.receiver`` that times the handler it connects."""
+
+    def decorator(func):
+        return django_receiver(signal, **kwargs)(timed_handler(func))
+
+    return decorator
+
+
+# -----------------------------
+# Rendering
+# -----------------------------
+@contextmanager
+def track_render():
+    timings = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            if timings.view_finished is None:
+                timings.view_finished = start
+            timings.render += time.perf_counter() - start
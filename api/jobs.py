@@ -0,0 +1,285 @@
+import json
+import logging
+import threading
+import traceback
+import uuid
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.http import HttpRequest, QueryDict
+from django.utils import timezone
+from rest_framework.request import Request
+from .models import Job, Partner
+
+# A job queue in the application database, no broker: views and commands
+# enqueue() rows into Job and the run_jobs command claims and runs them.
+# On PostgreSQL workers claim with SELECT ... FOR UPDATE SKIP LOCKED; on
+# other databases with a compare-and-set on the status. A running job's
+# worker refreshes heartbeat_at; jobs whose heartbeat went quiet are given
+# back by requeue_stale(). Tasks are plain functions registered with @task;
+# their keyword arguments and return value must be JSON.
+
+logger = logging.getLogger("api.jobs")
+
+TASKS = {}
+# Task name -> who may enqueue it through /api/jobs/: "user" or "staff".
+API_TASKS = {}
+
+
+def task(name, api=None):
+    def register(func):
+        TASKS[name] = func
+        if api:
+            API_TASKS[name] = api
+        return func
+
+    return register
+
+
+def output_dir():
+    return Path(getattr(settings, "JOB_OUTPUT_DIR", None) or settings.BASE_DIR / "jobs")
+
+
+def enqueue(name, kwargs=None, priority=0, delay=None, max_attempts=3, user=None):
+    if name not in TASKS:
+        raise ValueError(f"Unknown task {name!r}.")
+    return Job.objects.create(
+        task=name,
+        kwargs=kwargs or {},
+        priority=priority,
+        max_attempts=max_attempts,
+        run_after=timezone.now() + (delay or timedelta()),
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+
+
+# -----------------------------
+# Worker side
+# -----------------------------
+def claim(worker):
+    """Mark the next due job as running by ``worker`` and return it, or None."""
+    now = timezone.now()
+    due = Job.objects.filter(status="queued", run_after__lte=now).order_by(
+        "-priority", "run_after", "pk"
+    )
+    running = {
+        "status": "running",
+        "locked_by": worker,
+        "started_at": now,
+        "heartbeat_at": now,
+        "attempts": F("attempts") + 1,
+    }
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            pk = (
+                due.select_for_update(skip_locked=True)
+                .values_list("pk", flat=True)
+                .first()
+            )
+            if pk is None:
+                return None
+            Job.objects.filter(pk=pk).update(**running)
+        return Job.objects.get(pk=pk)
+    for pk in due.values_list("pk", flat=True)[:10]:
+        if Job.objects.filter(pk=pk, status="queued").update(**running):
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def retry_delay(attempts):
+    base = getattr(settings, "JOB_RETRY_DELAY_SECONDS", 30)
+    return timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def _claimed(job):
+    """The job's row while it is still this claim's: same worker and attempt."""
+    return Job.objects.filter(
+        pk=job.pk, status="running", locked_by=job.locked_by, attempts=job.attempts
+    )
+
+
+class Heartbeat:
+    """
+    Refresh the job's heartbeat_at every JOB_HEARTBEAT_SECONDS from a side
+    thread while the task runs, so requeue_stale() can tell a long job from
+    a dead worker.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.beat, daemon=True)
+
+    def beat(self):
+        interval = getattr(settings, "JOB_HEARTBEAT_SECONDS", 30)
+        try:
+            while not self.stopped.wait(interval):
+                if not _claimed(self.job).update(heartbeat_at=timezone.now()):
+                    return  # given back meanwhile; the final write will notice
+        finally:
+            # Only this thread's connection.
+            connections.close_all()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+def _finish(job, **fields):
+    if not _claimed(job).update(**fields):
+        logger.warning(
+            "Job %s (%s) was given back before attempt %s finished; "
+            "its outcome is dropped",
+            job.pk,
+            job.task,
+            job.attempts,
+        )
+        return False
+    return True
+
+
+def run(job):
+    """Run a claimed job and record its outcome; True if it succeeded."""
+    func = TASKS.get(job.task)
+    try:
+        if func is None:
+            raise LookupError(f"Unknown task {job.task!r}.")
+        with Heartbeat(job):
+            result = func(**job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if func is not None and job.attempts < job.max_attempts:
+            _finish(
+                job,
+                status="queued",
+                error=error,
+                locked_by="",
+                run_after=now + retry_delay(job.attempts),
+            )
+        else:
+            _finish(job, status="failed", error=error, finished_at=now)
+        logger.warning("Job %s (%s) failed, attempt %s", job.pk, job.task, job.attempts)
+        return False
+    return _finish(
+        job,
+        status="done",
+        result=json.loads(json.dumps(result, cls=DjangoJSONEncoder)),
+        error="",
+        finished_at=timezone.now(),
+    )
+
+
+def requeue_stale():
+    """
+    Give back jobs whose worker died: running without a heartbeat for
+    JOB_STALE_SECONDS. Returns the number of jobs touched.
+    """
+    stale_after = timedelta(seconds=getattr(settings, "JOB_STALE_SECONDS", 120))
+    cutoff = timezone.now() - stale_after
+    stale = Job.objects.alias(
+        last_seen=Coalesce("heartbeat_at", "started_at")
+    ).filter(status="running", last_seen__lt=cutoff)
+    error = "The worker stopped responding."
+    failed = stale.filter(attempts__gte=F("max_attempts")).update(
+        status="failed", error=error, finished_at=timezone.now()
+    )
+    retried = stale.update(status="queued", error=error, locked_by="")
+    return failed + retried
+
+
+# -----------------------------
+# Tasks
+# -----------------------------
+@task("reconcile", api="staff")
+def reconcile_balances():
+    from .ledger import reconcile
+
+    mismatches = reconcile()
+    return {
+        "mismatches": len(mismatches),
+        "safe_partners": [safe_partner.pk for safe_partner, _, _ in mismatches],
+    }
+
+
+@task("archive_transactions", api="staff")
+def archive_transactions(before, batch_size=2000):
+    from .archive import archive
+
+    cutoff = timezone.make_aware(datetime.combine(date.fromisoformat(before), time.min))
+    return dict(archive(cutoff, batch_size=batch_size))
+
+
+@task("prune_change_events")
+def prune_change_events(hours=None):
+    from .events import prune_events
+
+    if hours is None:
+        hours = getattr(settings, "CHANGE_EVENT_RETENTION_HOURS", 24)
+    return {"deleted": prune_events(timedelta(hours=hours))}
+
+
+@task("prune_idempotency_keys")
+def prune_idempotency_keys():
+    from .idempotency import prune_keys
+
+    return {"deleted": prune_keys()}
+
+
+@task("partner_statements", api="staff")
+def partner_statements(month=None):
+    """Store every partner's statement of ``month`` (default: last month)."""
+    from .partitions import add_months
+    from .statements import current_month, generate_statements, parse_month
+
+    month = parse_month(month) if month else add_months(current_month(), -1)
+    if month is None:
+        raise ValueError("month must be YYYY-MM.")
+    built = generate_statements(month, Partner.objects.order_by("pk"))
+    return {"month": f"{month:%Y-%m}", "built": built}
+
+
+@task("export", api="user")
+def export(basename, query="", export_format="csv"):
+    """
+    The ``export`` action of the viewset registered as ``basename``, with
+    the list filters of ``query``, written to a file in JOB_OUTPUT_DIR.
+    """
+    from .exports import EXPORT_FORMATS
+    from .urls import router  # api.urls imports the views, which import this
+
+    viewset = next(
+        (viewset for _, viewset, name in router.registry if name == basename), None
+    )
+    if not getattr(viewset, "export_columns", None):
+        raise ValueError(f"{basename!r} has no export.")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format!r}.")
+
+    http_request = HttpRequest()
+    http_request.method = "GET"
+    http_request.GET = QueryDict(query)
+    view = viewset(
+        request=Request(http_request), action="list", format_kwarg=None, kwargs={}
+    )
+    queryset = view.filter_queryset(view.get_queryset())
+    stream, _ = EXPORT_FORMATS[export_format]
+
+    directory = output_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    name = (
+        f"{basename}-{timezone.localdate().isoformat()}-"
+        f"{uuid.uuid4().hex[:8]}.{export_format}"
+    )
+    with open(directory / name, "wb") as output:
+        for chunk in stream(queryset, view.export_columns, view.export_chunk_size):
+            output.write(chunk)
+    return {"file": name, "bytes": (directory / name).stat().st_size}
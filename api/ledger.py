@@ -0,0 +1,262 @@
+from collections import defaultdict
+from decimal import Decimal
+from .models import (
+    CarryForward,
+    CryptoTransaction,
+    Debt,
+    DebtRepayment,
+    IncomingMoney,
+    OutgoingMoney,
+    Partner,
+    SafePartner,
+    SafeTransaction,
+    TransferExchange,
+)
+
+# Pure re-statement of the balance effects api.signals applies when a row is
+# created in its final state. Used to give bulk-created data (seed_dataset)
+# the balances the signal handlers would have produced, and to reconcile
+# SafePartner balances against the transaction tables.
+#
+# A posting is ``(safe_partner_id, currency, amount)``. A cross-currency debt
+# repayment splits on what the debt's earlier repayments left to pay, so its
+# postings read ``repaid_before`` (set by replay(), else queried).
+
+OWNER_CASH_SAFE = "قاسە"
+
+BALANCE_FIELDS = {"USD": "total_usd", "USDT": "total_usdt", "IQD": "total_iqd"}
+
+
+class OwnerSafes:
+    """The system owner's SafePartner ids, by safe type."""
+
+    def __init__(self, by_safe_type, cash_safe_type_id):
+        self.by_safe_type = by_safe_type
+        self.cash = by_safe_type.get(cash_safe_type_id)
+
+    @classmethod
+    def load(cls):
+        owner = Partner.objects.get(is_system_owner=True)
+        rows = SafePartner.objects.filter(partner=owner).values_list(
+            "safe_type_id", "pk", "safe_type__name"
+        )
+        by_safe_type = {safe_type_id: pk for safe_type_id, pk, _ in rows}
+        cash = next((st for st, _, name in rows if name == OWNER_CASH_SAFE), None)
+        return cls(by_safe_type, cash)
+
+    def safe(self, safe_type_id):
+        return self.by_safe_type.get(safe_type_id)
+
+
+# -----------------------------
+# Per-model postings
+# -----------------------------
+def _crypto(row, owner):
+    payment = owner.safe(row.payment_safe_id)
+    crypto = owner.safe(row.crypto_safe_id)
+    if payment is None or crypto is None:
+        return
+    sign = 1 if row.transaction_type == "Buy" else -1
+    yield crypto, "USDT", sign * row.usdt_amount
+
+    if row.status != "Completed":
+        if row.partner_client_id and row.currency in ("USD", "IQD"):
+            yield row.partner_client_id, row.currency, sign * row.usdt_price
+        return
+
+    if row.currency in ("USD", "IQD"):
+        yield payment, row.currency, -sign * row.usdt_price
+    if row.bonus:
+        partner_share = row.bonus / Decimal("2") if row.partner_id else Decimal("0")
+        owner_share = row.bonus - partner_share
+        owner_safe = crypto if row.bonus_currency == "USDT" else payment
+        yield owner_safe, row.bonus_currency, owner_share
+        if row.partner_id:
+            yield row.partner_id, row.bonus_currency, partner_share
+
+
+def _incoming(row, owner):
+    if row.from_partner_id:
+        yield row.from_partner_id, row.currency, -row.money_amount
+    if row.status != "Completed":
+        return
+    if not row.is_received and row.to_partner_id:
+        yield row.to_partner_id, row.currency, row.money_amount
+    yield owner.cash, row.bonus_currency, row.my_bonus
+    if row.from_partner_id:
+        yield row.from_partner_id, row.bonus_currency, row.partner_bonus
+
+
+def _outgoing(row, owner):
+    if not row.is_received:
+        yield row.to_partner_id, row.currency, row.money_amount
+    if row.status != "Completed":
+        return
+    if row.from_partner_id:
+        yield row.from_partner_id, row.currency, -row.money_amount
+    yield owner.cash, row.bonus_currency, row.my_bonus
+    if not row.is_received:
+        yield row.to_partner_id, row.bonus_currency, row.partner_bonus
+
+
+def _safe_transaction(row, owner):
+    if row.transaction_type == "TRANSFER":
+        yield row.from_safepartner_id, row.currency, -row.money_amount
+        yield row.to_safepartner_id, row.currency, row.money_amount
+    elif row.transaction_type == "ADD":
+        yield row.partner_id, row.currency, row.money_amount
+    else:  # REMOVE, EXPENSE
+        yield row.partner_id, row.currency, -row.money_amount
+
+
+def _exchange(row, owner):
+    usd, iqd = Decimal(row.usd_amount), row.iqd_amount
+    if row.exchange_type == "USD_TO_IQD":
+        yield row.partner_id, "USD", -usd
+        yield row.partner_id, "IQD", iqd
+    elif row.exchange_type == "IQD_TO_USD":
+        yield row.partner_id, "IQD", -iqd
+        yield row.partner_id, "USD", usd
+    yield row.partner_id, row.bonus_currency, row.my_bonus
+
+
+def _debt(row, owner):
+    safe_partner = row.safe_partner_id or owner.safe(row.debt_safe_id)
+    if safe_partner:
+        yield safe_partner, row.currency, -row.total_amount
+
+
+def _stored(currency, amount):
+    # As the handler saves it: total_iqd truncates, the others keep cents.
+    if currency == "IQD":
+        return int(amount)
+    return amount.quantize(Decimal("0.01"))
+
+
+def _repaid_before(row):
+    """The debt's earlier repayments, in the debt's currency."""
+    if hasattr(row, "repaid_before"):
+        return row.repaid_before
+    earlier = DebtRepayment.objects.filter(debt_id=row.debt_id, pk__lt=row.pk)
+    return sum(
+        (r.converted_amount() for r in earlier.select_related("debt")), Decimal("0")
+    )
+
+
+def _repayment(row, owner):
+    debt = row.debt
+    if not debt.safe_partner_id:
+        return
+    if row.currency == debt.currency:
+        yield debt.safe_partner_id, row.currency, row.amount
+        return
+
+    debt_safe = owner.safe(debt.debt_safe_id)
+    repayment_safe = owner.safe(row.safe_type_id)
+    if debt_safe is None or repayment_safe is None:
+        return
+    converted = row.converted_amount(debt.currency)
+    remaining = max(Decimal("0"), debt.total_amount - _repaid_before(row))
+    normal = min(converted, remaining)
+    if row.currency == "IQD":
+        received = normal * row.conversion_rate
+    else:
+        received = normal / row.conversion_rate
+    yield debt.safe_partner_id, debt.currency, _stored(debt.currency, normal)
+    yield debt_safe, debt.currency, -_stored(debt.currency, normal)
+    yield repayment_safe, row.currency, _stored(row.currency, received)
+    if converted > remaining:
+        # The overpayment goes back to the debtor in the repayment currency.
+        if row.currency == "IQD":
+            extra = row.amount - received
+        else:
+            extra = row.amount - normal
+        yield debt.safe_partner_id, row.currency, _stored(row.currency, extra)
+
+
+POSTING_RULES = {
+    CryptoTransaction: _crypto,
+    IncomingMoney: _incoming,
+    OutgoingMoney: _outgoing,
+    SafeTransaction: _safe_transaction,
+    TransferExchange: _exchange,
+    Debt: _debt,
+    DebtRepayment: _repayment,
+}
+
+
+def postings(row, owner):
+    for safe_partner_id, currency, amount in POSTING_RULES[type(row)](row, owner):
+        if safe_partner_id and currency in BALANCE_FIELDS and amount:
+            yield safe_partner_id, currency, amount
+
+
+# -----------------------------
+# Balances
+# -----------------------------
+class Balances:
+    """Running ``{safe_partner_id: {field: amount}}`` totals."""
+
+    def __init__(self):
+        self.totals = defaultdict(lambda: defaultdict(Decimal))
+
+    def post(self, row, owner):
+        for safe_partner_id, currency, amount in postings(row, owner):
+            self.totals[safe_partner_id][BALANCE_FIELDS[currency]] += Decimal(amount)
+
+    def carry(self, carry_forward):
+        """Add the totals of archived rows (api.archive)."""
+        totals = self.totals[carry_forward.safe_partner_id]
+        for field in BALANCE_FIELDS.values():
+            totals[field] += Decimal(getattr(carry_forward, field))
+
+    def get(self, safe_partner_id):
+        totals = self.totals.get(safe_partner_id, {})
+        cent = Decimal("0.01")
+        return {
+            "total_usd": totals.get("total_usd", Decimal("0")).quantize(cent),
+            "total_usdt": totals.get("total_usdt", Decimal("0")).quantize(cent),
+            # total_iqd is an integer column.
+            "total_iqd": int(totals.get("total_iqd", Decimal("0"))),
+        }
+
+
+def _repayments(chunk_size):
+    """Every DebtRepayment with its ``repaid_before``, in creation order."""
+    repaid = defaultdict(Decimal)
+    queryset = DebtRepayment.objects.select_related("debt").order_by("pk")
+    for row in queryset.iterator(chunk_size=chunk_size):
+        row.repaid_before = repaid[row.debt_id]
+        repaid[row.debt_id] += row.converted_amount()
+        yield row
+
+
+def replay(chunk_size=5000):
+    """
+    Balances implied by every transaction row currently in the database,
+    plus the carry-forward of archived rows.
+    """
+    owner = OwnerSafes.load()
+    balances = Balances()
+    for model in POSTING_RULES:
+        if model is DebtRepayment:
+            rows = _repayments(chunk_size)
+        else:
+            rows = model.objects.all().iterator(chunk_size=chunk_size)
+        for row in rows:
+            balances.post(row, owner)
+    for carry_forward in CarryForward.objects.all():
+        balances.carry(carry_forward)
+    return balances
+
+
+def reconcile(balances=None):
+    """``[(safe_partner, expected, actual)]`` for every mismatching SafePartner."""
+    balances = balances or replay()
+    mismatches = []
+    for safe_partner in SafePartner.objects.order_by("pk"):
+        expected = balances.get(safe_partner.pk)
+        actual = {field: getattr(safe_partner, field) for field in expected}
+        if expected != actual:
+            mismatches.append((safe_partner, expected, actual))
+    return mismatches
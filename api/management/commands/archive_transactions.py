@@ -0,0 +1,57 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from api.archive import ARCHIVED_MODELS, archive, latest_allowed_cutoff
+from api.ledger import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Move Completed crypto, incoming, outgoing and safe transactions "
+        "created before --before into the archive table and add their "
+        "balance effect to each SafePartner's carry-forward. Partner reports "
+        "keep including the archived rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--before",
+            required=True,
+            help="Cutoff day, YYYY-MM-DD (Baghdad time); at most the 1st of "
+            "this month.",
+        )
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only count the rows."
+        )
+        parser.add_argument(
+            "--reconcile",
+            action="store_true",
+            help="Check every balance against the ledger afterwards.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            before = timezone.make_aware(datetime.fromisoformat(options["before"]))
+        except ValueError:
+            raise CommandError("--before must be YYYY-MM-DD.")
+        if before > latest_allowed_cutoff():
+            raise CommandError(
+                "--before must not be after "
+                f"{latest_allowed_cutoff().date().isoformat()}."
+            )
+
+        counts = archive(
+            before, batch_size=options["batch_size"], dry_run=options["dry_run"]
+        )
+        verb = "Would archive" if options["dry_run"] else "Archived"
+        for name in ARCHIVED_MODELS:
+            self.stdout.write(f"{verb} {counts[name]:>10} {name}")
+
+        if options["reconcile"] and not options["dry_run"]:
+            mismatches = reconcile()
+            if mismatches:
+                raise CommandError(
+                    f"{len(mismatches)} SafePartners disagree with the ledger."
+                )
+            self.stdout.write(self.style.SUCCESS("All balances reconcile."))
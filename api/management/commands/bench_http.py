@@ -0,0 +1,480 @@
+import http.client
+import itertools
+import json
+import re
+import subprocess
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from api.urls import router
+
+# Query strings for the "filtered" and "search" variants of a list route.
+LIST_VARIANTS = {
+    "crypto-transactions": {
+        "filtered": "status=Completed&start_date={month_ago}",
+        "search": "search=Client&start_date={month_ago}",
+    },
+    "incoming-money": {
+        "filtered": "status=Completed&start_date={month_ago}",
+        "search": "search=Receiver&start_date={month_ago}",
+    },
+    "outgoing-money": {
+        "filtered": "status=Pending&start_date={month_ago}",
+        "search": "search=Taker&start_date={month_ago}",
+    },
+    "safe-transactions": {
+        "filtered": "start_date={month_ago}",
+        "search": "search=Opening&start_date=2000-01-01",
+    },
+}
+STATUS_PATCH = ("crypto-transactions", "incoming-money", "outgoing-money")
+# safe-transactions/ without a date range only returns today's rows, detail
+# included.
+DETAIL_QUERY = {"safe-transactions": "start_date=2000-01-01"}
+# Routes outside the router (api/urls.py urlpatterns).
+EXTRA_ROUTES = (
+    ("GET", "outgoing/pending/total/"),
+    ("GET", "portfolio/"),
+    ("GET", "async/bonuses/today/"),
+    ("GET", "async/bonuses/month/"),
+    ("GET", "async/partners/{partner}/report/"),
+    ("GET", "async/outgoing/pending/total/"),
+)
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def _results(data):
+    return data["results"] if isinstance(data, dict) and "results" in data else data
+
+
+def _pk(value):
+    return value["id"] if isinstance(value, dict) else value
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    rank = max(int(round(pct / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+# -----------------------------
+# Payloads for the write routes
+# -----------------------------
+def _create_payloads(ctx):
+    partner, other = ctx["partner_safes"][:2]
+    cash, crypto = ctx["cash_safe_type"], ctx["crypto_safe_type"]
+    return {
+        "crypto-transactions": lambda i: {
+            "transaction_type": "Buy",
+            "usdt_amount": "10.00",
+            "usdt_price": "10.10",
+            "crypto_safe": crypto,
+            "payment_safe": cash,
+            "bonus": "0.20",
+            "bonus_currency": "USD",
+            "currency": "USD",
+            "status": "Pending",
+            "client_name": f"bench {i}",
+        },
+        "incoming-money": lambda i: {
+            "from_partner": partner,
+            "to_partner": other,
+            "money_amount": "25.00",
+            "currency": "USD",
+            "status": "Pending",
+            "to_name": f"bench {i}",
+        },
+        "outgoing-money": lambda i: {
+            "from_partner": partner,
+            "to_partner": other,
+            "money_amount": "25.00",
+            "currency": "USD",
+            "status": "Pending",
+            "taker_name": f"bench {i}",
+        },
+        "safe-transactions": lambda i: {
+            "partner": partner,
+            "transaction_type": "ADD",
+            "money_amount": "1.00",
+            "currency": "USD",
+            "note": f"bench {i}",
+        },
+        "transfer-exchanges": lambda i: {
+            "partner": partner,
+            "exchange_type": "USD_TO_IQD",
+            "usd_amount": "10.00",
+            "iqd_amount": 14500,
+            "exchange_rate": "1450.00",
+        },
+        "debt-repayments": lambda i: {
+            "debt_id": ctx["usd_debts"][i % len(ctx["usd_debts"])],
+            "safe_type_id": cash,
+            "amount": "0.01",
+            "currency": "USD",
+            "conversion_rate": "1",
+        },
+        "debts": lambda i: {
+            "debt_safe_id": cash,
+            "safe_partner_id": partner,
+            "debtor_name": f"bench {i}",
+            "total_amount": "100.00",
+            "currency": "USD",
+        },
+    }
+
+
+class Client:
+    """One keep-alive connection per thread."""
+
+    def __init__(self, base_url, token):
+        parts = urlsplit(base_url)
+        self.https = parts.scheme == "https"
+        self.host = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.token = token
+        self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            if self.https:
+                cls = http.client.HTTPSConnection
+            else:
+                cls = http.client.HTTPConnection
+            conn = self.local.conn = cls(self.host, timeout=120)
+        return conn
+
+    def request(self, method, path, body=None):
+        headers = {"Accept": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        for attempt in (1, 2):
+            conn = self._connection()
+            try:
+                conn.request(method, self.prefix + path, payload, headers)
+                response = conn.getresponse()
+                data = response.read()
+                return response.status, response.getheader("Server-Timing", ""), data
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                self.local.conn = None
+                if attempt == 2:
+                    raise
+
+    def json(self, method, path, body=None):
+        status, _, data = self.request(method, path, body)
+        if status >= 400:
+            raise CommandError(f"{method} {path} -> {status}: {data[:200]!r}")
+        return json.loads(data) if data else None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every API route over HTTP against a running server: "
+        "p50/p95/p99 latency, throughput and queries per request (from the "
+        "Server-Timing header). Writes JSON results and diffs them against "
+        "a baseline file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000/api")
+        parser.add_argument("--username", help="Obtain a JWT with these credentials.")
+        parser.add_argument("--password")
+        parser.add_argument("--token", help="Use this access token instead.")
+        parser.add_argument("--requests", type=int, default=200, help="Per scenario.")
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument(
+            "--only", default="", help="Run scenarios whose name contains this."
+        )
+        parser.add_argument(
+            "--no-writes",
+            action="store_true",
+            help="Skip create and status-patch scenarios.",
+        )
+        parser.add_argument("--output", help="Write results as JSON to this file.")
+        parser.add_argument("--baseline", help="Compare with an earlier --output file.")
+        parser.add_argument(
+            "--fail-threshold",
+            type=float,
+            help="Exit non-zero when a p95 regresses by more than this percent.",
+        )
+
+    def handle(self, *args, **options):
+        token = options["token"]
+        self.client = Client(options["base_url"], token)
+        if not token:
+            if not options["username"]:
+                raise CommandError("Pass --token or --username/--password.")
+            token = self.client.json(
+                "POST",
+                "/token/",
+                {"username": options["username"], "password": options["password"]},
+            )["access"]
+            self.client.token = token
+
+        ctx = self.load_context()
+        scenarios = [
+            s
+            for s in self.build_scenarios(ctx, writes=not options["no_writes"])
+            if options["only"] in s["name"]
+        ]
+        results = {}
+        self.stdout.write(
+            f"{'scenario':<48}{'n':>6}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}"
+            f"{'req/s':>9}{'queries':>9}"
+        )
+        for scenario in scenarios:
+            result = self.run(scenario, options)
+            results[scenario["name"]] = result
+            self.stdout.write(
+                f"{scenario['name']:<48}{result['requests']:>6}{result['errors']:>5}"
+                f"{result['p50_ms'] or 0:>9.1f}{result['p95_ms'] or 0:>9.1f}"
+                f"{result['p99_ms'] or 0:>9.1f}{result['throughput_rps']:>9.1f}"
+                f"{'' if result['queries'] is None else result['queries']:>9}"
+            )
+
+        report = {"meta": self.meta(options), "scenarios": results}
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(report, fh, indent=2, sort_keys=True)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options["baseline"]:
+            self.compare(report, options["baseline"], options["fail_threshold"])
+
+    # -- setup ------------------------------------------------------------
+    def load_context(self):
+        get = lambda path: _results(self.client.json("GET", path))  # noqa: E731
+        safe_types = get("/safe-types/")
+        safe_partners = get("/safe-partners/?fields=id,partner,safe_type&expand=")
+        partners = get("/partners/")
+        owner = next((p["id"] for p in partners if p.get("is_system_owner")), None)
+        ctx = {
+            "cash_safe_type": next(
+                (s["id"] for s in safe_types if s["type"] == "Physical"), None
+            ),
+            "crypto_safe_type": next(
+                (s["id"] for s in safe_types if s["type"] == "Crypto"), None
+            ),
+            "partner_safes": [
+                sp["id"] for sp in safe_partners if _pk(sp["partner"]) != owner
+            ],
+            "partner": next((p["id"] for p in partners if p["id"] != owner), None),
+            "usd_debts": [d["id"] for d in get("/debts/") if d["currency"] == "USD"],
+            "month_ago": (timezone.localdate() - timedelta(days=30)).isoformat(),
+            "ids": {},
+            "pending": {},
+        }
+        if not ctx["partner_safes"] or ctx["partner"] is None:
+            raise CommandError("Seed the database first (manage.py seed_dataset).")
+        return ctx
+
+    def sample_ids(self, prefix, query="start_date=2000-01-01"):
+        data = _results(self.client.json("GET", f"/{prefix}/?{query}&page_size=100"))
+        return [row["id"] for row in data if "id" in row]
+
+    def build_scenarios(self, ctx, writes):
+        scenarios = []
+        payloads = _create_payloads(ctx)
+        for prefix, viewset, _ in router.registry:
+            for route in router.get_routes(viewset):
+                mapping = router.get_method_map(viewset, route.mapping)
+                path = route.url.format(
+                    prefix=prefix, lookup="{pk}", trailing_slash="/"
+                ).strip("^$")
+                for method, action in mapping.items():
+                    scenarios += self.route_scenarios(
+                        ctx, payloads, prefix, path, method.upper(), action, writes
+                    )
+        for method, path in EXTRA_ROUTES:
+            scenario = self.scenario(method, path, "report")
+            scenario["path"] = path.format(**ctx)
+            scenarios.append(scenario)
+        return scenarios
+
+    def route_scenarios(self, ctx, payloads, prefix, path, method, action, writes):
+        if method == "GET" and action == "list":
+            out = [self.scenario(method, path, "list")]
+            for variant, query in LIST_VARIANTS.get(prefix, {}).items():
+                query = query.format(**ctx)
+                out.append(self.scenario(method, f"{path}?{query}", variant))
+            return out
+        if method == "GET" and action == "export":
+            return [
+                self.scenario(
+                    method,
+                    f"{path}?export_format=csv&start_date={ctx['month_ago']}",
+                    "export",
+                )
+            ]
+        if method == "GET" and "{pk}" in path:
+            if action == "report":
+                ids = [ctx["partner"]]
+            else:
+                ids = ctx["ids"].setdefault(prefix, self.sample_ids(prefix))
+            if not ids:
+                return []
+            if prefix in DETAIL_QUERY:
+                path = f"{path}?{DETAIL_QUERY[prefix]}"
+            return [self.scenario(method, path, action, ids=ids)]
+        if not writes:
+            return []
+        if method == "POST" and prefix in payloads:
+            if prefix == "debt-repayments" and not ctx["usd_debts"]:
+                return []
+            return [self.scenario(method, path, "create", body=payloads[prefix])]
+        if method == "PATCH" and prefix in STATUS_PATCH:
+            # Each status patch needs its own Pending row.
+            pending = self.sample_ids(prefix, "status=Pending&start_date=2000-01-01")
+            if pending:
+                return [
+                    self.scenario(
+                        method,
+                        path,
+                        "status patch",
+                        ids=pending,
+                        body=lambda i: {"status": "Completed"},
+                        unique_ids=True,
+                    )
+                ]
+        # PUT/DELETE and creates without a payload are not benchmarked.
+        return []
+
+    def scenario(self, method, path, kind, ids=None, body=None, unique_ids=False):
+        return {
+            "name": f"{method} {path.split('?')[0]} [{kind}]",
+            "method": method,
+            "path": path,
+            "ids": ids,
+            "body": body,
+            "unique_ids": unique_ids,
+        }
+
+    # -- running ----------------------------------------------------------
+    def run(self, scenario, options):
+        total = options["requests"]
+        if scenario["unique_ids"]:
+            total = min(total, len(scenario["ids"]))
+        warmup = 0 if scenario["method"] != "GET" else options["warmup"]
+        counter = itertools.count()
+        lock = threading.Lock()
+        latencies, queries, errors = [], [], []
+        ids = scenario["ids"]
+
+        def one(i):
+            path = scenario["path"]
+            if ids:
+                path = path.replace("{pk}", str(ids[i % len(ids)]))
+            body = scenario["body"](i) if scenario["body"] else None
+            start = time.perf_counter()
+            try:
+                status, timing, _ = self.client.request(
+                    scenario["method"], "/" + path, body
+                )
+            except (http.client.HTTPException, OSError) as exc:
+                status, timing = str(exc), ""
+            elapsed = (time.perf_counter() - start) * 1000
+            return status, timing, elapsed
+
+        for i in range(warmup):
+            one(i)
+
+        def worker():
+            while True:
+                i = next(counter)
+                if i >= total:
+                    return
+                status, timing, elapsed = one(i)
+                match = SERVER_TIMING_QUERIES.search(timing)
+                with lock:
+                    latencies.append(elapsed)
+                    if not isinstance(status, int) or status >= 400:
+                        errors.append(status)
+                    if match:
+                        queries.append(int(match.group(1)))
+
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=worker) for _ in range(options["concurrency"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            "method": scenario["method"],
+            "path": scenario["path"],
+            "requests": len(latencies),
+            "errors": len(errors),
+            "error_statuses": sorted({str(e) for e in errors}),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "mean_ms": sum(latencies) / len(latencies) if latencies else None,
+            "throughput_rps": len(latencies) / wall if wall else 0.0,
+            "queries": round(sum(queries) / len(queries), 1) if queries else None,
+        }
+
+    def meta(self, options):
+        try:
+            revision = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True,
+                text=True,
+                check=False,
+            ).stdout.strip()
+        except OSError:
+            revision = ""
+        return {
+            "base_url": options["base_url"],
+            "requests": options["requests"],
+            "concurrency": options["concurrency"],
+            "date": date.today().isoformat(),
+            "revision": revision,
+        }
+
+    # -- baseline ---------------------------------------------------------
+    def compare(self, report, baseline_path, threshold):
+        with open(baseline_path) as fh:
+            baseline = json.load(fh)["scenarios"]
+        self.stdout.write(
+            f"\n{'scenario':<48}{'p95 before':>11}{'p95 now':>10}{'change':>9}"
+            f"{'queries':>12}"
+        )
+        regressions = []
+        for name, now in report["scenarios"].items():
+            before = baseline.get(name)
+            if not before or not before["p95_ms"] or now["p95_ms"] is None:
+                continue
+            change = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+            queries = f"{before['queries']} -> {now['queries']}"
+            self.stdout.write(
+                f"{name:<48}{before['p95_ms']:>11.1f}{now['p95_ms']:>10.1f}"
+                f"{change:>+8.0f}%{queries:>12}"
+            )
+            if threshold is not None and change > threshold:
+                regressions.append(name)
+            elif now["method"] == "GET" and None not in (
+                before["queries"],
+                now["queries"],
+            ):
+                # Writes fan out into a data-dependent number of postings.
+                if now["queries"] > before["queries"]:
+                    regressions.append(f"{name} (queries)")
+        missing = sorted(set(baseline) - set(report["scenarios"]))
+        if missing:
+            self.stdout.write(f"Not run this time: {', '.join(missing)}")
+        if regressions and threshold is not None:
+            raise CommandError(f"Regressed: {', '.join(regressions)}")
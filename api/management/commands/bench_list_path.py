@@ -0,0 +1,89 @@
+import json
+import time
+from statistics import median
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+from api.views import (
+    CryptoTransactionViewSet,
+    IncomingMoneyViewSet,
+    OutgoingMoneyViewSet,
+    SafePartnerViewSet,
+    SafeTransactionViewSet,
+    TransferExchangeViewSet,
+)
+
+ENDPOINTS = {
+    "safe-partners": SafePartnerViewSet,
+    "crypto-transactions": CryptoTransactionViewSet,
+    "transfer-exchanges": TransferExchangeViewSet,
+    "incoming-money": IncomingMoneyViewSet,
+    "outgoing-money": OutgoingMoneyViewSet,
+    "safe-transactions": SafeTransactionViewSet,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the serializer list path with the values()/fast-renderer "
+        "path on the current database (read-only)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "endpoints",
+            nargs="*",
+            help=f"Endpoints to bench (default: all of {', '.join(ENDPOINTS)}).",
+        )
+        parser.add_argument(
+            "--query",
+            default="start_date=2000-01-01&page_size=300",
+            help="Query string sent with every request.",
+        )
+        parser.add_argument("--repeat", type=int, default=10)
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        user = User(username="bench", is_staff=True)  # never saved
+
+        self.stdout.write(
+            f"{'endpoint':<22}{'rows':>6}{'serializer ms':>15}{'fast ms':>10}"
+            f"{'speedup':>9}{'queries':>12}  same"
+        )
+        for name in options["endpoints"] or ENDPOINTS:
+            if name not in ENDPOINTS:
+                raise CommandError(f"Unknown endpoint {name!r}.")
+            view = ENDPOINTS[name].as_view({"get": "list"})
+            results = {}
+            for fast in ("0", "1"):
+                timings = []
+                for _ in range(options["repeat"]):
+                    request = factory.get(
+                        f"/api/{name}/?{options['query']}&fast={fast}"
+                    )
+                    force_authenticate(request, user=user)
+                    connection.queries_log.clear()
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        response = view(request)
+                        response.render()
+                        timings.append(time.perf_counter() - started)
+                results[fast] = (median(timings), len(queries), response.content)
+
+            slow, fast = results["0"], results["1"]
+            slow_rows, fast_rows = _rows(slow[2]), _rows(fast[2])
+            rows = len(slow_rows)
+            same = slow_rows == fast_rows
+            self.stdout.write(
+                f"{name:<22}{rows:>6}{slow[0] * 1000:>15.1f}{fast[0] * 1000:>10.1f}"
+                f"{slow[0] / fast[0]:>8.1f}x{slow[1]:>6} → {fast[1]:<3}  "
+                + ("yes" if same else self.style.ERROR("NO"))
+            )
+
+
+def _rows(content):
+    # Paginated bodies differ in their next/previous links (?fast=…).
+    body = json.loads(content)
+    return body["results"] if isinstance(body, dict) else body
@@ -0,0 +1,150 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+from statistics import median
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import NoReverseMatch, reverse
+from rest_framework.test import APIClient
+
+# Routes outside the router (api/urls.py urlpatterns), by URL name.
+EXTRA_ROUTES = ("total-pending-outgoing", "portfolio-valuation")
+
+
+def routes():
+    from api.urls import router
+
+    paths = []
+    for _, _, basename in router.registry:
+        try:
+            paths.append(reverse(f"{basename}-list"))
+        except NoReverseMatch:
+            continue
+    return paths + [reverse(name) for name in EXTRA_ROUTES]
+
+
+def _ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure first-request latency of a fresh process with and without "
+        "the boot warm-up of gunicorn.conf.py (api.warmup). Each run starts "
+        "one process per mode and GETs every list route twice, in process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5, help="Processes per mode.")
+        parser.add_argument("--output", help="Also write the results as JSON here.")
+        parser.add_argument("--child", choices=("cold", "warm"), help=argparse.SUPPRESS)
+        parser.add_argument("--paths", help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options["child"]:
+            paths = options["paths"].split(",")
+            self.stdout.write(json.dumps(self.child(options["child"], paths)))
+            return
+
+        paths = routes()
+        samples = {"cold": [], "warm": []}
+        for _ in range(options["runs"]):
+            for mode in samples:
+                samples[mode].append(self.spawn(mode, paths))
+        results = self.summarize(samples)
+        self.report(results)
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
+
+    def spawn(self, mode, paths):
+        command = [
+            sys.executable,
+            str(settings.BASE_DIR / "manage.py"),
+            "bench_startup",
+            "--child",
+            mode,
+            "--paths",
+            ",".join(paths),
+        ]
+        child = subprocess.run(command, capture_output=True, text=True)
+        if child.returncode:
+            raise CommandError(f"{mode} run failed:\n{child.stderr}")
+        return json.loads(child.stdout.strip().splitlines()[-1])
+
+    def child(self, mode, paths):
+        """
+        One fresh process: optional warm-up, then two passes over ``paths``.
+        Nothing here imports the URLconf before the timed requests.
+        """
+        boot = {}
+        if mode == "warm":
+            from api.warmup import preload, warm_up
+
+            start = time.perf_counter()
+            preload()
+            boot["preload"] = _ms(start)
+            boot.update(warm_up())
+        client = APIClient()
+        client.force_authenticate(User(username="bench", is_staff=True))
+        # A server builds its handler (middleware chain) when the app loads.
+        client.handler.load_middleware()
+
+        passes = []
+        for _ in range(2):
+            timings = {}
+            for path in paths:
+                start = time.perf_counter()
+                response = client.get(path)
+                timings[path] = _ms(start)
+                if response.status_code >= 400:
+                    raise CommandError(f"GET {path} -> {response.status_code}")
+            passes.append(timings)
+        return {"boot": boot, "first": passes[0], "steady": passes[1]}
+
+    def summarize(self, samples):
+        def per_route(mode, key):
+            return {
+                path: median(run[key][path] for run in samples[mode])
+                for path in samples[mode][0][key]
+            }
+
+        boot = {
+            step: median(run["boot"][step] for run in samples["warm"])
+            for step in samples["warm"][0]["boot"]
+        }
+        return {
+            "runs": len(samples["cold"]),
+            "boot_ms": boot,
+            "cold_first_ms": per_route("cold", "first"),
+            "warm_first_ms": per_route("warm", "first"),
+            "steady_ms": per_route("cold", "steady"),
+        }
+
+    def report(self, results):
+        cold, warm, steady = (
+            results["cold_first_ms"],
+            results["warm_first_ms"],
+            results["steady_ms"],
+        )
+        self.stdout.write(
+            f"{'route':<34}{'cold first':>12}{'warm first':>12}{'steady':>10}"
+        )
+        for path in cold:
+            self.stdout.write(
+                f"{path:<34}{cold[path]:>12.1f}{warm[path]:>12.1f}{steady[path]:>10.1f}"
+            )
+        totals = [sum(values.values()) for values in (cold, warm, steady)]
+        self.stdout.write(
+            f"{'total':<34}{totals[0]:>12.1f}{totals[1]:>12.1f}{totals[2]:>10.1f}"
+        )
+        boot = results["boot_ms"]
+        steps = ", ".join(f"{step} {ms:.1f}" for step, ms in boot.items())
+        self.stdout.write(
+            f"Warm-up at boot: {sum(boot.values()):.1f} ms ({steps}); "
+            f"first requests {totals[0] - totals[1]:.1f} ms faster "
+            f"(median of {results['runs']} runs, ms)."
+        )
@@ -0,0 +1,49 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from api.partitions import (
+    MONTHS_AHEAD,
+    add_partition,
+    is_partitioned,
+    missing_partitions,
+    partition_name,
+    partitioned_tables,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the monthly partitions of the crypto, incoming and outgoing "
+        "tables for this month and the next --months months, so new rows never "
+        "land in the default partition. PostgreSQL only; run it from cron, "
+        "e.g. once a week."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months", type=int, default=MONTHS_AHEAD)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only list the missing partitions."
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            self.stdout.write(
+                f"Partitioning needs PostgreSQL (this database is {connection.vendor})."
+            )
+            return
+        if options["months"] < 0:
+            raise CommandError("--months must not be negative.")
+
+        created = 0
+        for table in partitioned_tables(apps):
+            with transaction.atomic(), connection.cursor() as cursor:
+                if not is_partitioned(cursor, table):
+                    raise CommandError(f"{table} is not partitioned; run partition_tables.")
+                for month in missing_partitions(cursor, table, options["months"]):
+                    if not options["dry_run"]:
+                        add_partition(cursor, table, month)
+                    created += 1
+                    verb = "Would create" if options["dry_run"] else "Created"
+                    self.stdout.write(f"{verb} {partition_name(table, month)}")
+        if not created:
+            self.stdout.write(self.style.SUCCESS("All partitions exist."))
@@ -0,0 +1,51 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from api.partitions import (
+    MONTHS_AHEAD,
+    is_partitioned,
+    partition_table,
+    partitioned_tables,
+    unpartition_table,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert the crypto, incoming and outgoing tables into monthly "
+        "partitioned tables (or back with --reverse), keeping their rows, "
+        "indexes, foreign keys and id sequences. Opt-in and PostgreSQL only: "
+        "take a backup first, the tables are locked while they are copied. "
+        "Afterwards run create_partitions from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reverse",
+            action="store_true",
+            help="Turn partitioned tables back into plain tables.",
+        )
+        parser.add_argument("--months", type=int, default=MONTHS_AHEAD)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            self.stdout.write(
+                f"Partitioning needs PostgreSQL (this database is {connection.vendor})."
+            )
+            return
+
+        # One transaction: a failure leaves every table as it was.
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Django's foreign keys are deferred; PostgreSQL refuses to alter a
+            # table with pending checks, so run them as the rows are written.
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            for table in partitioned_tables(apps):
+                if is_partitioned(cursor, table) != options["reverse"]:
+                    self.stdout.write(f"{table} is unchanged.")
+                elif options["reverse"]:
+                    unpartition_table(cursor, table)
+                    self.stdout.write(f"Unpartitioned {table}")
+                else:
+                    partition_table(cursor, table, options["months"])
+                    self.stdout.write(f"Partitioned {table}")
+            cursor.execute("SET CONSTRAINTS ALL DEFERRED")
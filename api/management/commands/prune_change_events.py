@@ -0,0 +1,20 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.events import prune_events
+
+
+class Command(BaseCommand):
+    help = "Delete SSE change events older than the retention window."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=float,
+            default=getattr(settings, "CHANGE_EVENT_RETENTION_HOURS", 24),
+            help="Keep events from the last N hours (default: CHANGE_EVENT_RETENTION_HOURS).",
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_events(timedelta(hours=options["hours"]))
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} change events."))
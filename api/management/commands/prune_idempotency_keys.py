@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from api.idempotency import prune_keys
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete Idempotency-Key records past their expiry "
+        "(IDEMPOTENCY_KEY_TTL_HOURS)."
+    )
+
+    def handle(self, *args, **options):
+        deleted = prune_keys()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} idempotency keys."))
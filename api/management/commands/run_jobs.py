@@ -0,0 +1,76 @@
+import os
+import signal
+import socket
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from api.jobs import claim, requeue_stale, run
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs (api.jobs). Stops after the current job "
+        "on SIGTERM/SIGINT; run several for more throughput."
+    )
+
+    # How often, in seconds, a worker gives back jobs of dead workers.
+    stale_check_interval = 60
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when the queue is empty."
+        )
+        parser.add_argument(
+            "--poll",
+            type=float,
+            default=2.0,
+            help="Seconds to sleep when the queue is empty.",
+        )
+        parser.add_argument(
+            "--max-jobs", type=int, default=0, help="Exit after this many jobs."
+        )
+        parser.add_argument(
+            "--worker-id",
+            default=f"{socket.gethostname()}:{os.getpid()}",
+            help="Name recorded on the jobs this worker runs.",
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.stop)
+
+        worker = options["worker_id"][:100]
+        done = failed = 0
+        next_stale_check = 0.0
+        while not self.stopping:
+            # Between jobs, like request_finished does between requests. Not
+            # inside a caller's transaction (call_command): closing would
+            # abort it.
+            if not connection.in_atomic_block:
+                close_old_connections()
+            if time.monotonic() >= next_stale_check:
+                requeued = requeue_stale()
+                if requeued:
+                    self.stdout.write(f"Gave back {requeued} stale jobs.")
+                next_stale_check = time.monotonic() + self.stale_check_interval
+            job = claim(worker)
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["poll"])
+                continue
+            started = time.perf_counter()
+            ok = run(job)
+            done += ok
+            failed += not ok
+            self.stdout.write(
+                f"Job {job.pk} {job.task}: {'done' if ok else 'failed'} "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
+            if options["max_jobs"] and done + failed >= options["max_jobs"]:
+                break
+        self.stdout.write(self.style.SUCCESS(f"{done} jobs done, {failed} failed."))
+
+    def stop(self, signum, frame):
+        self.stopping = True
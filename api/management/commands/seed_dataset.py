@@ -0,0 +1,478 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.utils import timezone
+from api.cache import REFERENCE_MODELS, reference_cache
+from api.ledger import OWNER_CASH_SAFE, Balances, OwnerSafes
+from api.models import (
+    ArchivedTransaction,
+    CarryForward,
+    ChangeEvent,
+    CryptoTransaction,
+    DataVersion,
+    Debt,
+    DebtRepayment,
+    ExchangeRate,
+    IdempotencyKey,
+    IncomingMoney,
+    Job,
+    OutgoingMoney,
+    Partner,
+    PartnerStatement,
+    SafePartner,
+    SafeTransaction,
+    SafeType,
+    TransferExchange,
+)
+from api.rates import backfill, invalidate_rate_book
+from api.versions import bump_version
+
+# In creation order.
+TRANSACTION_MODELS = {
+    "debt": Debt,
+    "repayment": DebtRepayment,
+    "crypto": CryptoTransaction,
+    "incoming": IncomingMoney,
+    "outgoing": OutgoingMoney,
+    "safe": SafeTransaction,
+    "exchange": TransferExchange,
+}
+DEFAULT_MIX = (
+    "crypto=30,incoming=20,outgoing=20,safe=12,exchange=10,debt=5,repayment=3"
+)
+SAFE_TYPES = (
+    (OWNER_CASH_SAFE, "Physical"),
+    ("Binance", "Crypto"),
+    ("FIB", "Physical"),
+)
+IQD_PER_USD = 1450
+
+
+def parse_weights(value, allowed=None):
+    """``"USD=6,IQD=3"`` -> ``{"USD": 6.0, "IQD": 3.0}``."""
+    weights = {}
+    for part in filter(None, value.split(",")):
+        key, _, weight = part.partition("=")
+        key = key.strip()
+        if allowed is not None and key not in allowed:
+            raise CommandError(
+                f"Unknown key {key!r}; expected one of {', '.join(allowed)}."
+            )
+        try:
+            weights[key] = float(weight)
+        except ValueError:
+            raise CommandError(f"Bad weight in {part!r}.")
+    if not weights or sum(weights.values()) <= 0:
+        raise CommandError(f"No positive weights in {value!r}.")
+    return weights
+
+
+@contextmanager
+def explicit_timestamps(*model_classes):
+    """Let bulk_create keep the created_at/updated_at values we assign."""
+    saved = []
+    for model in model_classes:
+        for field in model._meta.concrete_fields:
+            if isinstance(field, models.DateTimeField) and (
+                field.auto_now or field.auto_now_add
+            ):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Generator:
+    def __init__(self, options):
+        self.rng = random.Random(options["seed"])
+        self.currency_weights = parse_weights(
+            options["currencies"], ("USD", "IQD", "USDT")
+        )
+        self.completed = options["completed"]
+        self.partner_share = options["partner_share"]
+        self.received = options["received"]
+
+    # -- helpers ----------------------------------------------------------
+    def chance(self, probability):
+        return self.rng.random() < probability
+
+    def pick(self, weights):
+        keys = list(weights)
+        return self.rng.choices(keys, [weights[k] for k in keys])[0]
+
+    def currency(self, allowed=("USD", "IQD", "USDT")):
+        weights = {c: w for c, w in self.currency_weights.items() if c in allowed}
+        return self.pick(weights) if weights else allowed[0]
+
+    def amount(self, currency, scale=5.0):
+        usd = min(self.rng.lognormvariate(scale, 1.1), 250_000)
+        if currency == "IQD":
+            return Decimal(int(usd * IQD_PER_USD / 250) * 250 or 250)
+        return Decimal(f"{usd:.2f}") or Decimal("1.00")
+
+    def bonus(self, currency):
+        return self.amount(currency, scale=1.0) if self.chance(0.6) else Decimal("0")
+
+    def status(self):
+        return "Completed" if self.chance(self.completed) else "Pending"
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill an empty database with a deterministic synthetic dataset using "
+        "bulk_create. SafePartner balances are computed with api.ledger, so "
+        "they equal what the signal handlers would have produced."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows", type=int, default=100_000, help="Total transaction rows."
+        )
+        parser.add_argument(
+            "--mix",
+            default=DEFAULT_MIX,
+            help=f"Relative share per model (default: {DEFAULT_MIX}).",
+        )
+        parser.add_argument("--partners", type=int, default=50)
+        parser.add_argument(
+            "--currencies",
+            default="USD=55,IQD=35,USDT=10",
+            help="Currency weights; USDT only applies where the model allows it.",
+        )
+        parser.add_argument(
+            "--completed", type=float, default=0.85, help="Share of Completed rows."
+        )
+        parser.add_argument(
+            "--partner-share",
+            type=float,
+            default=0.4,
+            help="Share of crypto rows involving a partner (bonus split / client).",
+        )
+        parser.add_argument(
+            "--received",
+            type=float,
+            default=0.05,
+            help="Share of is_received incoming/outgoing rows.",
+        )
+        parser.add_argument(
+            "--days", type=int, default=365, help="Spread created_at over N days."
+        )
+        parser.add_argument(
+            "--end", help="Last day of the data, YYYY-MM-DD (default: today)."
+        )
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Delete all existing api data first (without reversing balances).",
+        )
+
+    def handle(self, *args, **options):
+        if Partner.objects.exists():
+            if not options["clear"]:
+                raise CommandError(
+                    "The database already has partners; use --clear to replace them."
+                )
+            self.clear()
+
+        mix = parse_weights(options["mix"], TRANSACTION_MODELS)
+        total_weight = sum(mix.values())
+        counts = {
+            name: int(options["rows"] * weight / total_weight)
+            for name, weight in mix.items()
+        }
+
+        end = options["end"] or timezone.localdate().isoformat()
+        try:
+            end = timezone.make_aware(datetime.fromisoformat(end) + timedelta(days=1))
+        except ValueError:
+            raise CommandError("--end must be YYYY-MM-DD.")
+        self.start = end - timedelta(days=options["days"])
+        self.span = end - self.start
+        self.batch_size = options["batch_size"]
+        self.gen = Generator(options)
+
+        started = time.perf_counter()
+        with explicit_timestamps(*TRANSACTION_MODELS.values()):
+            self.create_reference_data(options["partners"])
+            self.balances = Balances()
+            self.create_opening_deposits()
+            self.debts = []
+            for name in TRANSACTION_MODELS:
+                if counts.get(name):
+                    self.create_rows(name, counts[name])
+            self.write_balances()
+        self.stdout.write(f"{backfill(apps, self.batch_size)} exchange rates.")
+
+        # bulk_create sends no signals: move every process to the new rows.
+        for model in (*REFERENCE_MODELS, SafePartner, *TRANSACTION_MODELS.values()):
+            bump_version(model)
+        invalidate_rate_book()
+        self.stdout.write(
+            self.style.SUCCESS(f"Done in {time.perf_counter() - started:.1f}s.")
+        )
+
+    # -- setup ------------------------------------------------------------
+    def clear(self):
+        # Raw deletes: no post_delete handlers, so nothing is "reversed".
+        for model in (
+            ArchivedTransaction,
+            CarryForward,
+            ExchangeRate,
+            DebtRepayment,
+            Debt,
+            CryptoTransaction,
+            IncomingMoney,
+            OutgoingMoney,
+            SafeTransaction,
+            TransferExchange,
+            ChangeEvent,
+            IdempotencyKey,
+            Job,
+            DataVersion,
+            PartnerStatement,
+            SafePartner.history.model,
+            SafePartner,
+            SafeType,
+            Partner,
+        ):
+            model.objects.all()._raw_delete(model.objects.db)
+        # The version counters start over: drop what was cached under them.
+        cache.clear()
+        reference_cache().clear()
+
+    def create_reference_data(self, partner_count):
+        owner = Partner.objects.create(name="Owner", is_system_owner=True)
+        partners = Partner.objects.bulk_create(
+            Partner(
+                name=f"Partner {i:04d}",
+                phone_number=f"0750{i:07d}",
+                is_office=i % 3 == 0,
+                is_person=i % 3 != 0,
+            )
+            for i in range(1, partner_count + 1)
+        )
+        safe_types = SafeType.objects.bulk_create(
+            SafeType(name=name, type=kind) for name, kind in SAFE_TYPES
+        )
+        SafePartner.objects.bulk_create(
+            SafePartner(partner=partner, safe_type=safe_type)
+            for partner in [owner, *partners]
+            for safe_type in safe_types
+        )
+        self.owner = OwnerSafes.load()
+        self.safe_types = [st.pk for st in safe_types]
+        self.crypto_safe = next(st.pk for st in safe_types if st.type == "Crypto")
+        self.fiat_safes = [st.pk for st in safe_types if st.type == "Physical"]
+        owner_ids = set(self.owner.by_safe_type.values())
+        self.partner_safes = list(
+            SafePartner.objects.exclude(pk__in=owner_ids).values_list("pk", flat=True)
+        )
+        self.all_safes = sorted(owner_ids) + self.partner_safes
+        self.stdout.write(
+            f"{partner_count} partners, {len(safe_types)} safe types, "
+            f"{len(self.all_safes)} safe partners."
+        )
+
+    def create_opening_deposits(self):
+        at = self.start
+        rows = [
+            SafeTransaction(
+                partner_id=sp,
+                transaction_type="ADD",
+                money_amount=self.gen.amount(currency, scale=9.0),
+                currency=currency,
+                note="Opening balance",
+                created_at=at,
+                updated_at=at,
+            )
+            for sp in self.all_safes
+            for currency in ("USD", "IQD", "USDT")
+        ]
+        for row in rows:
+            self.balances.post(row, self.owner)
+        SafeTransaction.objects.bulk_create(rows, batch_size=self.batch_size)
+
+    # -- rows -------------------------------------------------------------
+    def create_rows(self, name, count):
+        model = TRANSACTION_MODELS[name]
+        build = getattr(self, f"build_{name}")
+        step = self.span / max(count, 1)
+        started = time.perf_counter()
+        created = 0
+        while created < count:
+            size = min(self.batch_size, count - created)
+            rows = []
+            for i in range(created, created + size):
+                at = self.start + step * i + step * self.gen.rng.random()
+                row = build()
+                row.created_at = at
+                if hasattr(row, "updated_at"):
+                    row.updated_at = at
+                self.balances.post(row, self.owner)
+                rows.append(row)
+            with transaction.atomic():
+                model.objects.bulk_create(rows, batch_size=self.batch_size)
+            if name == "debt":
+                self.debts.extend(
+                    [row.pk, row.safe_partner_id, row.currency, row.total_amount]
+                    for row in rows
+                )
+            created += size
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{model.__name__:<20}{count:>10} rows {elapsed:8.1f}s")
+
+    def build_crypto(self):
+        g = self.gen
+        currency = g.currency()
+        usdt = g.amount("USDT")
+        if currency == "IQD":
+            price = Decimal(int(usdt * IQD_PER_USD))
+        else:
+            price = (usdt * Decimal("1.01")).quantize(Decimal("0.01"))
+        with_partner = g.chance(g.partner_share)
+        bonus_currency = g.currency(("USD", "IQD", "USDT"))
+        bonus = g.bonus(bonus_currency)
+        if with_partner:
+            # Whole-cent halves: the handlers round every save of the split.
+            bonus = (bonus / 2).quantize(Decimal("0.01")) * 2
+        return CryptoTransaction(
+            transaction_type=g.rng.choice(("Buy", "Sell")),
+            partner_id=g.rng.choice(self.partner_safes) if with_partner else None,
+            partner_client_id=(
+                g.rng.choice(self.partner_safes)
+                if g.chance(g.partner_share)
+                else None
+            ),
+            client_name=None if with_partner else f"Client {g.rng.randint(1, 5000)}",
+            usdt_amount=usdt,
+            usdt_price=price,
+            crypto_safe_id=self.crypto_safe,
+            payment_safe_id=g.rng.choice(self.fiat_safes),
+            bonus=bonus,
+            bonus_currency=bonus_currency,
+            status=g.status(),
+            currency=currency,
+        )
+
+    def _transfer_fields(self):
+        g = self.gen
+        currency = g.currency(("USD", "IQD"))
+        bonus_currency = g.currency(("USD", "IQD"))
+        return {
+            "money_amount": g.amount(currency),
+            "currency": currency,
+            "status": g.status(),
+            "is_received": g.chance(g.received),
+            "my_bonus": g.bonus(bonus_currency),
+            "partner_bonus": g.bonus(bonus_currency) if g.chance(0.3) else Decimal("0"),
+            "bonus_currency": bonus_currency,
+        }
+
+    def build_incoming(self):
+        g = self.gen
+        # Distinct safes: the handlers do not support from == to.
+        from_partner, to_partner = g.rng.sample(self.partner_safes, 2)
+        return IncomingMoney(
+            from_partner_id=from_partner,
+            to_partner_id=to_partner if g.chance(0.5) else None,
+            to_name=f"Receiver {g.rng.randint(1, 5000)}",
+            to_number=f"0770{g.rng.randint(0, 9_999_999):07d}",
+            **self._transfer_fields(),
+        )
+
+    def build_outgoing(self):
+        g = self.gen
+        to_partner, from_partner = g.rng.sample(self.partner_safes, 2)
+        return OutgoingMoney(
+            to_partner_id=to_partner,
+            from_partner_id=self.owner.cash if g.chance(0.5) else from_partner,
+            from_name=f"Sender {g.rng.randint(1, 5000)}",
+            taker_name=f"Taker {g.rng.randint(1, 5000)}",
+            **self._transfer_fields(),
+        )
+
+    def build_safe(self):
+        g = self.gen
+        kind = g.pick({"ADD": 4, "REMOVE": 3, "EXPENSE": 2, "TRANSFER": 3})
+        currency = g.currency()
+        row = SafeTransaction(
+            transaction_type=kind, money_amount=g.amount(currency), currency=currency
+        )
+        if kind == "TRANSFER":
+            from_safe, to_safe = g.rng.sample(self.all_safes, 2)
+            row.from_safepartner_id, row.to_safepartner_id = from_safe, to_safe
+        else:
+            row.partner_id = g.rng.choice(self.all_safes)
+        return row
+
+    def build_exchange(self):
+        g = self.gen
+        usd = g.amount("USD")
+        rate = Decimal(g.rng.randint(1420, 1480))
+        bonus_currency = g.currency(("USD", "IQD"))
+        return TransferExchange(
+            partner_id=g.rng.choice(self.all_safes),
+            exchange_type=g.rng.choice(("USD_TO_IQD", "IQD_TO_USD")),
+            usd_amount=usd,
+            iqd_amount=int(usd * rate),
+            exchange_rate=rate,
+            my_bonus=g.bonus(bonus_currency),
+            bonus_currency=bonus_currency,
+        )
+
+    def build_debt(self):
+        g = self.gen
+        currency = g.currency()
+        with_partner = g.chance(0.8)
+        return Debt(
+            debt_safe_id=g.rng.choice(self.safe_types),
+            safe_partner_id=g.rng.choice(self.partner_safes) if with_partner else None,
+            debtor_name=f"Debtor {g.rng.randint(1, 2000)}",
+            total_amount=g.amount(currency, scale=6.0),
+            currency=currency,
+        )
+
+    def build_repayment(self):
+        g = self.gen
+        if not self.debts:
+            raise CommandError("Repayments need debts; give debt a weight in --mix.")
+        debt = g.rng.choice(self.debts)
+        debt_id, safe_partner_id, currency, remaining = debt
+        # Same-currency repayments only: the stub debt below has no debt_safe.
+        if remaining > 0:
+            amount = min(g.amount(currency, scale=4.0), remaining)
+        else:
+            amount = g.amount(currency, scale=2.0)  # overpayment
+        debt[3] = remaining - amount
+        row = DebtRepayment(
+            debt_id=debt_id,
+            amount=amount,
+            currency=currency,
+            conversion_rate=Decimal("1"),
+            safe_type_id=g.rng.choice(self.safe_types),
+        )
+        # The ledger reads the debt through the relation.
+        row.debt = Debt(pk=debt_id, safe_partner_id=safe_partner_id, currency=currency)
+        return row
+
+    def write_balances(self):
+        safe_partners = list(SafePartner.objects.all())
+        for safe_partner in safe_partners:
+            for field, value in self.balances.get(safe_partner.pk).items():
+                setattr(safe_partner, field, value)
+        SafePartner.objects.bulk_update(
+            safe_partners,
+            ["total_usd", "total_usdt", "total_iqd"],
+            batch_size=self.batch_size,
+        )
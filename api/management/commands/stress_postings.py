@@ -0,0 +1,279 @@
+import random
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, connections, transaction
+from api.ledger import OWNER_CASH_SAFE, OwnerSafes, reconcile
+from api.models import (
+    CryptoTransaction,
+    IncomingMoney,
+    OutgoingMoney,
+    Partner,
+    SafePartner,
+    SafeTransaction,
+    SafeType,
+)
+
+MODELS = ("incoming", "outgoing", "crypto", "safe")
+
+
+class Worker(threading.Thread):
+    """Creates, completes and deletes rows through the ORM so every signal fires."""
+
+    def __init__(self, index, command, options):
+        super().__init__(name=f"stress-{index}")
+        self.command = command
+        self.rng = random.Random(options["seed"] + index)
+        self.operations = options["operations"]
+        self.delete_share = options["delete_share"]
+        self.complete_share = options["complete_share"]
+        self.atomic = options["atomic"]
+        self.rows = []
+        self.done = Counter()
+        self.errors = Counter()
+        self.first_error = None
+
+    def run(self):
+        try:
+            self.command.barrier.wait()
+            for _ in range(self.operations):
+                kind, operation = self.pick()
+                try:
+                    if self.atomic:
+                        with transaction.atomic():
+                            operation()
+                    else:
+                        operation()
+                    self.done[kind] += 1
+                except DatabaseError as exc:
+                    self.errors[kind] += 1
+                    self.first_error = self.first_error or f"{kind}: {exc}"
+        finally:
+            connections.close_all()
+
+    def pick(self):
+        roll = self.rng.random()
+        if self.rows and roll < self.delete_share:
+            row = self.rows.pop(self.rng.randrange(len(self.rows)))
+            return "delete", lambda: self.fresh(row).delete()
+        pending = [row for row in self.rows if getattr(row, "status", "") == "Pending"]
+        if pending and roll < self.delete_share + self.complete_share:
+            row = self.rng.choice(pending)
+            return "complete", lambda: self.complete(row)
+        name = self.rng.choice(MODELS)
+        return "create", lambda: self.rows.append(getattr(self, f"build_{name}")())
+
+    def fresh(self, row):
+        # Like the API's get_object(): related SafePartners are loaded anew,
+        # not reused from the instance that created the row.
+        return type(row).objects.get(pk=row.pk)
+
+    def complete(self, row):
+        instance = self.fresh(row)
+        instance.status = "Completed"
+        instance.save()
+        row.status = "Completed"
+
+    # -- rows -------------------------------------------------------------
+    def money(self):
+        currency = self.rng.choice(("USD", "IQD"))
+        unit = 1000 if currency == "IQD" else 1
+        amount = Decimal(self.rng.randint(1, 500) * unit)
+        # Even bonuses: the handlers split partner bonuses in half.
+        bonus = Decimal(self.rng.randint(0, 5) * 2 * unit)
+        return currency, amount, bonus
+
+    def status(self):
+        return self.rng.choice(("Pending", "Completed"))
+
+    def two_safes(self):
+        return self.rng.sample(self.command.safes, 2)
+
+    def build_incoming(self):
+        currency, amount, bonus = self.money()
+        source, target = self.two_safes()
+        return IncomingMoney.objects.create(
+            from_partner_id=source,
+            to_partner_id=target,
+            money_amount=amount,
+            currency=currency,
+            status=self.status(),
+            my_bonus=bonus,
+            partner_bonus=bonus,
+            bonus_currency=currency,
+        )
+
+    def build_outgoing(self):
+        currency, amount, bonus = self.money()
+        source, target = self.two_safes()
+        return OutgoingMoney.objects.create(
+            from_partner_id=source,
+            to_partner_id=target,
+            money_amount=amount,
+            currency=currency,
+            status=self.status(),
+            taker_name="stress",
+            my_bonus=bonus,
+            partner_bonus=bonus,
+            bonus_currency=currency,
+        )
+
+    def build_crypto(self):
+        usdt = Decimal(self.rng.randint(1, 500))
+        bonus = Decimal(self.rng.randint(0, 5) * 2)
+        return CryptoTransaction.objects.create(
+            transaction_type=self.rng.choice(("Buy", "Sell")),
+            partner_id=self.rng.choice(self.command.safes),
+            usdt_amount=usdt,
+            usdt_price=usdt + 1,
+            crypto_safe_id=self.command.crypto_safe,
+            payment_safe_id=self.command.cash_safe,
+            bonus=bonus,
+            bonus_currency="USD",
+            currency="USD",
+            status=self.status(),
+        )
+
+    def build_safe(self):
+        currency, amount, _ = self.money()
+        transaction_type = self.rng.choice(("ADD", "REMOVE", "TRANSFER"))
+        source, target = self.two_safes()
+        if transaction_type == "TRANSFER":
+            return SafeTransaction.objects.create(
+                from_safepartner_id=source,
+                to_safepartner_id=target,
+                transaction_type=transaction_type,
+                money_amount=amount,
+                currency=currency,
+                note="stress",
+            )
+        return SafeTransaction.objects.create(
+            partner_id=source,
+            transaction_type=transaction_type,
+            money_amount=amount,
+            currency=currency,
+            note="stress",
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer a few SafePartners with concurrent creates, status changes "
+        "and deletes from many threads, then reconcile every balance against "
+        "the transaction tables (api.ledger) and report postings per second. "
+        "Writes real rows: run it on a scratch database, e.g. after "
+        "seed_dataset."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument(
+            "--operations", type=int, default=200, help="Per thread."
+        )
+        parser.add_argument(
+            "--safes",
+            type=int,
+            default=3,
+            help="How many partner cash safes all threads write to.",
+        )
+        parser.add_argument("--delete-share", type=float, default=0.2)
+        parser.add_argument("--complete-share", type=float, default=0.2)
+        parser.add_argument(
+            "--atomic",
+            action="store_true",
+            help="Run each operation in its own transaction.atomic() block.",
+        )
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument(
+            "--allow-sqlite",
+            action="store_true",
+            help="Run on SQLite anyway (it serialises writers; expect lock errors).",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql" and not options["allow_sqlite"]:
+            raise CommandError(
+                f"Needs PostgreSQL (this database is {connection.vendor}); "
+                "pass --allow-sqlite to run anyway."
+            )
+        if options["threads"] < 1 or options["operations"] < 1:
+            raise CommandError("--threads and --operations must be positive.")
+
+        self.load_safes(options["safes"])
+        before = reconcile()
+        if before:
+            raise CommandError(
+                f"{len(before)} SafePartners already disagree with the ledger; "
+                "start from a freshly seeded database."
+            )
+
+        workers = [Worker(i, self, options) for i in range(options["threads"])]
+        self.barrier = threading.Barrier(len(workers))
+        self.stdout.write(
+            f"{len(workers)} threads x {options['operations']} operations on "
+            f"{len(self.safes)} partner safes + the owner's safes..."
+        )
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        done = sum((worker.done for worker in workers), Counter())
+        errors = sum((worker.errors for worker in workers), Counter())
+        total = sum(done.values())
+        self.stdout.write(
+            f"{total} postings in {elapsed:.1f}s = {total / elapsed:.1f} postings/s "
+            f"({', '.join(f'{k} {v}' for k, v in sorted(done.items()))})"
+        )
+        if errors:
+            first = next(w.first_error for w in workers if w.first_error)
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{sum(errors.values())} operations failed "
+                    f"({', '.join(f'{k} {v}' for k, v in sorted(errors.items()))}); "
+                    f"first: {first}"
+                )
+            )
+            if not options["atomic"]:
+                self.stdout.write(
+                    "Without --atomic a failed operation can leave its row and "
+                    "part of its postings behind."
+                )
+
+        mismatches = reconcile()
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS("All balances reconcile."))
+            return
+        for safe_partner, expected, actual in mismatches:
+            diff = ", ".join(
+                f"{field} {actual[field] - expected[field]:+}"
+                for field in expected
+                if actual[field] != expected[field]
+            )
+            self.stdout.write(f"  SafePartner {safe_partner.pk}: {diff}")
+        raise CommandError(
+            f"{len(mismatches)} SafePartners lost or gained postings "
+            "(actual - expected shown above)."
+        )
+
+    def load_safes(self, count):
+        try:
+            owner = OwnerSafes.load()
+            cash = SafeType.objects.get(name=OWNER_CASH_SAFE)
+            crypto = SafeType.objects.filter(type="Crypto").earliest("pk")
+        except (Partner.DoesNotExist, SafeType.DoesNotExist):
+            raise CommandError("Seed the database first (manage.py seed_dataset).")
+        if owner.safe(crypto.pk) is None:
+            raise CommandError("The system owner has no crypto safe.")
+        self.cash_safe, self.crypto_safe = cash.pk, crypto.pk
+        self.safes = list(
+            SafePartner.objects.filter(safe_type=cash, partner__is_system_owner=False)
+            .order_by("pk")
+            .values_list("pk", flat=True)[: max(count, 2)]
+        )
+        if len(self.safes) < 2:
+            raise CommandError("Needs at least two partner cash safes.")
@@ -0,0 +1,337 @@
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connections
+
+# In-process collectors rendered in the Prometheus text format by the
+# /metrics view. Every process keeps its own samples; when METRICS_DIR is
+# set each one also dumps them to ``<METRICS_DIR>/metrics-<pid>.json`` (from
+# a background thread every METRICS_FLUSH_SECONDS, at scrape time and at
+# exit; never from inc/observe, which run in signal handlers) and the view
+# sums the files, so the numbers cover all gunicorn workers. Counters must not go backwards
+# when a worker is recycled, so the files of exited workers are folded into
+# ``metrics-aggregate.json`` rather than dropped.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger("api.metrics")
+
+_lock = threading.Lock()
+_samples = {}  # (sample name, ((label, value), ...)) -> float
+_families = {}  # metric name -> (type, help)
+_flush_lock = threading.Lock()  # one writer of this process's file at a time
+_flusher_pid = None  # the process whose flush thread is running
+_file_checked = False  # a recycled pid may find an exited worker's file
+
+AGGREGATE_FILE = "metrics-aggregate.json"
+
+
+def _inc(name, labels, amount=1.0):
+    key = (name, tuple(labels))
+    _samples[key] = _samples.get(key, 0.0) + amount
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.labelnames = tuple(labelnames)
+        _families[name] = ("counter", documentation)
+
+    def inc(self, amount=1.0, **labels):
+        with _lock:
+            _inc(self.name, [(key, str(labels[key])) for key in self.labelnames], amount)
+        _start_flusher()
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        _families[name] = ("histogram", documentation)
+
+    def observe(self, value, **labels):
+        labels = [(key, str(labels[key])) for key in self.labelnames]
+        with _lock:
+            for bound in self.buckets:
+                # Zero increments too, so every bucket of the series exists.
+                _inc(
+                    f"{self.name}_bucket",
+                    labels + [("le", str(bound))],
+                    1.0 if value <= bound else 0.0,
+                )
+            _inc(f"{self.name}_bucket", labels + [("le", "+Inf")])
+            _inc(f"{self.name}_sum", labels, value)
+            _inc(f"{self.name}_count", labels)
+        _start_flusher()
+
+
+# -----------------------------
+# Collectors
+# -----------------------------
+REQUEST_DURATION = Histogram(
+    "api_request_duration_seconds",
+    "Request latency by view and action.",
+    ("view", "action", "method", "status"),
+)
+POSTINGS = Counter(
+    "api_postings_total",
+    "Transaction rows posted, by model, transaction type and currency.",
+    ("model", "type", "currency", "action"),
+)
+HISTORY_ROWS = Counter(
+    "api_history_rows_total",
+    "simple_history rows written.",
+    ("model",),
+)
+DB_CONNECTIONS_OPENED = Counter(
+    "api_db_connections_opened_total",
+    "Database connections opened by the app.",
+    ("alias",),
+)
+
+
+# -----------------------------
+# Multi-process storage
+# -----------------------------
+def _metrics_dir():
+    return getattr(settings, "METRICS_DIR", None)
+
+
+def _worker_path(directory, pid):
+    return os.path.join(directory, f"metrics-{pid}.json")
+
+
+def _read(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return []
+
+
+def _write(path, rows):
+    # A private temporary file: concurrent writers never share one.
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w") as fh:
+            json.dump(rows, fh)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _sum(paths):
+    totals = {}
+    for path in paths:
+        for name, labels, value in _read(path):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+@contextmanager
+def _locked(directory):
+    """Serializes folding files into the aggregate across processes."""
+    with open(os.path.join(directory, "metrics.lock"), "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # alive, owned by another user
+        return True
+    return True
+
+
+def _retire(directory, paths):
+    """Add ``paths`` to the aggregate file and delete them; hold the lock."""
+    if not paths:
+        return
+    aggregate = os.path.join(directory, AGGREGATE_FILE)
+    totals = _sum([aggregate, *paths])
+    rows = [[name, list(labels), value] for (name, labels), value in totals.items()]
+    _write(aggregate, rows)
+    for path in paths:
+        os.remove(path)
+
+
+def _retire_exited(directory):
+    """Fold the files of exited workers into the aggregate; hold the lock."""
+    exited = []
+    for path in glob.glob(_worker_path(directory, "*")):
+        pid = os.path.basename(path)[len("metrics-") : -len(".json")]
+        if pid.isdigit() and int(pid) != os.getpid() and not _is_running(int(pid)):
+            exited.append(path)
+    _retire(directory, exited)
+
+
+def flush():
+    global _file_checked
+    directory = _metrics_dir()
+    if not directory:
+        return
+    path = _worker_path(directory, os.getpid())
+    # Held across snapshot and write, so an older snapshot never replaces
+    # a newer one.
+    with _flush_lock:
+        if not _file_checked:
+            # Left by an exited worker whose pid this process got.
+            with _locked(directory):
+                _retire(directory, [path] if os.path.exists(path) else [])
+            _file_checked = True
+        with _lock:
+            samples = list(_samples.items())
+        data = [[name, list(labels), value] for (name, labels), value in samples]
+        _write(path, data)
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(getattr(settings, "METRICS_FLUSH_SECONDS", 5))
+        try:
+            flush()
+        except OSError:
+            logger.warning("Could not write the metrics file", exc_info=True)
+
+
+def _start_flusher():
+    """Start this process's flush thread; again in a forked worker."""
+    global _flusher_pid
+    if _flusher_pid == os.getpid() or not _metrics_dir():
+        return
+    with _lock:
+        if _flusher_pid != os.getpid():
+            threading.Thread(
+                target=_flush_periodically, name="metrics-flush", daemon=True
+            ).start()
+            _flusher_pid = os.getpid()
+
+
+def _after_fork():
+    # The flush thread does not survive a fork, and a lock it held would
+    # stay held. The worker counts from zero; the parent keeps its own file.
+    global _lock, _flush_lock, _file_checked
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _samples.clear()
+    _file_checked = False
+
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(flush)
+
+
+def collect():
+    """Samples of every process, summed by name and labels."""
+    directory = _metrics_dir()
+    if not directory:
+        with _lock:
+            return dict(_samples)
+    flush()
+    # Locked, so a concurrent scrape cannot count a file both before and
+    # after it is folded into the aggregate.
+    with _locked(directory):
+        _retire_exited(directory)
+        return _sum(glob.glob(os.path.join(directory, "metrics-*.json")))
+
+
+# -----------------------------
+# Gauges read at scrape time
+# -----------------------------
+def _database_gauges():
+    """PostgreSQL server connections by state, and psycopg pool usage."""
+    server, pool_lines = [], []
+    for alias in connections:
+        connection = connections[alias]
+        if connection.vendor != "postgresql":
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COALESCE(state, 'unknown'), count(*) FROM pg_stat_activity "
+                "WHERE datname = current_database() GROUP BY 1"
+            )
+            for state, count in cursor.fetchall():
+                server.append(
+                    f'api_db_server_connections{{alias="{alias}",state="{state}"}} {count}'
+                )
+        pool = getattr(connection, "pool", None)
+        if pool is not None:
+            # Connection pools are per process, so only this worker's is visible.
+            stats = pool.get_stats()
+            for key in ("pool_size", "pool_available", "requests_waiting"):
+                pool_lines.append(
+                    f'api_db_pool{{alias="{alias}",pid="{os.getpid()}",stat="{key}"}} '
+                    f"{stats.get(key, 0)}"
+                )
+    lines = []
+    if server:
+        lines += [
+            "# HELP api_db_server_connections Connections to the app database by state.",
+            "# TYPE api_db_server_connections gauge",
+        ] + server
+    if pool_lines:
+        lines += [
+            "# HELP api_db_pool Connection pool usage of the scraped worker.",
+            "# TYPE api_db_pool gauge",
+        ] + pool_lines
+    return lines
+
+
+# -----------------------------
+# Exposition
+# -----------------------------
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _sort_key(sample):
+    name, labels, _ = sample
+    # Buckets in ascending ``le`` order, +Inf last.
+    le = dict(labels).get("le")
+    bound = float("inf") if le == "+Inf" else float(le) if le else 0.0
+    return (name, [pair for pair in labels if pair[0] != "le"], bound)
+
+
+def render():
+    samples = collect()
+    by_family = {}
+    for (name, labels), value in samples.items():
+        family = name
+        for suffix in ("_bucket", "_sum", "_count"):
+            if name.endswith(suffix) and name[: -len(suffix)] in _families:
+                family = name[: -len(suffix)]
+        by_family.setdefault(family, []).append((name, labels, value))
+
+    lines = []
+    for family, (kind, documentation) in _families.items():
+        lines.append(f"# HELP {family} {documentation}")
+        lines.append(f"# TYPE {family} {kind}")
+        for name, labels, value in sorted(by_family.get(family, ()), key=_sort_key):
+            label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels)
+            label_text = f"{{{label_text}}}" if label_text else ""
+            lines.append(f"{name}{label_text} {_format_value(value)}")
+    lines.extend(_database_gauges())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,336 @@
+import json
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+from django.urls import Resolver404, resolve, reverse
+from .authentication import authenticate_jwt
+from .db_routers import _read_alias, replica_alias
+from .instrumentation import collect_timings, current_timings
+from .metrics import REQUEST_DURATION
+from .profiling import Profile, profile_dir, requested_modes
+from .versions import remembered_versions
+
+
+# *************************
+# Read replica routing
+# *************************
+REPLICA_ACTIONS = ("list", "export", "report")
+UNSAFE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+PIN_COOKIE = "pin_primary"
+PIN_HEADER = "Primary-Pin"
+_pin_signer = signing.TimestampSigner(salt="api.replica-pin")
+
+
+def _is_pinned(request):
+    """
+    Whether the request carries a pin from a recent write, as a cookie or,
+    for clients without a cookie jar, echoed in the Primary-Pin header. The
+    pin is a signed timestamp, so every worker can check it on its own.
+    """
+    pin = request.COOKIES.get(PIN_COOKIE) or request.headers.get(PIN_HEADER)
+    if not pin:
+        return False
+    try:
+        _pin_signer.unsign(pin, max_age=getattr(settings, "REPLICA_PIN_SECONDS", 5))
+    except signing.BadSignature:  # includes SignatureExpired
+        return False
+    return True
+
+
+def _is_replica_view(view, method):
+    cls = getattr(view, "cls", None)
+    actions = getattr(view, "actions", None)
+    if cls is not None and actions:
+        # ViewSet routes: map the HTTP method to the action it dispatches to.
+        action = actions.get(method.lower())
+        return action in getattr(cls, "replica_actions", REPLICA_ACTIONS)
+    if cls is not None:
+        return getattr(cls, "replica_reads", False)
+    return getattr(view, "replica_reads", False)
+
+
+def _iter_on(alias, content):
+    iterator = iter(content)
+    while True:
+        token = _read_alias.set(alias)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _read_alias.reset(token)
+        yield chunk
+
+
+async def _aiter_on(alias, content):
+    iterator = aiter(content)
+    while True:
+        token = _read_alias.set(alias)
+        try:
+            chunk = await anext(iterator)
+        except StopAsyncIteration:
+            return
+        finally:
+            _read_alias.reset(token)
+        yield chunk
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Route the reads of replica-safe GET views to the read replica.
+
+    Eligible: viewset actions in ``replica_actions`` (default list, export,
+    report), APIView classes with ``replica_reads = True`` and function views
+    wrapped in ``api.db_routers.replica_reads``. After a successful POST, PUT,
+    PATCH or DELETE the client is pinned to the primary for
+    REPLICA_PIN_SECONDS (a signed pin, sent as a cookie and as the
+    Primary-Pin header to echo back), so it reads its own writes while the
+    replica catches up.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        alias = self.read_alias(request)
+        token = _read_alias.set(alias)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self.finish(request, response, alias)
+
+    async def __acall__(self, request):
+        alias = self.read_alias(request)
+        token = _read_alias.set(alias)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self.finish(request, response, alias)
+
+    def read_alias(self, request):
+        alias = replica_alias()
+        if alias is None or request.method not in ("GET", "HEAD"):
+            return None
+        if _is_pinned(request):
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        return alias if _is_replica_view(match.func, request.method) else None
+
+    def finish(self, request, response, alias):
+        if alias and response.streaming:
+            # Exports stream after the view returns; keep them on the replica.
+            if response.is_async:
+                response.streaming_content = _aiter_on(alias, response.streaming_content)
+            else:
+                response.streaming_content = _iter_on(alias, response.streaming_content)
+        if (
+            request.method in UNSAFE_METHODS
+            and response.status_code < 400
+            and replica_alias() is not None
+        ):
+            seconds = getattr(settings, "REPLICA_PIN_SECONDS", 5)
+            pin = _pin_signer.sign("primary")
+            response.set_cookie(PIN_COOKIE, pin, max_age=seconds, samesite="Lax")
+            response[PIN_HEADER] = pin
+        return response
+
+
+# *************************
+# Data versions
+# *************************
+class DataVersionMiddleware:
+    """
+    Read each DataVersion token at most once per request (see
+    ``api.versions.remembered_versions``), so the reference caches and the
+    rate book cost no version query after the first lookup.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with remembered_versions():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with remembered_versions():
+            return await self.get_response(request)
+
+
+# *************************
+# Request timing
+# *************************
+timing_logger = logging.getLogger("api.timing")
+slow_logger = logging.getLogger("api.timing.slow")
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+def _view_labels(view, method):
+    cls = getattr(view, "cls", None)
+    actions = getattr(view, "actions", None) or {}
+    name = cls.__name__ if cls is not None else getattr(view, "__name__", "view")
+    return name, actions.get(method.lower(), method.lower())
+
+
+class RequestTimingMiddleware:
+    """
+    Measure each request: query count and SQL time, time spent in the
+    api.signals handlers, serializer/view time and JSON rendering time.
+    ``serialize`` is derived rather than timed: the view's run time minus
+    its SQL and signal time.
+
+    The numbers go out as a Server-Timing header (SERVER_TIMING_HEADER), one
+    JSON line on the ``api.timing`` logger, a warning on ``api.timing.slow``
+    when the request took SLOW_REQUEST_MS or longer, and the
+    api_request_duration_seconds histogram (api.metrics).
+    Keep it first in MIDDLEWARE so ``total`` covers the whole stack.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with collect_timings() as timings:
+            response = self.get_response(request)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        with collect_timings() as timings:
+            response = await self.get_response(request)
+        return self.finish(request, response, timings)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timings = current_timings()
+        if timings is not None:
+            timings.view_started = time.perf_counter()
+            timings.view_name, timings.action = _view_labels(view_func, request.method)
+
+    def finish(self, request, response, timings):
+        values = timings.as_dict(time.perf_counter() - timings.started)
+
+        if getattr(settings, "SERVER_TIMING_HEADER", True):
+            response["Server-Timing"] = ", ".join(
+                [
+                    f'db;dur={_ms(values["db"])};desc="{values["queries"]} queries"',
+                    f'signals;dur={_ms(values["signals"])}',
+                    f'serialize;dur={_ms(values["serialize"])};'
+                    'desc="derived: view - db - signals"',
+                    f'render;dur={_ms(values["render"])}',
+                    f'total;dur={_ms(values["total"])}',
+                ]
+            )
+
+        line = json.dumps(
+            {
+                "method": request.method,
+                "path": request.get_full_path(),
+                "status": response.status_code,
+                "queries": values["queries"],
+                **{key: _ms(values[key]) for key in values if key != "queries"},
+            },
+            ensure_ascii=False,
+        )
+        timing_logger.info(line)
+        REQUEST_DURATION.observe(
+            values["total"],
+            view=timings.view_name,
+            action=timings.action,
+            method=request.method,
+            status=f"{response.status_code // 100}xx",
+        )
+        if values["total"] * 1000 >= getattr(settings, "SLOW_REQUEST_MS", 1000):
+            slow_logger.warning(line)
+        return response
+
+
+# *************************
+# On-demand profiling
+# *************************
+class ProfilingMiddleware:
+    """
+    Run one request under cProfile (and tracemalloc with ``memory``) when a
+    staff user asks for it with ``?profile=1|cpu|memory`` or an
+    ``X-Profile`` header. The files go to PROFILE_DIR (unset: disabled) and
+    the response carries ``X-Profile-Id`` plus an ``X-Profile-Url`` to
+    download the summary from. Requests from anyone else are served as usual.
+
+    Streamed bodies (exports) are produced after the response leaves the
+    middleware and are not part of the profile. Under ASGI requests are
+    never profiled: cProfile only follows the thread it was enabled on.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        modes = self.profile_modes(request)
+        if not modes:
+            return self.get_response(request)
+
+        profile = Profile(modes)
+        with profile.running():
+            response = self.get_response(request)
+        profile.save(
+            f"{request.method} {request.get_full_path()} -> {response.status_code}"
+        )
+        response["X-Profile-Id"] = profile.id
+        response["X-Profile-Url"] = request.build_absolute_uri(
+            reverse("profile-download", args=[profile.id, "txt"])
+        )
+        return response
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def profile_modes(self, request):
+        if profile_dir() is None:
+            return ()
+        modes = requested_modes(request)
+        if not modes:
+            return ()
+        user = getattr(request, "user", None)
+        if user is None or not user.is_authenticated:
+            user = authenticate_jwt(request)
+        return modes if user is not None and user.is_staff else ()
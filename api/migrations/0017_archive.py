@@ -0,0 +1,44 @@
+# Generated by Django 5.2.5 on 2026-10-19 06:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_changeevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CarryForward',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('through', models.DateTimeField(help_text='Latest archive cutoff')),
+                ('total_usd', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('total_usdt', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('total_iqd', models.BigIntegerField(default=0)),
+                ('rows', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('safe_partner', models.OneToOneField(on_delete=django.db.models.deletion.PROTECT, related_name='carry_forward', to='api.safepartner')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=50)),
+                ('original_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField()),
+                ('data', models.JSONField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('counterparty', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.safepartner')),
+                ('partner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.safepartner')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['partner', 'created_at'], name='api_archive_partner_ae48b7_idx'), models.Index(fields=['counterparty', 'created_at'], name='api_archive_counter_14363a_idx'), models.Index(fields=['model', 'created_at'], name='api_archive_model_c0203f_idx')],
+                'constraints': [models.UniqueConstraint(fields=('model', 'original_id'), name='unique_archived_row')],
+            },
+        ),
+    ]
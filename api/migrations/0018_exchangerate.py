@@ -0,0 +1,98 @@
+# Generated by Django 5.2.5 on 2026-10-19 06:10
+
+from decimal import Decimal
+from django.db import migrations, models
+
+# Frozen copy of api.rates.observation/backfill as of this migration, so
+# later changes to that module never change what this migration does.
+RATE_PLACES = Decimal("0.000001")
+BATCH_SIZE = 2000
+
+
+def _ratio(numerator, denominator):
+    if not numerator or not denominator or numerator < 0 or denominator < 0:
+        return None
+    return (Decimal(numerator) / Decimal(denominator)).quantize(RATE_PLACES)
+
+
+def _exchange(row):
+    if row.exchange_rate and row.exchange_rate > 0:
+        return "USD_IQD", Decimal(row.exchange_rate).quantize(RATE_PLACES)
+    rate = _ratio(row.iqd_amount, row.usd_amount)
+    return ("USD_IQD", rate) if rate else None
+
+
+def _crypto(row):
+    if row.currency != "USD":
+        return None
+    rate = _ratio(row.usdt_price, row.usdt_amount)
+    return ("USDT_USD", rate) if rate else None
+
+
+def _repayment(row):
+    if {row.currency, row.debt.currency} != {"USD", "IQD"}:
+        return None
+    if row.conversion_rate is None or row.conversion_rate <= 1:
+        return None
+    return "USD_IQD", Decimal(row.conversion_rate).quantize(RATE_PLACES)
+
+
+SOURCES = (
+    ("exchange", "TransferExchange", _exchange),
+    ("crypto", "CryptoTransaction", _crypto),
+    ("repayment", "DebtRepayment", _repayment),
+)
+
+
+def backfill_rates(apps, schema_editor):
+    ExchangeRate = apps.get_model("api", "ExchangeRate")
+    for source, model_name, observation in SOURCES:
+        rows = apps.get_model("api", model_name).objects.order_by("pk")
+        if source == "repayment":
+            rows = rows.select_related("debt")
+        batch = []
+        for row in rows.iterator(chunk_size=BATCH_SIZE):
+            observed = observation(row)
+            if observed is None:
+                continue
+            pair, rate = observed
+            batch.append(
+                ExchangeRate(
+                    pair=pair,
+                    rate=rate,
+                    observed_at=row.created_at,
+                    source=source,
+                    source_id=row.pk,
+                )
+            )
+            if len(batch) >= BATCH_SIZE:
+                ExchangeRate.objects.bulk_create(batch)
+                batch = []
+        ExchangeRate.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pair', models.CharField(choices=[('USD_IQD', 'IQD per USD'), ('USDT_USD', 'USD per USDT')], max_length=10)),
+                ('rate', models.DecimalField(decimal_places=6, max_digits=20)),
+                ('observed_at', models.DateTimeField()),
+                ('source', models.CharField(choices=[('exchange', 'Transfer exchange'), ('crypto', 'Crypto transaction'), ('repayment', 'Debt repayment')], max_length=10)),
+                ('source_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['pair', 'observed_at'], name='api_exchang_pair_8d8c74_idx')],
+                'constraints': [models.UniqueConstraint(fields=('source', 'source_id'), name='unique_rate_source')],
+            },
+        ),
+        migrations.RunPython(backfill_rates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-19 06:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartnerStatement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('body', models.JSONField()),
+                ('generated_at', models.DateTimeField(auto_now=True)),
+                ('partner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statements', to='api.partner')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('partner', 'month'), name='unique_partner_statement')],
+            },
+        ),
+    ]
@@ -0,0 +1,344 @@
+import hashlib
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from .cache import get_rows
+from .exports import CHUNK_SIZE, EXPORT_FORMATS, export_response
+from .fastpath import ValuesRowBuilder
+from .idempotency import (
+    HEADER,
+    MAX_KEY_LENGTH,
+    claim,
+    fingerprint,
+    finish,
+    release,
+    stored_data,
+)
+from .jobs import enqueue
+from .models import VersionConflict, VersionedModel
+from .serializers import select_related_paths
+from .versions import version_token
+
+
+# *************************
+# ETag / conditional GET
+# *************************
+class VersionETagMixin:
+    """
+    Emit an ETag on list and retrieve from the DataVersion counters of
+    ``etag_models`` and answer a matching If-None-Match with 304 before the
+    transaction tables are queried. There is no Last-Modified: the lists
+    default to "today", so a response can change with the date alone, and
+    the ETag covers that while a timestamp cannot.
+
+    For row-versioned models (api.models.VersionedModel) the retrieve ETag
+    starts with the row's version (``"<version>.<digest>"``) and PUT/PATCH
+    honour If-Match: a write whose If-Match names another version than the
+    row's current one is rejected with 412. Their responses carry the new
+    version as ``ETag: "<version>"``.
+    """
+
+    etag_models = ()
+
+    def get_etag_models(self):
+        return self.etag_models or (self.queryset.model,)
+
+    def get_version_etag(self, request):
+        token = version_token(self.get_etag_models())
+        # The unfiltered lists default to "today", so the day is part of the key.
+        key = "|".join(
+            [
+                token,
+                request.get_full_path(),
+                getattr(request, "accepted_media_type", "") or "",
+                timezone.localdate().isoformat(),
+            ]
+        )
+        return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional_response(request, super().retrieve, *args, **kwargs)
+
+    def _conditional_response(self, request, handler, *args, **kwargs):
+        etag = self.get_version_etag(request)
+        if self.action == "retrieve" and self.row_versioned():
+            # The digest changes with every save of the model, so a client
+            # ETag "<version>.<digest>" with the current digest still names
+            # the current row: the 304 check needs no query for the version.
+            etag = self._client_row_etag(request, etag) or etag
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            self.retrieved_version = None
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            if self.retrieved_version is not None:
+                etag = quote_etag(f"{self.retrieved_version}.{unquote_etag(etag)}")
+        response["ETag"] = etag
+        # The ETag depends on the negotiated format.
+        patch_vary_headers(response, ["Accept"])
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    @staticmethod
+    def _client_row_etag(request, etag):
+        digest = unquote_etag(etag)
+        for tag in parse_etags(request.headers.get("If-None-Match", "")):
+            version, _, tag_digest = unquote_etag(tag).partition(".")
+            if tag_digest == digest and version.isdigit():
+                return quote_etag(f"{version}.{digest}")
+        return None
+
+    # -- row versions (If-Match) -------------------------------------------
+    def row_versioned(self):
+        return issubclass(self.queryset.model, VersionedModel)
+
+    def get_object(self):
+        obj = super().get_object()
+        self.retrieved_version = getattr(obj, "version", None)
+        return obj
+
+    def update(self, request, *args, **kwargs):
+        if not self.row_versioned():
+            return super().update(request, *args, **kwargs)
+        self.if_match = if_match_versions(request)
+        self.saved_version = None
+        try:
+            with transaction.atomic():
+                response = super().update(request, *args, **kwargs)
+        except VersionConflict as conflict:
+            if not self._is_own_row(conflict.instance, kwargs):
+                raise
+            # 412 answers a failed If-Match; without one the row simply moved
+            # on between our read and our write.
+            return Response(
+                {"error": "The row changed since it was read"},
+                status=409 if self.if_match is None else 412,
+                headers={"ETag": quote_etag(str(conflict.current))},
+            )
+        if self.saved_version is not None:
+            response["ETag"] = quote_etag(str(self.saved_version))
+        return response
+
+    def perform_update(self, serializer):
+        instance = serializer.instance
+        # Lock-free: the save is one UPDATE ... WHERE version = <loaded>
+        # (VersionedModel), so checking If-Match against the loaded version
+        # is enough; a concurrent write makes that UPDATE match nothing.
+        versions = getattr(self, "if_match", None)
+        if versions not in (None, "*") and instance.version not in versions:
+            raise VersionConflict(instance, next(iter(versions), None), instance.version)
+        instance.check_version = True
+        super().perform_update(serializer)
+        self.saved_version = instance.version
+
+    def _is_own_row(self, instance, kwargs):
+        lookup = kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        return type(instance) is self.queryset.model and str(instance.pk) == str(lookup)
+
+
+def unquote_etag(etag):
+    return etag.removeprefix("W/").strip('"')
+
+
+def if_match_versions(request):
+    """
+    Row versions named by If-Match (``"7"`` or a retrieve ETag
+    ``"7.<digest>"``, weak or not); ``"*"`` for any, None without the header.
+    """
+    header = request.headers.get("If-Match")
+    if not header:
+        return None
+    versions = set()
+    for etag in parse_etags(header):
+        if etag == "*":
+            return "*"
+        version = unquote_etag(etag).split(".", 1)[0]
+        if version.isdigit():
+            versions.add(int(version))
+    return versions
+
+
+# *************************
+# Idempotency keys
+# *************************
+class IdempotencyMixin:
+    """
+    Honour an ``Idempotency-Key`` header on create and update (PUT/PATCH).
+    The first request runs and its response is stored with it; a retry
+    with the same key gets that response back (``Idempotent-Replayed:
+    true``) without running the view again. Reusing a key for a different
+    request answers 422, retrying while the first one still runs 409.
+    """
+
+    def create(self, request, *args, **kwargs):
+        return self._idempotent(request, super().create, *args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
+        # partial_update goes through update().
+        return self._idempotent(request, super().update, *args, **kwargs)
+
+    def _idempotent(self, request, handler, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return handler(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({"error": f"{HEADER} is too long"}, status=400)
+
+        record, claimed = claim(request, key)
+        if not claimed:
+            return self._replay(request, record)
+        try:
+            # The response is stored in the same transaction as the writes.
+            with transaction.atomic():
+                response = handler(request, *args, **kwargs)
+                if response.status_code < 500:
+                    finish(record, response)
+        except Exception:
+            release(record)
+            raise
+        if response.status_code >= 500:
+            release(record)
+        return response
+
+    def _replay(self, request, record):
+        if record.fingerprint != fingerprint(request):
+            return Response(
+                {"error": f"{HEADER} was already used for a different request"},
+                status=422,
+            )
+        if record.response_status is None:
+            return Response(
+                {"error": f"A request with this {HEADER} is still in progress"},
+                status=409,
+                headers={"Retry-After": "1"},
+            )
+        return Response(
+            stored_data(record),
+            status=record.response_status,
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+
+# *************************
+# Reference data
+# *************************
+class ReferenceCacheMixin:
+    """Serve the list action of a reference model from api.cache."""
+
+    def get_queryset(self):
+        if self.action == "list":
+            return list(get_rows(self.queryset.model).values())
+        return super().get_queryset()
+
+
+# *************************
+# Fast list path
+# *************************
+class FastListMixin:
+    """
+    Serializer-free read path for the list action.
+
+    Rows come from one ``values_list()`` query shaped by the Get serializer
+    (see api.fastpath) instead of model instances and per-row nested
+    serializers. Enabled per request with ``?fast=1``, or by default with
+    the FAST_LIST_PATH setting (``?fast=0`` then opts out).
+    """
+
+    def use_fast_list(self):
+        flag = self.request.query_params.get("fast")
+        if flag is not None:
+            return flag.lower() in ("1", "true", "yes")
+        return getattr(settings, "FAST_LIST_PATH", False)
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_list():
+            return super().list(request, *args, **kwargs)
+
+        builder = ValuesRowBuilder(self.get_serializer())
+        rows = builder.values(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(builder.build(page))
+        return Response(builder.build(rows))
+
+
+# *************************
+# Sparse fieldsets
+# *************************
+class SparseFieldsQuerysetMixin:
+    """
+    Join only the relations the (possibly ?fields=/?expand= restricted)
+    read serializer renders as nested objects.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ("list", "retrieve"):
+            paths = select_related_paths(self.get_serializer())
+            if paths:
+                queryset = queryset.select_related(*paths)
+        return queryset
+
+
+# *************************
+# Export
+# *************************
+class ExportMixin:
+    """
+    ``GET <list-url>/export/?export_format=csv|xlsx`` streams every row the
+    list action would return (same filters, no pagination) as a file.
+    ``export_columns`` is a sequence of ``(header, lookup)`` pairs.
+    """
+
+    export_columns = ()
+    export_chunk_size = CHUNK_SIZE
+
+    @action(detail=False, methods=["get"], url_path="export")
+    def export(self, request, *args, **kwargs):
+        file_format = request.query_params.get("export_format", "csv").lower()
+        if file_format not in EXPORT_FORMATS:
+            return Response(
+                {"error": f"export_format must be one of {', '.join(EXPORT_FORMATS)}"},
+                status=400,
+            )
+        if request.query_params.get("background", "").lower() in ("1", "true", "yes"):
+            return self._background_export(request, file_format)
+        queryset = self.filter_queryset(self.get_queryset())
+        return export_response(
+            queryset,
+            self.export_columns,
+            file_format,
+            filename=self.basename,
+            chunk_size=self.export_chunk_size,
+        )
+
+    def _background_export(self, request, file_format):
+        """Queue the export as a job (api.jobs) and answer 202 with its URL."""
+        query = request.query_params.copy()
+        for name in ("background", "export_format"):
+            query.pop(name, None)
+        job = enqueue(
+            "export",
+            {
+                "basename": self.basename,
+                "query": query.urlencode(),
+                "export_format": file_format,
+            },
+            user=request.user,
+        )
+        url = reverse("job-detail", args=[job.pk], request=request)
+        return Response({"job": job.pk, "url": url}, status=202)
@@ -1,8 +1,111 @@
-from django.db import models
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, models
+from django.db.models import F
 from decimal import Decimal
 from simple_history.models import HistoricalRecords
 
 
+# ------------------------------------
+# Row versions (optimistic concurrency)
+# ------------------------------------
+class VersionConflict(DatabaseError):
+    """
+    A save found its row at another version than the one it loaded. A
+    DatabaseError, like a serialization failure: retry with fresh data.
+    """
+
+    def __init__(self, instance, loaded, current):
+        super().__init__(
+            f"{instance._meta.label} #{instance.pk} is at version {current}, "
+            f"not {loaded}."
+        )
+        self.instance = instance
+        self.current = current
+
+
+class VersionedModel(models.Model):
+    """
+    ``version`` goes up by one on every save of an existing row, including
+    the balance postings of api.signals. An API edit sets ``check_version``
+    (api.mixins.VersionETagMixin): its UPDATE then only matches the row at
+    the version this instance loaded (``WHERE version = <loaded>``), so an
+    edit based on a stale read raises VersionConflict instead of silently
+    overwriting the other write. Clients send the version back in If-Match.
+
+    Other saves are postings: the ``increment_fields`` are written as
+    ``F(field) + (value - loaded value)``, so two copies of one row (or two
+    concurrent requests) each add their own change and neither is lost.
+    """
+
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    # Balance columns that postings increment instead of overwrite.
+    increment_fields = ()
+    # Set by an API edit for its next save only.
+    check_version = False
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._remember_loaded()
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if not self._state.adding and update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "version"}
+        super().save(*args, **kwargs)
+        self._remember_loaded()
+
+    def _remember_loaded(self):
+        # __dict__: a deferred field is not loaded (and not incremented).
+        self._loaded = {
+            name: self.__dict__[name]
+            for name in self.increment_fields
+            if name in self.__dict__
+        }
+
+    def _update_value(self, field, value, check):
+        name = field.attname
+        if name == "version":
+            return F("version") + 1
+        loaded = getattr(self, "_loaded", {})
+        if check or name not in loaded:
+            return value
+        return F(name) + (field.to_python(value) - loaded[name])
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        check, self.check_version = self.check_version, False
+        loaded = self.version
+        values = [
+            (field, model, self._update_value(field, value, check))
+            for field, model, value in values
+        ]
+        rows = base_qs.filter(pk=pk_val)
+        if not check:
+            if not rows._update(values):
+                return False
+            self.version = loaded + 1  # at least; other postings may follow
+            return True
+        if rows.filter(version=loaded)._update(values):
+            self.version = loaded + 1
+            return True
+        current = rows.values_list("version", flat=True).first()
+        if current is None:
+            # Deleted meanwhile: let save() insert it again, as Django does.
+            return False
+        self.version = current
+        raise VersionConflict(self, loaded, current)
+
+
 # ------------------------------------
 # 1. Partner
 # ------------------------------------
@@ -35,7 +138,7 @@ class SafeType(models.Model):
 # ------------------------------------
 # 3. Safe Balance per Partner
 # ------------------------------------
-class SafePartner(models.Model):
+class SafePartner(VersionedModel):
     partner = models.ForeignKey(
         Partner, on_delete=models.PROTECT, related_name="safe_balances"
     )
@@ -45,6 +148,8 @@ class SafePartner(models.Model):
     total_iqd = models.BigIntegerField(default=0)
     history = HistoricalRecords()
 
+    increment_fields = ("total_usd", "total_usdt", "total_iqd")
+
     class Meta:
         unique_together = ("partner", "safe_type")
 
@@ -55,7 +160,7 @@ class SafePartner(models.Model):
 # ------------------------------------
 # 4. Crypto Transactions
 # ------------------------------------
-class CryptoTransaction(models.Model):
+class CryptoTransaction(VersionedModel):
     TRANSACTION_TYPE_CHOICES = [
         ("Buy", "Buy"),
         ("Sell", "Sell"),
@@ -130,7 +235,7 @@ class CryptoTransaction(models.Model):
 # ------------------------------------
 # Debt Model
 # ------------------------------------
-class Debt(models.Model):
+class Debt(VersionedModel):
     CURRENCY_CHOICES = [
         ("USDT", "USDT"),
         ("USD", "USD"),
@@ -178,7 +283,7 @@ class Debt(models.Model):
         return f"{self.debtor_name} owes {self.remaining_amount} {self.currency}"
 
 
-class DebtRepayment(models.Model):
+class DebtRepayment(VersionedModel):
     CURRENCY_CHOICES = [
         ("USDT", "USDT"),
         ("USD", "USD"),
@@ -226,7 +331,7 @@ class DebtRepayment(models.Model):
 # ------------------------------------
 # 3. Transfer Exchange (Currency Conversion in Safe)
 # ------------------------------------
-class TransferExchange(models.Model):
+class TransferExchange(VersionedModel):
     EXCHANGE_CHOICES = [
         ("USD_TO_IQD", "USD to IQD"),
         ("IQD_TO_USD", "IQD to USD"),
@@ -254,7 +359,7 @@ class TransferExchange(models.Model):
 # ------------------------------------
 # 4. Incoming Money
 # ------------------------------------
-class IncomingMoney(models.Model):
+class IncomingMoney(VersionedModel):
     STATUS_CHOICES = [
         ("Pending", "Pending"),
         ("Completed", "Completed"),
@@ -296,7 +401,7 @@ class IncomingMoney(models.Model):
 # ------------------------------------
 # 5. Outgoing Money
 # ------------------------------------
-class OutgoingMoney(models.Model):
+class OutgoingMoney(VersionedModel):
     STATUS_CHOICES = [
         ("Pending", "Pending"),
         ("Completed", "Completed"),
@@ -334,7 +439,7 @@ class OutgoingMoney(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
 
-class SafeTransaction(models.Model):
+class SafeTransaction(VersionedModel):
     TRANSACTION_TYPE_CHOICES = [
         ("ADD", "Add (Deposit)"),
         ("REMOVE", "Remove (Withdrawal)"),
@@ -388,3 +493,260 @@ class SafeTransaction(models.Model):
             return (
                 f"{self.get_transaction_type_display()} by {self.partner.partner.name}"
             )
+
+
+# ------------------------------------
+# Data Versions (ETags)
+# ------------------------------------
+class DataVersion(models.Model):
+    """Monotonic change counter per model, bumped from api.signals."""
+
+    model = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.model} v{self.version}"
+
+
+# ------------------------------------
+# Change Events (SSE feed)
+# ------------------------------------
+class ChangeEvent(models.Model):
+    """Compact after-commit change record streamed by the /events/ SSE feed."""
+
+    ACTION_CHOICES = [
+        ("created", "Created"),
+        ("updated", "Updated"),
+        ("deleted", "Deleted"),
+    ]
+    topic = models.CharField(max_length=50)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    object_id = models.BigIntegerField()
+    payload = models.JSONField(encoder=DjangoJSONEncoder, default=dict)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"#{self.pk} {self.topic} {self.object_id} {self.action}"
+
+
+class StreamTicket(models.Model):
+    """
+    Single-use credential for opening the /events/ stream: EventSource
+    cannot send an Authorization header, and a JWT in the URL would end up
+    in access logs. Issued and redeemed by api.authentication.
+    """
+
+    key = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.user_id} until {self.expires_at:%H:%M:%S}"
+
+
+# ------------------------------------
+# Archive (closed historical transactions)
+# ------------------------------------
+class ArchivedTransaction(models.Model):
+    """
+    A Completed transaction moved out of its hot table by
+    archive_transactions. ``data`` is the original ``.values()`` row (see
+    api.archive); ``partner``/``counterparty`` are its two SafePartners so
+    reports can find it without reading the JSON.
+    """
+
+    model = models.CharField(max_length=50)
+    original_id = models.BigIntegerField()
+    created_at = models.DateTimeField()
+    partner = models.ForeignKey(
+        SafePartner,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    counterparty = models.ForeignKey(
+        SafePartner,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    data = models.JSONField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model", "original_id"], name="unique_archived_row"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["partner", "created_at"]),
+            models.Index(fields=["counterparty", "created_at"]),
+            models.Index(fields=["model", "created_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.model} #{self.original_id} (archived)"
+
+
+class CarryForward(models.Model):
+    """Net balance effect of all archived rows of one SafePartner."""
+
+    safe_partner = models.OneToOneField(
+        SafePartner, on_delete=models.PROTECT, related_name="carry_forward"
+    )
+    through = models.DateTimeField(help_text="Latest archive cutoff")
+    total_usd = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    total_usdt = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    total_iqd = models.BigIntegerField(default=0)
+    rows = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Carry-forward for {self.safe_partner_id} through {self.through}"
+
+
+# ------------------------------------
+# Exchange Rates (history)
+# ------------------------------------
+class ExchangeRate(models.Model):
+    """
+    One observed rate, taken from a TransferExchange, a USD-priced
+    CryptoTransaction or a USD/IQD DebtRepayment (see api.rates).
+    """
+
+    PAIR_CHOICES = [
+        ("USD_IQD", "IQD per USD"),
+        ("USDT_USD", "USD per USDT"),
+    ]
+    SOURCE_CHOICES = [
+        ("exchange", "Transfer exchange"),
+        ("crypto", "Crypto transaction"),
+        ("repayment", "Debt repayment"),
+    ]
+    pair = models.CharField(max_length=10, choices=PAIR_CHOICES)
+    rate = models.DecimalField(max_digits=20, decimal_places=6)
+    observed_at = models.DateTimeField()
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    source_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["source", "source_id"], name="unique_rate_source"
+            )
+        ]
+        indexes = [models.Index(fields=["pair", "observed_at"])]
+
+    def __str__(self):
+        return f"{self.pair} {self.rate} at {self.observed_at}"
+
+
+# ------------------------------------
+# Idempotency keys
+# ------------------------------------
+class IdempotencyKey(models.Model):
+    """
+    A write request sent with an ``Idempotency-Key`` header and, once it
+    finished, its response (see api.idempotency). ``response_status`` is
+    null while the first request is still running.
+    """
+
+    scope = models.CharField(max_length=64)  # the user, or "anonymous"
+    key = models.CharField(max_length=255)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    # The rendered JSON as text: jsonb would not keep the key order.
+    response_body = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["scope", "key"], name="unique_idempotency_key"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.method} {self.path} [{self.key}]"
+
+
+# ------------------------------------
+# Background jobs
+# ------------------------------------
+class Job(models.Model):
+    """
+    Deferred work run by the run_jobs worker command (see api.jobs).
+    Higher ``priority`` runs first; failed attempts are retried after
+    ``run_after`` until ``max_attempts`` is used up.
+    """
+
+    STATUS_CHOICES = [
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+    task = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="queued")
+    priority = models.SmallIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField()
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the worker while the job runs (api.jobs.Heartbeat).
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "priority", "run_after"])]
+
+    def __str__(self):
+        return f"#{self.pk} {self.task} ({self.status})"
+
+
+# ------------------------------------
+# Partner statements (closed months)
+# ------------------------------------
+class PartnerStatement(models.Model):
+    """
+    A partner's report for one closed month, generated once and served from
+    here (see api.statements). Dropped when a transaction of that month
+    changes.
+    """
+
+    partner = models.ForeignKey(
+        Partner, on_delete=models.CASCADE, related_name="statements"
+    )
+    month = models.DateField(help_text="First day of the month")
+    body = models.JSONField()
+    generated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["partner", "month"], name="unique_partner_statement"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.partner_id} statement for {self.month:%Y-%m}"
@@ -1,3 +1,7 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
 from rest_framework.pagination import PageNumberPagination
 
 
@@ -5,3 +9,43 @@ class TenPerPagePagination(PageNumberPagination):
     page_size = 30  # same as SALES_PER_PAGE on the front‑end
     page_size_query_param = "page_size"
     max_page_size = 300
+
+
+def estimated_count(queryset):
+    """
+    PostgreSQL's row estimate (pg_class.reltuples, summed over the
+    partitions of a partitioned table) for an unfiltered queryset; None for
+    filtered querysets and other databases.
+    """
+    if not isinstance(queryset, QuerySet) or queryset.query.has_filters():
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT SUM(GREATEST(c.reltuples, 0)) FROM pg_class c "
+            "WHERE c.oid = to_regclass(%s) OR c.oid IN "
+            "(SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))",
+            [table, table],
+        )
+        estimate = cursor.fetchone()[0]
+    return None if estimate is None else int(estimate)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists of large tables: an unfiltered list of
+    more than ``estimate_above`` rows (by the estimate) shows the estimate
+    instead of running COUNT(*) over the whole table.
+    """
+
+    estimate_above = 100_000
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is not None and estimate > self.estimate_above:
+            return estimate
+        return super().count
@@ -0,0 +1,255 @@
+from datetime import date, datetime, time
+from django.utils import timezone
+
+# Monthly range partitioning (PostgreSQL only) of the largest transaction
+# tables on created_at. Each table becomes a partitioned parent with
+#     <table>_pYYYYMM   one partition per TIME_ZONE (Baghdad) month
+#     <table>_default   rows no monthly partition covers yet
+# PostgreSQL requires the partition key in every unique index, so the
+# database primary key is (id, created_at); id still comes from a sequence
+# and Django keeps treating it as the primary key. Filters on plain
+# created_at ranges (api.reports.day_range) are pruned to the matching
+# partitions. The conversion is opt-in (manage.py partition_tables, also
+# --reverse); create_partitions then adds the coming months ahead of time.
+
+PARTITIONED_MODELS = ("CryptoTransaction", "IncomingMoney", "OutgoingMoney")
+MONTHS_AHEAD = 3
+
+
+def partitioned_tables(apps):
+    return [apps.get_model("api", name)._meta.db_table for name in PARTITIONED_MODELS]
+
+
+def qn(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+# -----------------------------
+# Months
+# -----------------------------
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_start(month):
+    return timezone.make_aware(datetime.combine(month, time.min))
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+
+def bounds_sql(month):
+    start = month_start(month).isoformat()
+    end = month_start(add_months(month, 1)).isoformat()
+    return f"FROM ('{start}') TO ('{end}')"
+
+
+def coming_months(months_ahead):
+    first = timezone.localdate().replace(day=1)
+    return [add_months(first, count) for count in range(months_ahead + 1)]
+
+
+# -----------------------------
+# Catalog
+# -----------------------------
+def is_partitioned(cursor, table):
+    cursor.execute(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", [table]
+    )
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def partitions(cursor, table):
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(%s)",
+        [table],
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _indexes(cursor, table):
+    """``CREATE INDEX`` statements of every index but the primary key."""
+    cursor.execute(
+        "SELECT i.relname, pg_get_indexdef(i.oid), x.indisunique "
+        "FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+        "WHERE x.indrelid = to_regclass(%s) AND NOT x.indisprimary",
+        [table],
+    )
+    indexes = []
+    for name, definition, unique in cursor.fetchall():
+        if unique:
+            raise ValueError(
+                f"{table} has the unique index {name}; partitioned tables only "
+                "allow unique indexes that include created_at."
+            )
+        # Indexes of a partitioned parent read "ON ONLY <table>".
+        indexes.append((name, definition.replace(" ON ONLY ", " ON ", 1)))
+    return indexes
+
+
+def _foreign_keys(cursor, table):
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+        [table],
+    )
+    return cursor.fetchall()
+
+
+def _next_id(cursor, table):
+    cursor.execute(
+        f"SELECT COALESCE(MAX(id), 0), pg_get_serial_sequence(%s, 'id') "
+        f"FROM {qn(table)}",
+        [table],
+    )
+    highest, sequence = cursor.fetchone()
+    if sequence:
+        cursor.execute(f"SELECT last_value FROM {sequence}")
+        highest = max(highest, cursor.fetchone()[0])
+    return highest
+
+
+# -----------------------------
+# Conversion
+# -----------------------------
+def _rebuild(cursor, table, create, primary_key, id_default):
+    """
+    Copy ``table`` into a new table of the same name built by ``create``
+    (``{table}``/``{old}`` placeholders), keeping its rows, indexes, foreign
+    keys and id sequence.
+    """
+    indexes = _indexes(cursor, table)
+    foreign_keys = _foreign_keys(cursor, table)
+    next_id = _next_id(cursor, table)
+    old = f"{table}_old"
+
+    cursor.execute(f"ALTER TABLE {qn(table)} RENAME TO {qn(old)}")
+    for name, _ in foreign_keys:
+        cursor.execute(f"ALTER TABLE {qn(old)} DROP CONSTRAINT {qn(name)}")
+    for name, _ in indexes:
+        cursor.execute(f"DROP INDEX {qn(name)}")
+    cursor.execute(f"ALTER TABLE {qn(old)} DROP CONSTRAINT {qn(table + '_pkey')}")
+    cursor.execute(f"ALTER TABLE {qn(old)} ALTER COLUMN id DROP IDENTITY IF EXISTS")
+    cursor.execute(f"ALTER TABLE {qn(old)} ALTER COLUMN id DROP DEFAULT")
+    cursor.execute(f"DROP SEQUENCE IF EXISTS {qn(table + '_id_seq')}")
+
+    cursor.execute(create.format(table=qn(table), old=qn(old)))
+    cursor.execute(f"ALTER TABLE {qn(table)} ADD PRIMARY KEY ({primary_key})")
+    id_default(cursor, table)
+    cursor.execute(
+        "SELECT setval(pg_get_serial_sequence(%s, 'id'), %s, %s)",
+        [table, max(next_id, 1), next_id > 0],
+    )
+    for _, definition in indexes:
+        cursor.execute(definition)
+    for name, definition in foreign_keys:
+        cursor.execute(
+            f"ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}"
+        )
+    return old
+
+
+def _sequence_default(cursor, table):
+    sequence = qn(f"{table}_id_seq")
+    cursor.execute(f"CREATE SEQUENCE {sequence} OWNED BY {qn(table)}.id")
+    cursor.execute(
+        f"ALTER TABLE {qn(table)} ALTER COLUMN id "
+        f"SET DEFAULT nextval('{sequence}'::regclass)"
+    )
+
+
+def _identity_default(cursor, table):
+    cursor.execute(
+        f"ALTER TABLE {qn(table)} ALTER COLUMN id "
+        "ADD GENERATED BY DEFAULT AS IDENTITY"
+    )
+
+
+def partition_table(cursor, table, months_ahead=MONTHS_AHEAD):
+    """Turn ``table`` into a monthly partitioned table; a no-op if it is one."""
+    if is_partitioned(cursor, table):
+        return
+    cursor.execute(f"SELECT MIN(created_at) FROM {qn(table)}")
+    oldest = cursor.fetchone()[0]
+    old = _rebuild(
+        cursor,
+        table,
+        "CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING "
+        "CONSTRAINTS INCLUDING STORAGE) PARTITION BY RANGE (created_at)",
+        "id, created_at",
+        _sequence_default,
+    )
+
+    month = coming_months(0)[0]
+    if oldest is not None:
+        month = min(month, timezone.localtime(oldest).date().replace(day=1))
+    last = coming_months(months_ahead)[-1]
+    while month <= last:
+        cursor.execute(
+            f"CREATE TABLE {qn(partition_name(table, month))} "
+            f"PARTITION OF {qn(table)} FOR VALUES {bounds_sql(month)}"
+        )
+        month = add_months(month, 1)
+    cursor.execute(
+        f"CREATE TABLE {qn(table + '_default')} PARTITION OF {qn(table)} DEFAULT"
+    )
+
+    cursor.execute(f"INSERT INTO {qn(table)} SELECT * FROM {qn(old)}")
+    cursor.execute(f"DROP TABLE {qn(old)}")
+    cursor.execute(f"ANALYZE {qn(table)}")
+
+
+def unpartition_table(cursor, table):
+    """Turn a partitioned ``table`` back into a plain table."""
+    if not is_partitioned(cursor, table):
+        return
+    old = _rebuild(
+        cursor,
+        table,
+        "CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING "
+        "CONSTRAINTS INCLUDING STORAGE)",
+        "id",
+        _identity_default,
+    )
+    cursor.execute(f"INSERT INTO {qn(table)} SELECT * FROM {qn(old)}")
+    cursor.execute(f"DROP TABLE {qn(old)} CASCADE")
+    cursor.execute(f"ANALYZE {qn(table)}")
+
+
+# -----------------------------
+# Future partitions
+# -----------------------------
+def missing_partitions(cursor, table, months_ahead=MONTHS_AHEAD):
+    existing = partitions(cursor, table)
+    return [
+        month
+        for month in coming_months(months_ahead)
+        if partition_name(table, month) not in existing
+    ]
+
+
+def add_partition(cursor, table, month):
+    """
+    Create the partition for ``month``. Rows of that month that already
+    landed in the default partition are moved into it before it is attached.
+    """
+    name = qn(partition_name(table, month))
+    cursor.execute(
+        f"CREATE TABLE {name} (LIKE {qn(table)} INCLUDING DEFAULTS "
+        "INCLUDING CONSTRAINTS INCLUDING STORAGE)"
+    )
+    start, end = month_start(month), month_start(add_months(month, 1))
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {qn(table + '_default')} "
+        "WHERE created_at >= %s AND created_at < %s RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved",
+        [start, end],
+    )
+    cursor.execute(
+        f"ALTER TABLE {qn(table)} ATTACH PARTITION {name} "
+        f"FOR VALUES {bounds_sql(month)}"
+    )
@@ -0,0 +1,101 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from django.conf import settings
+
+# On-demand profiling of single requests (see ProfilingMiddleware).
+# A profile is up to three files in PROFILE_DIR sharing one id:
+#   <id>.prof         cProfile stats, for pstats / snakeviz
+#   <id>.txt          readable summary (top functions, top allocations)
+#   <id>.tracemalloc  tracemalloc snapshot, for tracemalloc.Snapshot.load
+
+FILE_KINDS = ("prof", "txt", "tracemalloc")
+PROFILE_ID = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9a-f]{8}$")
+TOP = 40
+TRACEMALLOC_FRAMES = 25
+
+
+def profile_dir():
+    directory = getattr(settings, "PROFILE_DIR", None)
+    return Path(directory) if directory else None
+
+
+def requested_modes(request):
+    """
+    Modes asked for with ``?profile=`` or the ``X-Profile`` header:
+    ``1``/``cpu``, ``memory`` or ``cpu,memory``. Empty when not asked.
+    """
+    value = request.GET.get("profile") or request.headers.get("X-Profile") or ""
+    parts = {part.strip().lower() for part in value.split(",")}
+    # A memory profile still gets a cProfile; the summary is built on it.
+    if "memory" in parts:
+        return ("cpu", "memory")
+    if parts & {"1", "true", "yes", "cpu"}:
+        return ("cpu",)
+    return ()
+
+
+def profile_path(profile_id, kind):
+    directory = profile_dir()
+    if directory is None or not PROFILE_ID.match(profile_id) or kind not in FILE_KINDS:
+        return None
+    return directory / f"{profile_id}.{kind}"
+
+
+class Profile:
+    def __init__(self, modes):
+        self.modes = modes
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.profiler = cProfile.Profile()
+        self.snapshot = None
+        self.elapsed = 0.0
+
+    @contextmanager
+    def running(self):
+        trace = "memory" in self.modes and not tracemalloc.is_tracing()
+        if trace:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        started = time.perf_counter()
+        self.profiler.enable()
+        try:
+            yield self
+        finally:
+            self.profiler.disable()
+            self.elapsed = time.perf_counter() - started
+            if "memory" in self.modes and tracemalloc.is_tracing():
+                self.snapshot = tracemalloc.take_snapshot()
+            if trace:
+                tracemalloc.stop()
+
+    def save(self, title):
+        directory = profile_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        self.profiler.dump_stats(directory / f"{self.id}.prof")
+
+        summary = io.StringIO()
+        summary.write(f"{title}\n{self.elapsed * 1000:.1f} ms\n\n")
+        stats = pstats.Stats(self.profiler, stream=summary)
+        stats.sort_stats("cumulative").print_stats(TOP)
+        if self.snapshot is not None:
+            self.snapshot.dump(str(directory / f"{self.id}.tracemalloc"))
+            summary.write(f"\nTop {TOP} allocations by line:\n")
+            for stat in self.snapshot.statistics("lineno")[:TOP]:
+                summary.write(f"{stat}\n")
+        (directory / f"{self.id}.txt").write_text(summary.getvalue())
+        prune(directory)
+
+
+def prune(directory):
+    """Keep the newest PROFILE_KEEP profiles."""
+    keep = getattr(settings, "PROFILE_KEEP", 100)
+    summaries = sorted(directory.glob("*.txt"), key=os.path.getmtime, reverse=True)
+    for old in summaries[keep:]:
+        for kind in FILE_KINDS:
+            old.with_suffix(f".{kind}").unlink(missing_ok=True)
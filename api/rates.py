@@ -0,0 +1,300 @@
+import threading
+from bisect import bisect_right
+from collections import defaultdict
+from decimal import Decimal
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count
+from .models import CryptoTransaction, DebtRepayment, ExchangeRate, TransferExchange
+from .versions import bump_version, model_label, version_token
+
+# Exchange-rate history. Every TransferExchange, USD-priced
+# CryptoTransaction and USD/IQD DebtRepayment records the rate it was made at
+# as an ExchangeRate row (api.signals). RateBook keeps all of them in memory,
+# sorted per pair, so an as-of lookup is a binary search:
+#     rate_book().convert(amount, "IQD", "USD", at=some_datetime)
+
+RATE_PLACES = Decimal("0.000001")
+
+# source -> model name; the keys are ExchangeRate.source values.
+RATE_SOURCES = {
+    "exchange": "TransferExchange",
+    "crypto": "CryptoTransaction",
+    "repayment": "DebtRepayment",
+}
+SOURCE_OF = {
+    TransferExchange: "exchange",
+    CryptoTransaction: "crypto",
+    DebtRepayment: "repayment",
+}
+PAIRS = ("USD_IQD", "USDT_USD")
+
+
+def rewrites_label(pair):
+    """DataVersion label bumped when rates of ``pair`` are changed in place."""
+    return f"{model_label(ExchangeRate)}:{pair}"
+
+
+class MissingRate(LookupError):
+    pass
+
+
+# -----------------------------
+# Observations
+# -----------------------------
+def _ratio(numerator, denominator):
+    if not numerator or not denominator or numerator < 0 or denominator < 0:
+        return None
+    return (Decimal(numerator) / Decimal(denominator)).quantize(RATE_PLACES)
+
+
+def observation(source, row):
+    """``(pair, rate)`` quoted by a source row, or None if it quotes none."""
+    if source == "exchange":
+        # exchange_rate is IQD per USD; the amounts are the fallback.
+        if row.exchange_rate and row.exchange_rate > 0:
+            return "USD_IQD", Decimal(row.exchange_rate).quantize(RATE_PLACES)
+        rate = _ratio(row.iqd_amount, row.usd_amount)
+        return ("USD_IQD", rate) if rate else None
+    if source == "crypto":
+        # usdt_price is the total paid for usdt_amount, in ``currency``.
+        if row.currency != "USD":
+            return None
+        rate = _ratio(row.usdt_price, row.usdt_amount)
+        return ("USDT_USD", rate) if rate else None
+    if source == "repayment":
+        # Between USD and IQD conversion_rate is IQD per USD either way
+        # (DebtRepayment.converted_amount); the default 1 means "not set".
+        if {row.currency, row.debt.currency} != {"USD", "IQD"}:
+            return None
+        if row.conversion_rate is None or row.conversion_rate <= 1:
+            return None
+        return "USD_IQD", Decimal(row.conversion_rate).quantize(RATE_PLACES)
+    raise ValueError(f"Unknown rate source {source!r}.")
+
+
+def record_rate(instance, created):
+    """
+    Create, update or drop the ExchangeRate of a saved source row. A save
+    that leaves the rate as it was bumps no version.
+    """
+    source = SOURCE_OF[type(instance)]
+    observed = observation(source, instance)
+    rates = ExchangeRate.objects.filter(source=source, source_id=instance.pk)
+    if observed is None:
+        if created or not rates.delete()[0]:
+            return
+    else:
+        pair, rate = observed
+        fields = {"pair": pair, "rate": rate, "observed_at": instance.created_at}
+        if created:
+            ExchangeRate.objects.create(source=source, source_id=instance.pk, **fields)
+        elif rates.exclude(**fields).update(**fields):
+            # Not a new id: every process reloads this pair (rate_book).
+            bump_version(rewrites_label(pair))
+        elif not ExchangeRate.objects.get_or_create(
+            source=source, source_id=instance.pk, defaults=fields
+        )[1]:
+            return
+    bump_version(ExchangeRate)
+
+
+def forget_rate(instance):
+    """Drop the ExchangeRate of a deleted source row."""
+    source = SOURCE_OF[type(instance)]
+    if ExchangeRate.objects.filter(source=source, source_id=instance.pk).delete()[0]:
+        bump_version(ExchangeRate)
+
+
+def backfill(apps, batch_size=2000):
+    """
+    Record the rates of every existing source row that has none yet; used
+    by seed_dataset (migration 0018 keeps its own frozen copy). Returns the
+    number of new rows.
+    """
+    ExchangeRateModel = apps.get_model("api", "ExchangeRate")
+    created = 0
+    for source, model_name in RATE_SOURCES.items():
+        model = apps.get_model("api", model_name)
+        known = set(
+            ExchangeRateModel.objects.filter(source=source).values_list(
+                "source_id", flat=True
+            )
+        )
+        rows = model.objects.order_by("pk")
+        if source == "repayment":
+            rows = rows.select_related("debt")
+        batch = []
+        for row in rows.iterator(chunk_size=batch_size):
+            observed = None if row.pk in known else observation(source, row)
+            if observed is None:
+                continue
+            pair, rate = observed
+            batch.append(
+                ExchangeRateModel(
+                    pair=pair,
+                    rate=rate,
+                    observed_at=row.created_at,
+                    source=source,
+                    source_id=row.pk,
+                )
+            )
+            if len(batch) >= batch_size:
+                created += len(ExchangeRateModel.objects.bulk_create(batch))
+                batch = []
+        created += len(ExchangeRateModel.objects.bulk_create(batch))
+    return created
+
+
+# -----------------------------
+# As-of lookups
+# -----------------------------
+class RateBook:
+    """
+    Observed rates per pair, sorted by time. ``rate`` returns the latest
+    rate observed at or before ``at`` and raises MissingRate for times
+    before the first observation; ``convert`` goes through USD.
+    """
+
+    def __init__(self, rows=()):
+        # rows: (id, pair, observed_at, rate), ordered by pair and observed_at.
+        # A pair's (times, rates) is swapped whole, never edited, so readers
+        # on other threads always see a matching pair of lists.
+        self.series = {}
+        self.last_id = 0
+        grouped = defaultdict(list)
+        for pk, pair, observed_at, rate in rows:
+            grouped[pair].append((observed_at, rate))
+            self.last_id = max(self.last_id, pk)
+        for pair, observations in grouped.items():
+            self.replace(pair, observations)
+
+    def size(self, pair):
+        return len(self.series.get(pair, ((), ()))[0])
+
+    def replace(self, pair, observations):
+        """Set the ``(observed_at, rate)`` observations of ``pair``, in time order."""
+        observations = list(observations)
+        self.series[pair] = (
+            [observed_at for observed_at, _ in observations],
+            [rate for _, rate in observations],
+        )
+
+    def add(self, pair, observations):
+        """Insert newer rows; each goes after the observations of the same time."""
+        times, rates = (list(values) for values in self.series.get(pair, ((), ())))
+        for observed_at, rate in observations:
+            index = bisect_right(times, observed_at)
+            times.insert(index, observed_at)
+            rates.insert(index, rate)
+        self.series[pair] = (times, rates)
+
+    def rate(self, pair, at=None):
+        times, rates = self.series.get(pair, ((), ()))
+        if not rates:
+            raise MissingRate(f"No {pair} rate has been recorded.")
+        if at is None:
+            return rates[-1]
+        index = bisect_right(times, at) - 1
+        if index < 0:
+            raise MissingRate(
+                f"No {pair} rate had been recorded by {at.isoformat()}."
+            )
+        return rates[index]
+    def convert(self, amount, currency, target, at=None):
+        amount = Decimal(amount)
+        if currency == target:
+            return amount
+        if currency == "USD":
+            usd = amount
+        elif currency == "IQD":
+            usd = amount / self.rate("USD_IQD", at)
+        elif currency == "USDT":
+            usd = amount * self.rate("USDT_USD", at)
+        else:
+            raise ValueError(f"Unknown currency {currency!r}.")
+        if target == "USD":
+            return usd
+        if target == "IQD":
+            return usd * self.rate("USD_IQD", at)
+        if target == "USDT":
+            return usd / self.rate("USDT_USD", at)
+        raise ValueError(f"Unknown currency {target!r}.")
+
+
+_book = None
+_book_versions = None
+_book_lock = threading.Lock()
+
+
+def _versions():
+    """``{label: version}`` of ExchangeRate and its per-pair rewrite counters."""
+    token = version_token([ExchangeRate, *map(rewrites_label, PAIRS)])
+    return dict(part.rsplit(":", 1) for part in token.split(","))
+
+
+def _refresh(book, rewritten):
+    """
+    Bring ``book`` up to date with what other processes wrote: rows with a
+    new id are inserted; a pair that was rewritten, or whose row count does
+    not add up (deletes, a row committed after a higher id), is reloaded.
+    """
+    rates = ExchangeRate.objects.using(DEFAULT_DB_ALIAS)
+    counts = dict(rates.order_by().values_list("pair").annotate(Count("pk")))
+    added = defaultdict(list)
+    for pk, pair, observed_at, rate in (
+        rates.filter(pk__gt=book.last_id)
+        .order_by("observed_at", "pk")
+        .values_list("pk", "pair", "observed_at", "rate")
+    ):
+        added[pair].append((observed_at, rate))
+        book.last_id = max(book.last_id, pk)
+    for pair in counts.keys() | book.series.keys():
+        expected = book.size(pair) + len(added[pair])
+        if pair in rewritten or counts.get(pair, 0) != expected:
+            book.replace(
+                pair,
+                rates.filter(pair=pair)
+                .order_by("observed_at", "pk")
+                .values_list("observed_at", "rate"),
+            )
+        elif added[pair]:
+            book.add(pair, added[pair])
+
+
+def rate_book():
+    """
+    This process's RateBook. When the ExchangeRate version moved (any
+    process wrote a rate) only the changes are read, see _refresh. The
+    version is read once per request (api.middleware.DataVersionMiddleware).
+    """
+    global _book, _book_versions
+    versions = _versions()
+    with _book_lock:
+        if _book is None:
+            # Always from the primary, like the other reference caches.
+            _book = RateBook(
+                ExchangeRate.objects.using(DEFAULT_DB_ALIAS)
+                .order_by("pair", "observed_at", "pk")
+                .values_list("pk", "pair", "observed_at", "rate")
+            )
+        elif versions != _book_versions:
+            rewritten = {
+                pair
+                for pair in PAIRS
+                if versions[rewrites_label(pair)]
+                != _book_versions[rewrites_label(pair)]
+            }
+            _refresh(_book, rewritten)
+        _book_versions = versions
+        return _book
+
+
+def invalidate_rate_book():
+    """
+    For rates written without record_rate (bulk loads): reload this
+    process's book on next use; the others follow the version bump.
+    """
+    global _book
+    with _book_lock:
+        _book = None
+    bump_version(ExchangeRate)
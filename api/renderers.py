@@ -0,0 +1,45 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+from .instrumentation import track_render
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stock renderer
+    orjson = None
+
+
+_drf_encoder = JSONEncoder()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson when it is installed.
+
+    The output matches the stock renderer: types orjson does not know
+    (Decimal, lazy strings, timedelta, ...) go through DRF's encoder, so a
+    Decimal still renders as a number, UTC datetimes end in "Z" and None
+    dict keys become "null". Indented (browsable API) output and
+    non-compact settings use the stock implementation.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with track_render():
+            return self._render(data, accepted_media_type, renderer_context)
+
+    def _render(self, data, accepted_media_type, renderer_context):
+        if orjson is None or data is None or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(
+            data,
+            default=_drf_encoder.default,
+            option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS,
+        )
+        # Same JavaScript-safety escaping as the stock renderer.
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+                b"\xe2\x80\xa9", b"\\u2029"
+            )
+        return ret
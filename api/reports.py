@@ -0,0 +1,332 @@
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from django.db.models import Case, Count, DecimalField, F, Q, Sum, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .archive import decode_row
+from .models import (
+    ArchivedTransaction,
+    CryptoTransaction,
+    IncomingMoney,
+    OutgoingMoney,
+    SafePartner,
+    TransferExchange,
+)
+import pytz
+
+# Query builders shared by the sync report views (api.views) and their async
+# counterparts (api.async_views). Each builder returns a dict of independent,
+# unevaluated querysets; the views decide whether to run them one after
+# another or concurrently, and the ``*_response`` helpers shape the results.
+
+baghdad_tz = pytz.timezone("Asia/Baghdad")
+
+
+def get_today_range():
+    # Get current date in Baghdad timezone
+    now_baghdad = timezone.now().astimezone(baghdad_tz)
+    today_baghdad = now_baghdad.date()
+
+    # Create start and end of day in Baghdad timezone
+    start_baghdad = baghdad_tz.localize(datetime.combine(today_baghdad, time.min))
+    end_baghdad = baghdad_tz.localize(datetime.combine(today_baghdad, time.max))
+
+    # Convert to UTC for database queries (Django stores datetime in UTC)
+    start_utc = start_baghdad.astimezone(pytz.UTC)
+    end_utc = end_baghdad.astimezone(pytz.UTC)
+    return start_utc, end_utc
+
+
+def local_day_start(day):
+    """Start of ``day`` in TIME_ZONE (Baghdad), as an aware datetime."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def parse_day(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def day_range(first=None, last=None):
+    """
+    created_at bounds for whole local days, the equivalent of
+    ``created_at__date__gte=first`` / ``__lte=last``. Plain comparisons on
+    created_at let PostgreSQL prune the monthly partitions (api.partitions);
+    ``__date`` casts every row and cannot.
+    """
+    bounds = {}
+    if first is not None:
+        bounds["created_at__gte"] = local_day_start(first)
+    if last is not None:
+        bounds["created_at__lt"] = local_day_start(last + timedelta(days=1))
+    return bounds
+
+
+# -----------------------------
+# Bonuses
+# -----------------------------
+def bonus_querysets(start, end):
+    date_filter = {"created_at__gte": start, "created_at__lte": end}
+    return {
+        "crypto": CryptoTransaction.objects.filter(**date_filter)
+        .annotate(
+            adjusted_bonus=Case(
+                When(partner__isnull=False, then=F("bonus") / Decimal("2")),
+                default=F("bonus"),
+                output_field=DecimalField(max_digits=20, decimal_places=2),
+            )
+        )
+        .values("bonus_currency")
+        .annotate(total=Sum("adjusted_bonus")),
+        "transfer": TransferExchange.objects.filter(**date_filter)
+        .values("bonus_currency")
+        .annotate(total=Sum("my_bonus")),
+        "incoming": IncomingMoney.objects.filter(**date_filter)
+        .values("bonus_currency")
+        .annotate(total=Sum("my_bonus")),
+        "outgoing": OutgoingMoney.objects.filter(**date_filter)
+        .values("bonus_currency")
+        .annotate(total=Sum("my_bonus")),
+    }
+
+
+def bonus_response(results):
+    bonus_totals = {}
+    for key in ("crypto", "transfer", "incoming", "outgoing"):
+        for entry in results[key]:
+            currency = entry["bonus_currency"]
+            total = entry["total"] or 0
+            bonus_totals[currency] = bonus_totals.get(currency, 0) + total
+    return bonus_totals
+
+
+# -----------------------------
+# Partner report
+# -----------------------------
+def _parse_report_datetime(value):
+    return parse_datetime(value) or datetime.fromisoformat(value)
+
+
+def report_date_filter(start, end):
+    """``?start=`` / ``?end=`` to created_at bounds; unparsable values are ignored."""
+    date_filter = {}
+    if start:
+        try:
+            date_filter["created_at__gte"] = _parse_report_datetime(start)
+        except (TypeError, ValueError):
+            pass
+    if end:
+        try:
+            date_filter["created_at__lte"] = _parse_report_datetime(end) + timedelta(
+                days=1
+            )
+        except (TypeError, ValueError):
+            pass
+    return date_filter
+
+
+# Report list -> (archived model, ArchivedTransaction party it matches on).
+ARCHIVED_REPORT_ROWS = {
+    "crypto_transactions": ("cryptotransaction", "partner"),
+    "crypto_transactions1": ("cryptotransaction", "counterparty"),
+    "incoming_money": ("incomingmoney", "counterparty"),
+    "incoming_money1": ("incomingmoney", "partner"),
+    "outgoing_money": ("outgoingmoney", "partner"),
+    "outgoing_money1": ("outgoingmoney", "counterparty"),
+}
+
+
+def partner_report_querysets(partner_name, date_filter):
+    def rows(model, lookup):
+        return (
+            model.objects.filter(Q(**{lookup: partner_name}), **date_filter)
+            .values()
+            .order_by("-created_at")
+        )
+
+    return {
+        "crypto_transactions": rows(CryptoTransaction, "partner__partner__name"),
+        "crypto_transactions1": rows(
+            CryptoTransaction, "partner_client__partner__name"
+        ),
+        "incoming_money": rows(IncomingMoney, "to_partner__partner__name"),
+        "incoming_money1": rows(IncomingMoney, "from_partner__partner__name"),
+        "outgoing_money": rows(OutgoingMoney, "from_partner__partner__name"),
+        "outgoing_money1": rows(OutgoingMoney, "to_partner__partner__name"),
+        # Rows moved out by archive_transactions, merged back in the response.
+        "archived": ArchivedTransaction.objects.filter(
+            Q(partner__partner__name=partner_name)
+            | Q(counterparty__partner__name=partner_name),
+            model__in={name for name, _ in ARCHIVED_REPORT_ROWS.values()},
+            **date_filter,
+        ).values_list(
+            "model",
+            "partner__partner__name",
+            "counterparty__partner__name",
+            "data",
+        ),
+    }
+
+
+def partner_report_response(partner, results):
+    results = dict(results)
+    archived = results.pop("archived", ())
+    merged = set()
+    for model, partner_name, counterparty_name, data in archived:
+        names = {"partner": partner_name, "counterparty": counterparty_name}
+        for key, (archived_model, party) in ARCHIVED_REPORT_ROWS.items():
+            if model == archived_model and names[party] == partner.name:
+                results[key].append(decode_row(model, data))
+                merged.add(key)
+    for key in merged:
+        results[key].sort(key=lambda row: row["created_at"], reverse=True)
+    return {"partner": partner.name, **results}
+
+
+# -----------------------------
+# Pending totals
+# -----------------------------
+def pending_total_querysets():
+    def totals(queryset, partner_type, amount):
+        # Grouped by both currency and the annotated partner_type.
+        return (
+            queryset.annotate(partner_type=F(partner_type))
+            .values("currency", "partner_type")
+            .annotate(total_money=Sum(amount))
+            .order_by("currency", "partner_type")
+        )
+
+    pending_crypto = CryptoTransaction.objects.filter(
+        status="Pending", partner_client__isnull=False
+    )
+    return {
+        "outgoing": totals(
+            OutgoingMoney.objects.filter(status="Pending"),
+            "to_partner__safe_type__name",
+            "money_amount",
+        ),
+        "incoming": totals(
+            IncomingMoney.objects.filter(status="Pending"),
+            "from_partner__safe_type__name",
+            "money_amount",
+        ),
+        "crypto": totals(
+            pending_crypto.filter(transaction_type="Sell"),
+            "payment_safe__name",
+            "usdt_price",
+        ),
+        "crypto1": totals(
+            pending_crypto.filter(transaction_type="Buy"),
+            "payment_safe__name",
+            "usdt_price",
+        ),
+    }
+
+
+def pending_total_response(results):
+    response = {}
+    for key in ("outgoing", "incoming", "crypto", "crypto1"):
+        by_currency = {}
+        for item in results[key]:
+            by_currency.setdefault(item["currency"], {})[item["partner_type"]] = item[
+                "total_money"
+            ]
+        response[key] = by_currency
+    return response
+
+
+# -----------------------------
+# Portfolio valuation
+# -----------------------------
+# Result key -> SafePartner fields the balances are grouped by.
+PORTFOLIO_GROUPS = {
+    "by_holder": ("partner__is_system_owner",),
+    "by_safe_type": ("safe_type_id", "safe_type__name", "safe_type__type"),
+    "by_partner": ("partner_id", "partner__name", "partner__is_system_owner"),
+}
+PORTFOLIO_FIELDS = {
+    "partner__is_system_owner": "is_system_owner",
+    "safe_type__name": "name",
+    "safe_type__type": "type",
+    "partner__name": "name",
+}
+CENT = Decimal("0.01")
+
+
+def parse_as_of(value):
+    """``?at=`` as an aware datetime; a bare date means the end of that day."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_day(value)
+        if day is None:
+            return None
+        moment = datetime.combine(day, time.max)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def portfolio_querysets():
+    def totals(fields):
+        return (
+            SafePartner.objects.values(*fields)
+            .annotate(
+                safes=Count("pk"),
+                usd=Sum("total_usd"),
+                usdt=Sum("total_usdt"),
+                iqd=Sum("total_iqd"),
+            )
+            .order_by(*fields)
+        )
+
+    return {key: totals(fields) for key, fields in PORTFOLIO_GROUPS.items()}
+
+
+def portfolio_response(results, book, at=None):
+    """
+    Value the grouped balances in USD with the rates of ``book`` (an
+    api.rates.RateBook) as of ``at``. The valuation is linear, so each group
+    is valued from its sums. A rate is only required when some group holds
+    a balance in its currency; otherwise api.rates.MissingRate is raised.
+    """
+    # Any group: balances that cancel out in one grouping still need a rate
+    # in the finer ones.
+    held = {
+        currency: any(row[currency] for rows in results.values() for row in rows)
+        for currency in ("usdt", "iqd")
+    }
+    usdt_usd = book.rate("USDT_USD", at) if held["usdt"] else None
+    usd_iqd = book.rate("USD_IQD", at) if held["iqd"] else None
+
+    def valued(row):
+        usd, usdt, iqd = (row[key] or 0 for key in ("usd", "usdt", "iqd"))
+        value = Decimal(usd)
+        if usdt:
+            value += usdt * usdt_usd
+        if iqd:
+            value += Decimal(iqd) / usd_iqd
+        valued_row = {PORTFOLIO_FIELDS.get(k, k): v for k, v in row.items()}
+        valued_row.update(usd=usd, usdt=usdt, iqd=iqd, value_usd=value.quantize(CENT))
+        return valued_row
+
+    groups = {key: [valued(row) for row in rows] for key, rows in results.items()}
+    holders = {row["is_system_owner"]: row for row in groups.pop("by_holder")}
+    empty = {"safes": 0, "usd": 0, "usdt": 0, "iqd": 0, "value_usd": CENT * 0}
+    owner = holders.get(True, {"is_system_owner": True, **empty})
+    others = holders.get(False, {"is_system_owner": False, **empty})
+    total = {key: owner[key] + others[key] for key in empty}
+    return {
+        "as_of": at,
+        "rates": {"USD_IQD": usd_iqd, "USDT_USD": usdt_usd},
+        "total": total,
+        "owner": owner,
+        "third_parties": others,
+        **groups,
+    }
+
+
+def evaluate(querysets):
+    """Run each queryset in turn; the sync views' counterpart of gather()."""
+    return {key: list(queryset) for key, queryset in querysets.items()}
@@ -1,5 +1,81 @@
 from rest_framework import serializers
 from .models import *
+from .cache import CachedPrimaryKeyRelatedField
+
+
+# **Sparse fieldsets (?fields= / ?expand=)**
+def parse_field_paths(value):
+    """Turn ``"id,partner.partner.name"`` into ``{"id": {}, "partner": {"partner": {"name": {}}}}``."""
+    tree = {}
+    for path in value.split(","):
+        node = tree
+        for part in path.strip().split("."):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def restrict_fields(serializer, fields=None, expand=None):
+    """
+    Drop fields not listed in ``fields`` and collapse nested serializers
+    not listed in ``expand`` to their primary key. ``None`` means "no
+    restriction"; a nested field with requested sub-fields is expanded.
+    """
+    for name, field in list(serializer.fields.items()):
+        if fields is not None and name not in fields:
+            serializer.fields.pop(name)
+            continue
+        if not isinstance(field, serializers.ModelSerializer):
+            continue
+
+        sub_fields = (fields or {}).get(name) or None
+        if expand is None or name in expand or sub_fields:
+            sub_expand = None if expand is None else expand.get(name, {})
+            restrict_fields(field, sub_fields, sub_expand)
+        else:
+            kwargs = {"read_only": True}
+            if field.source != name:
+                kwargs["source"] = field.source
+            serializer.fields[name] = serializers.PrimaryKeyRelatedField(**kwargs)
+
+
+def select_related_paths(serializer, prefix=""):
+    """Relations a (restricted) serializer renders as nested objects."""
+    paths = []
+    for field in serializer.fields.values():
+        if isinstance(field, serializers.ModelSerializer) and not field.write_only:
+            path = f"{prefix}{field.source}"
+            paths.append(path)
+            paths.extend(select_related_paths(field, f"{path}__"))
+    return paths
+
+
+class SparseFieldsMixin:
+    """
+    Honour ``?fields=`` and ``?expand=`` on read serializers.
+
+    ``fields`` is a comma list of (dotted) field names to keep, e.g.
+    ``fields=id,status,partner.partner.name``. ``expand`` lists the nested
+    relations to render as objects, e.g. ``expand=partner,partner.partner``;
+    once it is given every other relation is rendered as its id.
+    Without either parameter the full representation is returned.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is None:
+            return
+        params = getattr(request, "query_params", request.GET)
+        fields = params.get("fields")
+        expand = params.get("expand")
+        if fields is None and expand is None:
+            return
+        restrict_fields(
+            self,
+            parse_field_paths(fields) if fields is not None else None,
+            parse_field_paths(expand) if expand is not None else None,
+        )
 
 
 # **GET/POST for SafeType**
@@ -24,7 +100,7 @@ class PartnerSerializer(serializers.ModelSerializer):
 
 
 # **Get for SafePartner**
-class SafePartnerSerializer(serializers.ModelSerializer):
+class SafePartnerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     partner = PartnerSerializer(read_only=True)
     safe_type = SafeTypeSerializer(read_only=True)
 
@@ -37,6 +113,7 @@ class SafePartnerSerializer(serializers.ModelSerializer):
             "total_usd",
             "total_usdt",
             "total_iqd",
+            "version",
         ]
 
 
@@ -44,10 +121,10 @@ class SafePartnerSerializer(serializers.ModelSerializer):
 
 
 class SafePartnerCreateSerializer(serializers.ModelSerializer):
-    partner_id = serializers.PrimaryKeyRelatedField(
+    partner_id = CachedPrimaryKeyRelatedField(
         queryset=Partner.objects.all(), write_only=True
     )
-    safe_type_id = serializers.PrimaryKeyRelatedField(
+    safe_type_id = CachedPrimaryKeyRelatedField(
         queryset=SafeType.objects.all(), write_only=True
     )
 
@@ -60,6 +137,7 @@ class SafePartnerCreateSerializer(serializers.ModelSerializer):
             "total_usd",
             "total_usdt",
             "total_iqd",
+            "version",
         ]
 
     def create(self, validated_data):
@@ -91,7 +169,7 @@ class SafePartnerCreateSerializer(serializers.ModelSerializer):
 
 
 # **GET for CryptoTransaction**
-class CryptoTransactionGetSerializer(serializers.ModelSerializer):
+class CryptoTransactionGetSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     partner = SafePartnerSerializer(read_only=True)
     partner_client = SafePartnerSerializer(read_only=True)
     crypto_safe = SafeTypeSerializer(read_only=True)
@@ -104,6 +182,8 @@ class CryptoTransactionGetSerializer(serializers.ModelSerializer):
 
 # **POST for CryptoTransaction**
 class CryptoTransactionPostSerializer(serializers.ModelSerializer):
+    serializer_related_field = CachedPrimaryKeyRelatedField
+
     class Meta:
         model = CryptoTransaction
         fields = "__all__"
@@ -116,7 +196,7 @@ class CryptoTransactionStatusUpdateSerializer(serializers.ModelSerializer):
 
 
 # **GET/POST for TransferExchange**
-class TransferExchangeGetSerializer(serializers.ModelSerializer):
+class TransferExchangeGetSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     partner = SafePartnerSerializer()
 
     class Meta:
@@ -131,7 +211,7 @@ class TransferExchangePostSerializer(serializers.ModelSerializer):
 
 
 # **GET for IncomingMoney**
-class IncomingMoneyGetSerializer(serializers.ModelSerializer):
+class IncomingMoneyGetSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     from_partner = SafePartnerSerializer(read_only=True)
     to_partner = SafePartnerSerializer(read_only=True)
 
@@ -168,7 +248,7 @@ class IncomingMoneyStatusUpdateSerializer(serializers.ModelSerializer):
 
 
 # **GET for OutgoingMoney**
-class OutgoingMoneyGetSerializer(serializers.ModelSerializer):
+class OutgoingMoneyGetSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     from_partner = SafePartnerSerializer(read_only=True)
     to_partner = SafePartnerSerializer(read_only=True)
 
@@ -204,7 +284,7 @@ class OutgoingMoneyStatusUpdateSerializer(serializers.ModelSerializer):
         fields = ["status", "my_bonus", "partner_bonus"]
 
 
-class SafeTransactionGetSerializer(serializers.ModelSerializer):
+class SafeTransactionGetSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     partner = SafePartnerSerializer(read_only=True)
     from_safepartner = SafePartnerSerializer(read_only=True)  # New field
     to_safepartner = SafePartnerSerializer(read_only=True)  # New field
@@ -234,7 +314,7 @@ class DebtRepaymentSerializer(serializers.ModelSerializer):
         queryset=Debt.objects.all(), source="debt", write_only=True
     )
     safe_type = SafeTypeSerializer(read_only=True)
-    safe_type_id = serializers.PrimaryKeyRelatedField(
+    safe_type_id = CachedPrimaryKeyRelatedField(
         queryset=SafeType.objects.all(), source="safe_type", write_only=True
     )
 
@@ -256,6 +336,7 @@ class DebtRepaymentSerializer(serializers.ModelSerializer):
             "conversion_rate",  # NEW
             "converted_amount",  # NEW (calculated value)
             "created_at",
+            "version",
         ]
 
     def get_converted_amount(self, obj):
@@ -265,7 +346,7 @@ class DebtRepaymentSerializer(serializers.ModelSerializer):
 
 class DebtSerializer(serializers.ModelSerializer):
     debt_safe = SafeTypeSerializer(read_only=True)
-    debt_safe_id = serializers.PrimaryKeyRelatedField(
+    debt_safe_id = CachedPrimaryKeyRelatedField(
         queryset=SafeType.objects.all(), source="debt_safe", write_only=True
     )
     safe_partner_id = serializers.PrimaryKeyRelatedField(
@@ -307,6 +388,7 @@ class DebtSerializer(serializers.ModelSerializer):
             "repayments",
             "created_at",
             "updated_at",
+            "version",
         ]
 
     def get_safe_partner_name(self, obj):
@@ -315,3 +397,35 @@ class DebtSerializer(serializers.ModelSerializer):
             if obj.safe_partner
             else None
         )
+
+
+# **Background jobs**
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            "id",
+            "task",
+            "kwargs",
+            "priority",
+            "status",
+            "attempts",
+            "max_attempts",
+            "run_after",
+            "result",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+        read_only_fields = [
+            "status",
+            "attempts",
+            "max_attempts",
+            "run_after",
+            "result",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
@@ -1,5 +1,6 @@
 from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
-from django.dispatch import receiver
+from django.db.backends.signals import connection_created
+from simple_history.signals import post_create_historical_record
 from django.db import transaction, models
 from decimal import Decimal
 from .models import (
@@ -12,7 +13,15 @@ from .models import (
     TransferExchange,
     Debt,
     DebtRepayment,
+    SafeType,
 )
+from .versions import bump_version
+from .events import EVENT_FIELDS, emit_event
+from .instrumentation import receiver, timed_handler
+from .metrics import DB_CONNECTIONS_OPENED, HISTORY_ROWS, POSTINGS
+from .rates import SOURCE_OF, forget_rate, record_rate
+from .statements import forget_month, forget_partner
+from .cache import get_system_owner, invalidate_rows
 
 
 # *************************
@@ -98,7 +107,7 @@ def crypto_txn_pre_save(sender, instance, **kwargs):
 @receiver(post_save, sender=CryptoTransaction)
 def crypto_txn_post_save(sender, instance, created, **kwargs):
     try:
-        owner = Partner.objects.get(is_system_owner=True)
+        owner = get_system_owner()
         payment_safe = SafePartner.objects.get(
             partner=owner, safe_type=instance.payment_safe
         )
@@ -161,7 +170,7 @@ def crypto_txn_post_delete(sender, instance, **kwargs):
     Reverse balances when a transaction is deleted
     """
     try:
-        owner = Partner.objects.get(is_system_owner=True)
+        owner = get_system_owner()
         payment_safe = SafePartner.objects.get(
             partner=owner, safe_type=instance.payment_safe
         )
@@ -282,7 +291,7 @@ def adjust_balance(safe_partner, amount, currency):
 
 
 def get_owner_safe():
-    owner_partner = Partner.objects.get(is_system_owner=True)
+    owner_partner = get_system_owner()
     return SafePartner.objects.get(partner=owner_partner, safe_type__name="قاسە")
 
 
@@ -428,7 +437,7 @@ def outgoing_money_post_save(sender, instance, created, **kwargs):
     Handle money movements and bonuses on creation and status updates
     """
     try:
-        owner_partner = Partner.objects.get(is_system_owner=True)
+        owner_partner = get_system_owner()
         owner_safe = SafePartner.objects.get(
             partner=owner_partner, safe_type__name="قاسە"
         )
@@ -540,7 +549,7 @@ def outgoing_money_post_delete(sender, instance, **kwargs):
     Rollback money movements and bonuses when an OutgoingMoney is deleted
     """
     try:
-        owner_partner = Partner.objects.get(is_system_owner=True)
+        owner_partner = get_system_owner()
         owner_safe = SafePartner.objects.get(
             partner=owner_partner, safe_type__name="قاسە"
         )
@@ -760,7 +769,7 @@ def handle_safe_transaction_reverse(instance):
 def get_system_owner_safe_partner(debt):
     """Return SafePartner for system owner + the chosen safe."""
     try:
-        system_owner = Partner.objects.get(is_system_owner=True)
+        system_owner = get_system_owner()
         safe_partner = SafePartner.objects.get(
             partner=system_owner, safe_type=debt.debt_safe
         )
@@ -836,7 +845,7 @@ def handle_repayment_created(sender, instance, created, **kwargs):
     # --------------------------------------
     else:
         try:
-            system_owner = Partner.objects.get(is_system_owner=True)
+            system_owner = get_system_owner()
             owner_safe_partner_safe = SafePartner.objects.get(
                 partner=system_owner, safe_type=instance.debt.debt_safe
             )
@@ -910,7 +919,7 @@ def handle_repayment_created(sender, instance, created, **kwargs):
             elif debt.currency == "USDT":
                 owner_safe_partner_safe.total_usdt -= normal_repayment
             elif debt.currency == "IQD":
-                owner_safe_partner_safe.total_iqd = normal_repayment
+                owner_safe_partner_safe.total_iqd -= int(normal_repayment)
             owner_safe_partner_safe.save()
         # 2d. Handle overpayment: subtract extra from owner’s repayment safe and add to debtor safe
         if extra_amount > 0:
@@ -985,7 +994,7 @@ def handle_repayment_deleted(sender, instance, **kwargs):
     # --------------------------------------
     else:
         try:
-            system_owner = Partner.objects.get(is_system_owner=True)
+            system_owner = get_system_owner()
             owner_safe_partner_safe = SafePartner.objects.get(
                 partner=system_owner, safe_type=debt.debt_safe
             )
@@ -1074,3 +1083,188 @@ def handle_repayment_deleted(sender, instance, **kwargs):
                 )
                 debtor_safe_partner.total_iqd -= overpaid_iqd
             debtor_safe_partner.save()
+
+
+# *************************
+# Reference Cache
+# *************************
+@receiver(post_save, sender=SafeType)
+@receiver(post_delete, sender=SafeType)
+def safe_type_changed(sender, **kwargs):
+    invalidate_rows(SafeType)
+
+
+@receiver(post_save, sender=Partner)
+@receiver(post_delete, sender=Partner)
+def partner_changed(sender, **kwargs):
+    invalidate_rows(Partner)
+
+
+# *************************
+# Data Versions (ETags)
+# *************************
+VERSIONED_MODELS = (
+    SafeType,
+    Partner,
+    SafePartner,
+    CryptoTransaction,
+    TransferExchange,
+    IncomingMoney,
+    OutgoingMoney,
+    SafeTransaction,
+    Debt,
+    DebtRepayment,
+)
+
+
+@timed_handler
+def bump_data_version(sender, **kwargs):
+    """Invalidate ETags of every list/detail endpoint that renders ``sender``."""
+    bump_version(sender)
+
+
+for _model in VERSIONED_MODELS:
+    post_save.connect(
+        bump_data_version, sender=_model, dispatch_uid=f"version_save_{_model.__name__}"
+    )
+    post_delete.connect(
+        bump_data_version,
+        sender=_model,
+        dispatch_uid=f"version_delete_{_model.__name__}",
+    )
+
+
+# *************************
+# Change Events (SSE)
+# *************************
+@timed_handler
+def change_event_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    emit_event(instance, "created" if created else "updated")
+
+
+@timed_handler
+def change_event_deleted(sender, instance, **kwargs):
+    emit_event(instance, "deleted")
+
+
+for _model in EVENT_FIELDS:
+    post_save.connect(
+        change_event_saved, sender=_model, dispatch_uid=f"event_save_{_model.__name__}"
+    )
+    post_delete.connect(
+        change_event_deleted,
+        sender=_model,
+        dispatch_uid=f"event_delete_{_model.__name__}",
+    )
+
+
+# *************************
+# Exchange Rates
+# *************************
+@timed_handler
+def rate_source_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        record_rate(instance, created)
+
+
+@timed_handler
+def rate_source_deleted(sender, instance, **kwargs):
+    forget_rate(instance)
+
+
+for _model in SOURCE_OF:
+    post_save.connect(
+        rate_source_saved, sender=_model, dispatch_uid=f"rate_save_{_model.__name__}"
+    )
+    post_delete.connect(
+        rate_source_deleted,
+        sender=_model,
+        dispatch_uid=f"rate_delete_{_model.__name__}",
+    )
+
+
+# *************************
+# Metrics
+# *************************
+# model -> (transaction type field, currency field) for api_postings_total.
+POSTING_LABELS = {
+    CryptoTransaction: ("transaction_type", "currency"),
+    TransferExchange: ("exchange_type", None),
+    IncomingMoney: (None, "currency"),
+    OutgoingMoney: (None, "currency"),
+    SafeTransaction: ("transaction_type", "currency"),
+    Debt: (None, "currency"),
+    DebtRepayment: (None, "currency"),
+}
+
+
+def _count_posting(instance, action):
+    type_field, currency_field = POSTING_LABELS[type(instance)]
+    POSTINGS.inc(
+        model=instance._meta.model_name,
+        type=getattr(instance, type_field) if type_field else "",
+        currency=getattr(instance, currency_field) if currency_field else "",
+        action=action,
+    )
+
+
+@timed_handler
+def posting_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        _count_posting(instance, "created" if created else "updated")
+
+
+@timed_handler
+def posting_deleted(sender, instance, **kwargs):
+    _count_posting(instance, "deleted")
+
+
+for _model in POSTING_LABELS:
+    post_save.connect(
+        posting_saved, sender=_model, dispatch_uid=f"metrics_save_{_model.__name__}"
+    )
+    post_delete.connect(
+        posting_deleted,
+        sender=_model,
+        dispatch_uid=f"metrics_delete_{_model.__name__}",
+    )
+
+
+@receiver(post_create_historical_record)
+def history_row_written(sender, history_instance, **kwargs):
+    HISTORY_ROWS.inc(model=history_instance.instance_type._meta.model_name)
+
+
+@receiver(connection_created)
+def database_connection_opened(sender, connection, **kwargs):
+    DB_CONNECTIONS_OPENED.inc(alias=connection.alias)
+
+
+# *************************
+# Partner Statements
+# *************************
+@timed_handler
+def statement_source_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        forget_month(instance.created_at)
+
+
+for _model in (CryptoTransaction, IncomingMoney, OutgoingMoney):
+    post_save.connect(
+        statement_source_changed,
+        sender=_model,
+        dispatch_uid=f"statement_save_{_model.__name__}",
+    )
+    post_delete.connect(
+        statement_source_changed,
+        sender=_model,
+        dispatch_uid=f"statement_delete_{_model.__name__}",
+    )
+
+
+@receiver(post_save, sender=Partner)
+def partner_statements_changed(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        forget_partner(instance)
@@ -0,0 +1,137 @@
+import json
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import PartnerStatement
+from .partitions import add_months, month_start
+from .renderers import FastJSONRenderer
+from .reports import evaluate, partner_report_querysets, partner_report_response
+
+# Monthly partner statements: the partner report (api.reports) for one
+# TIME_ZONE month plus its totals. A closed month (any month before the
+# current one) is built once and stored as a PartnerStatement; the current
+# month is always built live. Saving or deleting a CryptoTransaction,
+# IncomingMoney or OutgoingMoney of a closed month drops the statements of
+# that month (api.signals), so a back-dated change is picked up on the next
+# request.
+
+# Report list -> amount fields summed in the totals. The money amounts and
+# usdt_price are summed per ``currency``; usdt_amount is always USDT.
+STATEMENT_AMOUNTS = {
+    "crypto_transactions": ("usdt_amount", "usdt_price"),
+    "crypto_transactions1": ("usdt_amount", "usdt_price"),
+    "incoming_money": ("money_amount",),
+    "incoming_money1": ("money_amount",),
+    "outgoing_money": ("money_amount",),
+    "outgoing_money1": ("money_amount",),
+}
+
+
+def current_month():
+    return timezone.localdate().replace(day=1)
+
+
+def parse_month(value):
+    """``YYYY-MM`` to the first day of that month, or None."""
+    try:
+        year, month = value.split("-")
+        return date(int(year), int(month), 1)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def is_closed(month):
+    return month < current_month()
+
+
+def statement_totals(results):
+    totals = {}
+    for key, fields in STATEMENT_AMOUNTS.items():
+        rows = results[key]
+        total = {"rows": len(rows)}
+        for field in fields:
+            if field == "usdt_amount":
+                total[field] = sum((row[field] for row in rows), Decimal(0))
+                continue
+            by_currency = defaultdict(Decimal)
+            for row in rows:
+                by_currency[row["currency"]] += row[field]
+            total[field] = dict(sorted(by_currency.items()))
+        totals[key] = total
+    return totals
+
+
+def build_statement(partner, month):
+    """The statement of ``month``, computed from the transaction tables."""
+    date_filter = {
+        "created_at__gte": month_start(month),
+        "created_at__lt": month_start(add_months(month, 1)),
+    }
+    report = partner_report_response(
+        partner, evaluate(partner_report_querysets(partner.name, date_filter))
+    )
+    return {
+        "partner": report.pop("partner"),
+        "month": f"{month:%Y-%m}",
+        "totals": statement_totals(report),
+        **report,
+    }
+
+
+def get_statement(partner, month):
+    """
+    ``(body, generated_at)``: stored for a closed month (built and stored
+    on first use), live for the current one (``generated_at`` is None).
+    """
+    if not is_closed(month):
+        return build_statement(partner, month), None
+    stored = PartnerStatement.objects.filter(partner=partner, month=month).first()
+    if stored is not None:
+        return stored.body, stored.generated_at
+    # Stored as rendered, so the stored and the live responses are the same JSON.
+    body = json.loads(FastJSONRenderer().render(build_statement(partner, month)))
+    try:
+        with transaction.atomic():
+            stored = PartnerStatement.objects.create(
+                partner=partner, month=month, body=body
+            )
+    except IntegrityError:
+        # A concurrent request stored it first.
+        stored = PartnerStatement.objects.get(partner=partner, month=month)
+    return stored.body, stored.generated_at
+
+
+def generate_statements(month, partners):
+    """Store the statements of a closed ``month``; returns how many were built."""
+    if not is_closed(month):
+        raise ValueError("Only closed months are stored.")
+    built = 0
+    for partner in partners:
+        if not PartnerStatement.objects.filter(partner=partner, month=month).exists():
+            get_statement(partner, month)
+            built += 1
+    return built
+
+
+# -----------------------------
+# Invalidation
+# -----------------------------
+def forget_month(moment):
+    """Drop the stored statements of the month of ``moment``, if it is closed."""
+    if moment is None:
+        return
+    month = timezone.localtime(moment).date().replace(day=1)
+    if not is_closed(month):
+        return
+    statements = PartnerStatement.objects.filter(month=month)
+    statements.delete()
+    # Again after commit: a statement built from pre-commit data meanwhile
+    # would otherwise stay.
+    transaction.on_commit(statements.delete)
+
+
+def forget_partner(partner):
+    """Statements carry the partner's name; a rename drops them."""
+    PartnerStatement.objects.filter(partner=partner).delete()
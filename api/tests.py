@@ -1,3 +1,1710 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from xml.etree import ElementTree
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.test import (
+    LiveServerTestCase,
+    RequestFactory,
+    TestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from . import async_views, metrics
+from .archive import ARCHIVED_MODELS, archive, latest_allowed_cutoff
+from .cache import get_rows, get_system_owner, reference_cache
+from .db_routers import ReplicaRouter
+from .events import ready_events
+from .exports import csv_stream
+from .instrumentation import collect_timings
+from .jobs import claim, enqueue, requeue_stale, run, task
+from .ledger import OWNER_CASH_SAFE, reconcile, replay
+from .middleware import PIN_COOKIE, PIN_HEADER, ReplicaRoutingMiddleware
+from .models import (
+    ArchivedTransaction,
+    ChangeEvent,
+    CryptoTransaction,
+    Debt,
+    DebtRepayment,
+    ExchangeRate,
+    IncomingMoney,
+    Job,
+    OutgoingMoney,
+    Partner,
+    PartnerStatement,
+    SafePartner,
+    SafeTransaction,
+    SafeType,
+    TransferExchange,
+    VersionConflict,
+)
+from .partitions import add_months, is_partitioned, month_start, partitioned_tables
+from .rates import MissingRate, invalidate_rate_book, rate_book, rewrites_label
+from .renderers import FastJSONRenderer
+from .reports import evaluate, portfolio_querysets, portfolio_response
+from .statements import current_month
+from .versions import bump_version
+from .warmup import warm_up
+
+# Fixture sizes for the query-count comparison: (rows, partners).
+SMALL = (40, 3)
+LARGE = (400, 12)
+ALL_DAYS = "start_date=2000-01-01"
+
+
+def seed(rows, partners):
+    # Rolled back tests reuse version numbers: start from empty caches.
+    cache.clear()
+    reference_cache().clear()
+    # The command runs in autocommit outside tests: let its version bumps land.
+    with TestCase.captureOnCommitCallbacks(execute=True):
+        call_command(
+            "seed_dataset",
+            rows=rows,
+            partners=partners,
+            days=2,
+            clear=True,
+            stdout=StringIO(),
+        )
+
+
+@contextmanager
+def one_query_thread():
+    # Async views keep their query threads and connections; swap in a single
+    # thread whose connection is closed afterwards, or the test database
+    # cannot be dropped.
+    pool = async_views._query_pool
+    async_views._query_pool = executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        yield
+    finally:
+        async_views._query_pool = pool
+        executor.submit(connections.close_all).result()
+        executor.shutdown()
+
+
+class QuietTimingLogMixin:
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # RequestTimingMiddleware logs a line per request.
+        logging.getLogger("api.timing").disabled = True
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.getLogger("api.timing").disabled = False
+        super().tearDownClass()
+
+
+class Fixture:
+    """Ids the scenarios need, looked up after seeding."""
+
+    def __init__(self):
+        self.cash = SafeType.objects.get(name=OWNER_CASH_SAFE).pk
+        self.crypto = SafeType.objects.get(type="Crypto").pk
+        owner = Partner.objects.get(is_system_owner=True)
+        self.owner = owner.pk
+        self.partner = Partner.objects.exclude(pk=owner.pk).order_by("pk")[0].pk
+        self.safes = list(
+            SafePartner.objects.filter(safe_type_id=self.cash)
+            .exclude(partner=owner)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:2]
+        )
+        self.debt = self.first(Debt)
+
+    def first(self, model):
+        return model.objects.order_by("pk").values_list("pk", flat=True)[0]
+
+
+# *************************
+# Endpoint query counts
+# *************************
+def read_scenarios(f):
+    """``(name, path)`` for every read action of the viewsets in api/views.py."""
+    return [
+        ("safe-types list", "/api/safe-types/"),
+        ("safe-types retrieve", f"/api/safe-types/{f.cash}/"),
+        ("partners list", "/api/partners/"),
+        ("partners retrieve", f"/api/partners/{f.partner}/"),
+        ("safe-partners list", "/api/safe-partners/"),
+        ("safe-partners list fast", "/api/safe-partners/?fast=1"),
+        ("safe-partners retrieve", f"/api/safe-partners/{f.safes[0]}/"),
+        ("crypto list", "/api/crypto-transactions/"),
+        ("crypto list filtered", f"/api/crypto-transactions/?{ALL_DAYS}"),
+        ("crypto list fast", f"/api/crypto-transactions/?{ALL_DAYS}&fast=1"),
+        (
+            "crypto list search",
+            f"/api/crypto-transactions/?{ALL_DAYS}&search=Partner",
+        ),
+        (
+            "crypto retrieve",
+            f"/api/crypto-transactions/{f.first(CryptoTransaction)}/",
+        ),
+        ("crypto export", f"/api/crypto-transactions/export/?{ALL_DAYS}"),
+        ("exchanges list", "/api/transfer-exchanges/"),
+        (
+            "exchanges retrieve",
+            f"/api/transfer-exchanges/{f.first(TransferExchange)}/",
+        ),
+        ("incoming list", f"/api/incoming-money/?{ALL_DAYS}"),
+        ("incoming list search", f"/api/incoming-money/?{ALL_DAYS}&search=a"),
+        ("incoming retrieve", f"/api/incoming-money/{f.first(IncomingMoney)}/"),
+        ("incoming export", f"/api/incoming-money/export/?{ALL_DAYS}"),
+        ("outgoing list", f"/api/outgoing-money/?{ALL_DAYS}"),
+        ("outgoing list search", f"/api/outgoing-money/?{ALL_DAYS}&search=a"),
+        ("outgoing retrieve", f"/api/outgoing-money/{f.first(OutgoingMoney)}/"),
+        ("outgoing export", f"/api/outgoing-money/export/?{ALL_DAYS}"),
+        ("safe-transactions list", f"/api/safe-transactions/?{ALL_DAYS}"),
+        (
+            "safe-transactions retrieve",
+            f"/api/safe-transactions/{f.first(SafeTransaction)}/?{ALL_DAYS}",
+        ),
+        ("safe-transactions export", f"/api/safe-transactions/export/?{ALL_DAYS}"),
+        ("debts list", "/api/debts/"),
+        ("debts retrieve", f"/api/debts/{f.debt}/"),
+        ("debt-repayments list", "/api/debt-repayments/"),
+        (
+            "debt-repayments retrieve",
+            f"/api/debt-repayments/{f.first(DebtRepayment)}/",
+        ),
+        ("bonuses today", "/api/bonuses/today/"),
+        ("bonuses month", "/api/bonuses/month/"),
+        ("partner report", f"/api/partners/{f.partner}/report/"),
+        ("pending total", "/api/outgoing/pending/total/"),
+        ("portfolio", "/api/portfolio/"),
+    ]
+
+
+def create_payloads(f):
+    partner, other = f.safes
+    return {
+        "crypto-transactions": {
+            "transaction_type": "Buy",
+            "partner": partner,
+            "usdt_amount": "10.00",
+            "usdt_price": "10.10",
+            "crypto_safe": f.crypto,
+            "payment_safe": f.cash,
+            "bonus": "0.20",
+            "bonus_currency": "USD",
+            "currency": "USD",
+            "status": "Pending",
+            "client_name": "query count",
+        },
+        "incoming-money": {
+            "from_partner": partner,
+            "to_partner": other,
+            "money_amount": "25.00",
+            "currency": "USD",
+            "status": "Pending",
+            "my_bonus": "1.00",
+            "partner_bonus": "1.00",
+            "bonus_currency": "USD",
+        },
+        "outgoing-money": {
+            "from_partner": partner,
+            "to_partner": other,
+            "money_amount": "25.00",
+            "currency": "USD",
+            "status": "Pending",
+            "taker_name": "query count",
+            "my_bonus": "1.00",
+            "partner_bonus": "1.00",
+            "bonus_currency": "USD",
+        },
+        "safe-transactions": {
+            "partner": partner,
+            "from_safepartner": partner,
+            "to_safepartner": other,
+            "transaction_type": "TRANSFER",
+            "money_amount": "5.00",
+            "currency": "USD",
+        },
+        "transfer-exchanges": {
+            "partner": partner,
+            "exchange_type": "USD_TO_IQD",
+            "usd_amount": "10.00",
+            "iqd_amount": 14500,
+            "exchange_rate": "1450.00",
+            "my_bonus": "0",
+            "bonus_currency": "USD",
+        },
+        "debts": {
+            "debt_safe_id": f.cash,
+            "safe_partner_id": partner,
+            "debtor_name": "query count",
+            "total_amount": "100.00",
+            "currency": "USD",
+        },
+        "debt-repayments": {
+            "debt_id": f.debt,
+            "safe_type_id": f.cash,
+            "amount": "1.00",
+            "currency": "USD",
+            "conversion_rate": "1",
+        },
+    }
+
+
+STATUS_PATCHES = {
+    "crypto-transactions": CryptoTransaction,
+    "incoming-money": IncomingMoney,
+    "outgoing-money": OutgoingMoney,
+}
+
+
+class EndpointQueryCountTests(QuietTimingLogMixin, TestCase):
+    """
+    Every viewset action must issue the same number of queries whatever the
+    fixture size; a difference means a per-row (N+1) query.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        user = User.objects.create_user("query-count", password="x", is_staff=True)
+        self.client.force_authenticate(user)
+
+    def count(self, method, path, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path, data, format="json")
+            if response.streaming:
+                b"".join(response.streaming_content)
+        self.assertLess(response.status_code, 400, f"{method} {path}")
+        return len(queries)
+
+    def measure_reads(self):
+        counts = {}
+        for name, path in read_scenarios(Fixture()):
+            # The first call fills the reference and version caches.
+            self.count("get", path)
+            counts[name] = self.count("get", path)
+        return counts
+
+    def measure_writes(self):
+        counts = {}
+        for prefix, payload in create_payloads(Fixture()).items():
+            self.count("post", f"/api/{prefix}/", payload)
+            counts[f"{prefix} create"] = self.count("post", f"/api/{prefix}/", payload)
+            model = STATUS_PATCHES.get(prefix)
+            if model is not None:
+                first, second = model.objects.order_by("-pk").values_list(
+                    "pk", flat=True
+                )[:2]
+                body = {"status": "Completed"}
+                self.count("patch", f"/api/{prefix}/{first}/", body)
+                counts[f"{prefix} status patch"] = self.count(
+                    "patch", f"/api/{prefix}/{second}/", body
+                )
+        return counts
+
+    def assertSameCounts(self, small, large):
+        self.assertEqual(small.keys(), large.keys())
+        for name in small:
+            with self.subTest(name):
+                self.assertEqual(
+                    small[name],
+                    large[name],
+                    f"{name}: {small[name]} queries at {SMALL[0]} rows, "
+                    f"{large[name]} at {LARGE[0]}",
+                )
+
+    def test_reads_are_constant(self):
+        seed(*SMALL)
+        small = self.measure_reads()
+        seed(*LARGE)
+        self.assertSameCounts(small, self.measure_reads())
+
+    def test_writes_are_constant(self):
+        seed(*SMALL)
+        small = self.measure_writes()
+        seed(*LARGE)
+        self.assertSameCounts(small, self.measure_writes())
+
+
+# *************************
+# Posting signal snapshots
+# *************************
+class PostingSignalQueryTests(QuietTimingLogMixin, TestCase):
+    """
+    Exact query counts of the balance-posting handlers in api/signals.py.
+    Update a number here only together with the handler change that
+    explains it.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(*SMALL)
+
+    def setUp(self):
+        self.f = Fixture()
+        self.partner, self.other = (
+            SafePartner.objects.get(pk=pk) for pk in self.f.safes
+        )
+        self.cash = SafeType.objects.get(pk=self.f.cash)
+        self.crypto = SafeType.objects.get(pk=self.f.crypto)
+        # Warm the owner-safe and version lookups shared by every handler.
+        self.crypto_transaction(status="Completed").delete()
+
+    def crypto_transaction(self, **kwargs):
+        values = dict(
+            transaction_type="Buy",
+            partner=self.partner,
+            usdt_amount=Decimal("10.00"),
+            usdt_price=Decimal("10.10"),
+            crypto_safe=self.crypto,
+            payment_safe=self.cash,
+            bonus=Decimal("0.20"),
+            bonus_currency="USD",
+            currency="USD",
+            status="Pending",
+        )
+        values.update(kwargs)
+        return CryptoTransaction.objects.create(**values)
+
+    def money(self, model, **kwargs):
+        values = dict(
+            from_partner=self.partner,
+            to_partner=self.other,
+            money_amount=Decimal("25.00"),
+            currency="USD",
+            status="Pending",
+            my_bonus=Decimal("1.00"),
+            partner_bonus=Decimal("1.00"),
+            bonus_currency="USD",
+        )
+        if model is OutgoingMoney:
+            values["taker_name"] = "query count"
+        values.update(kwargs)
+        return model.objects.create(**values)
+
+    def complete(self, instance):
+        instance.status = "Completed"
+        instance.save()
+
+    def assertPosting(self, expected, action):
+        with CaptureQueriesContext(connection) as queries:
+            action()
+        self.assertEqual(
+            len(queries),
+            expected,
+            "\n".join(query["sql"] for query in queries.captured_queries),
+        )
+
+    def test_crypto_transaction(self):
+        # Each includes the ExchangeRate write (api.rates) and the version
+        # check of the cached system owner (api.cache). Completing keeps the
+        # rate: an UPDATE that matches nothing and a SELECT, but no version
+        # bump that every process would have to follow.
+        self.assertPosting(13, lambda: self.crypto_transaction())
+        pending = self.crypto_transaction()
+        self.assertPosting(15, lambda: self.complete(pending))
+        self.assertPosting(13, lambda: self.crypto_transaction(status="Completed"))
+        self.assertPosting(13, pending.delete)
+
+    def test_incoming_money(self):
+        self.assertPosting(5, lambda: self.money(IncomingMoney))
+        pending = self.money(IncomingMoney)
+        self.assertPosting(10, lambda: self.complete(pending))
+        self.assertPosting(11, pending.delete)
+
+    def test_outgoing_money(self):
+        self.assertPosting(7, lambda: self.money(OutgoingMoney))
+        pending = self.money(OutgoingMoney)
+        self.assertPosting(12, lambda: self.complete(pending))
+        self.assertPosting(13, pending.delete)
+
+    def test_safe_transaction(self):
+        for transaction_type, expected in (("ADD", 5), ("REMOVE", 5)):
+            self.assertPosting(
+                expected,
+                lambda: SafeTransaction.objects.create(
+                    partner=self.partner,
+                    transaction_type=transaction_type,
+                    money_amount=Decimal("5.00"),
+                    currency="USD",
+                ),
+            )
+        self.assertPosting(
+            7,
+            lambda: SafeTransaction.objects.create(
+                partner=self.partner,
+                from_safepartner=self.partner,
+                to_safepartner=self.other,
+                transaction_type="TRANSFER",
+                money_amount=Decimal("5.00"),
+                currency="USD",
+            ),
+        )
+
+    def test_transfer_exchange(self):
+        self.assertPosting(
+            6,
+            lambda: TransferExchange.objects.create(
+                partner=self.partner,
+                exchange_type="USD_TO_IQD",
+                usd_amount=Decimal("10.00"),
+                iqd_amount=14500,
+                exchange_rate=Decimal("1450.00"),
+                bonus_currency="USD",
+            ),
+        )
+
+    def test_debt_and_repayment(self):
+        debt = Debt(
+            debt_safe=self.cash,
+            safe_partner=self.partner,
+            total_amount=Decimal("100.00"),
+            currency="USD",
+        )
+        self.assertPosting(3, debt.save)
+        self.assertPosting(
+            4,
+            lambda: DebtRepayment.objects.create(
+                debt=debt,
+                safe_type=self.cash,
+                amount=Decimal("10.00"),
+                currency="USD",
+                conversion_rate=Decimal("1"),
+            ),
+        )
+
+
+# *************************
+# Renderer and fast list path
+# *************************
+class FastJSONRendererTests(TestCase):
+    def test_output_matches_the_stock_renderer(self):
+        data = {
+            "amount": Decimal("1450.50"),
+            "at": timezone.now(),
+            "day": timezone.now().date(),
+            "label": gettext_lazy("Partner"),
+            "note": "line\u2028break",
+            None: [1, "دینار", None],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class FastListPathTests(QuietTimingLogMixin, TestCase):
+    paths = (
+        "/api/safe-partners/",
+        "/api/crypto-transactions/",
+        "/api/transfer-exchanges/",
+        "/api/incoming-money/",
+        "/api/outgoing-money/",
+        "/api/safe-transactions/",
+    )
+
+    def rows(self, response):
+        # Paginated bodies differ in their next/previous links (?fast=…).
+        body = response.json()
+        return body["results"] if isinstance(body, dict) else body
+
+    def test_fast_rows_match_the_serializer(self):
+        seed(*SMALL)
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="f", is_staff=True))
+        for path in self.paths:
+            with self.subTest(path):
+                query = f"{path}?{ALL_DAYS}&page_size=300"
+                slow = self.rows(client.get(f"{query}&fast=0"))
+                fast = self.rows(client.get(f"{query}&fast=1"))
+                self.assertTrue(slow)
+                self.assertEqual(fast, slow)
+
+
+# *************************
+# Sparse fieldsets
+# *************************
+class SparseFieldsetTests(QuietTimingLogMixin, TestCase):
+    path = f"/api/crypto-transactions/?{ALL_DAYS}&page_size=300"
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(*SMALL)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username="s", is_staff=True))
+        self.full = self.rows("")
+        self.assertTrue(self.full)
+
+    def rows(self, query):
+        body = self.client.get(f"{self.path}{query}").json()
+        return body["results"]
+
+    def assertRowsEqual(self, query, project):
+        expected = [project(row) for row in self.full]
+        for fast in ("0", "1"):
+            with self.subTest(query=query, fast=fast):
+                self.assertEqual(self.rows(f"{query}&fast={fast}"), expected)
+
+    def test_fields_keep_the_listed_paths(self):
+        def project(row):
+            partner = row["partner"]
+            if partner:
+                partner = {"partner": {"name": partner["partner"]["name"]}}
+            return {"id": row["id"], "status": row["status"], "partner": partner}
+
+        self.assertRowsEqual("&fields=id,status,partner.partner.name", project)
+
+    def test_expand_collapses_other_relations_to_ids(self):
+        def project(row):
+            row = dict(row)
+            for name in ("partner_client", "crypto_safe", "payment_safe"):
+                row[name] = row[name] and row[name]["id"]
+            if row["partner"]:
+                row["partner"] = dict(
+                    row["partner"],
+                    partner=row["partner"]["partner"]["id"],
+                    safe_type=row["partner"]["safe_type"]["id"],
+                )
+            return row
+
+        self.assertRowsEqual("&expand=partner", project)
+
+
+# *************************
+# Streaming exports
+# *************************
+class ExportTests(QuietTimingLogMixin, TestCase):
+    path = f"/api/incoming-money/export/?{ALL_DAYS}"
+    columns = (("id", "id"), ("from_partner", "from_partner__partner__name"))
+
+    @classmethod
+    def setUpTestData(cls):
+        seed(*SMALL)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username="x", is_staff=True))
+        self.ids = set(IncomingMoney.objects.values_list("pk", flat=True))
+        self.assertTrue(self.ids)
+
+    def download(self, query=""):
+        response = self.client.get(f"{self.path}{query}")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content)
+
+    def test_csv_has_every_filtered_row(self):
+        content = self.download().decode()
+        self.assertTrue(content.startswith("\ufeff"))
+        header, *rows = csv.reader(StringIO(content[1:]))
+        self.assertEqual(header[:3], ["id", "created_at", "status"])
+        self.assertEqual({int(row[0]) for row in rows}, self.ids)
+        self.assertEqual(len(rows), len(self.ids))
+
+    def test_csv_chunks_join_to_the_same_file(self):
+        queryset = IncomingMoney.objects.order_by("pk")
+        chunks = list(csv_stream(queryset, self.columns, chunk_size=3))
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual(b"".join(chunks), b"".join(csv_stream(queryset, self.columns)))
+
+    def test_xlsx_is_a_workbook_with_every_row(self):
+        workbook = zipfile.ZipFile(BytesIO(self.download("&export_format=xlsx")))
+        self.assertIsNone(workbook.testzip())
+        sheet = ElementTree.fromstring(workbook.read("xl/worksheets/sheet1.xml"))
+        self.assertEqual(len(sheet.findall(".//{*}row")), len(self.ids) + 1)
+
+    def test_unknown_format_is_rejected(self):
+        response = self.client.get(f"{self.path}&export_format=pdf")
+        self.assertEqual(response.status_code, 400)
+
+
+# *************************
+# Request timing
+# *************************
+class RequestTimingTests(TestCase):
+    path = "/api/safe-partners/"
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username="t", is_staff=True))
+
+    def get(self):
+        with self.assertLogs("api.timing", "INFO") as logs:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.path)
+        return response, json.loads(logs.records[0].getMessage()), len(queries)
+
+    def test_header_and_log_line_count_the_queries(self):
+        response, line, queries = self.get()
+        header = response["Server-Timing"]
+        self.assertEqual(
+            [metric.split(";")[0] for metric in header.split(", ")],
+            ["db", "signals", "serialize", "render", "total"],
+        )
+        self.assertIn(f'desc="{queries} queries"', header)
+        self.assertIn('desc="derived: view - db - signals"', header)
+        self.assertEqual(line["queries"], queries)
+        self.assertEqual(line["status"], 200)
+        self.assertEqual(line["path"], self.path)
+
+    def test_queries_of_the_async_reports_are_counted(self):
+        querysets = {
+            "partners": Partner.objects.all(),
+            "events": ChangeEvent.objects.all(),
+        }
+        with one_query_thread(), collect_timings() as timings:
+            results = asyncio.run(async_views.gather_querysets(querysets))
+        self.assertEqual(results, {"partners": [], "events": []})
+        self.assertEqual(timings.queries, 2)
+
+    @override_settings(SERVER_TIMING_HEADER=False, SLOW_REQUEST_MS=0)
+    def test_header_off_and_slow_requests_warn(self):
+        with self.assertLogs("api.timing.slow", "WARNING"):
+            response, _, _ = self.get()
+        self.assertNotIn("Server-Timing", response)
+
+
+# *************************
+# Conditional GET (ETags)
+# *************************
+class ConditionalGetTests(QuietTimingLogMixin, TestCase):
+    path = "/api/partners/"
+
+    def setUp(self):
+        Partner.objects.create(name="etag")
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username="e", is_staff=True))
+
+    def test_matching_etag_answers_304_without_reading_the_table(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Last-Modified", response)
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(self.path, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached["ETag"], response["ETag"])
+        self.assertFalse(
+            [q for q in queries.captured_queries if "api_partner" in q["sql"]]
+        )
+        # If-Modified-Since alone is not honoured: the lists depend on the date.
+        since = self.client.get(self.path, HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(since.status_code, 200)
+
+    def test_a_write_changes_the_etag(self):
+        etag = self.client.get(self.path)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Partner.objects.create(name="new")
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_the_etag_varies_with_the_accepted_format(self):
+        json_response = self.client.get(self.path)
+        html_response = self.client.get(self.path, HTTP_ACCEPT="text/html")
+        self.assertIn("Accept", json_response["Vary"])
+        self.assertNotEqual(json_response["ETag"], html_response["ETag"])
+        response = self.client.get(
+            self.path, HTTP_ACCEPT="text/html", HTTP_IF_NONE_MATCH=json_response["ETag"]
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+# *************************
+# Reference cache
+# *************************
+class ReferenceCacheTests(QuietTimingLogMixin, TestCase):
+    def setUp(self):
+        reference_cache().clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.partner = Partner.objects.create(name="cached")
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create(username="ref", is_staff=True)
+        )
+
+    def create_safe_partner(self, safe_type):
+        return self.client.post(
+            "/api/safe-partners/",
+            {"partner_id": self.partner.pk, "safe_type_id": safe_type.pk},
+            format="json",
+        )
+
+    def test_a_version_bump_from_another_process_refreshes_the_rows(self):
+        self.assertEqual(get_rows(Partner)[self.partner.pk].name, "cached")
+        # Another worker: no signal reaches this process, only the version.
+        Partner.objects.filter(pk=self.partner.pk).update(name="renamed")
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_version(Partner)
+        self.assertEqual(get_rows(Partner)[self.partner.pk].name, "renamed")
+
+    def test_rows_of_a_rolled_back_transaction_are_not_cached(self):
+        get_rows(Partner)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            ghost = Partner.objects.create(name="ghost")
+            self.assertIn(ghost.pk, get_rows(Partner))
+            raise RuntimeError
+        self.assertNotIn(ghost.pk, get_rows(Partner))
+
+    def test_writes_resolve_reference_ids_from_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cash, bank = (
+                SafeType.objects.create(name=name, type="Physical")
+                for name in ("cash", "bank")
+            )
+        self.assertEqual(self.create_safe_partner(cash).status_code, 201)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.create_safe_partner(bank)
+        self.assertEqual(response.status_code, 201)
+        sql = [query["sql"] for query in queries]
+        self.assertEqual(
+            [q for q in sql if '"api_partner"' in q or '"api_safetype"' in q], []
+        )
+        # One version read per model for the whole request.
+        self.assertEqual(sum('"api_dataversion"' in q for q in sql), 2)
+
+    def test_a_partner_deleted_elsewhere_is_rejected(self):
+        safe_type = SafeType.objects.create(name="cash", type="Physical")
+        get_rows(Partner)
+        Partner.objects.filter(pk=self.partner.pk)._raw_delete(connection.alias)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_version(Partner)
+        response = self.create_safe_partner(safe_type)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("partner_id", response.json())
+
+
+# *************************
+# Read replica routing
+# *************************
+@override_settings(REPLICA_DATABASE_ALIAS="default")  # stands in for a replica
+class ReplicaPinTests(TestCase):
+    def routed_alias(self, **headers):
+        """
+        The alias a list read goes to, seen by a new middleware instance: no
+        state is shared with the worker that served the write.
+        """
+        middleware = ReplicaRoutingMiddleware(
+            lambda request: HttpResponse(ReplicaRouter().db_for_read(Partner) or "")
+        )
+        request = RequestFactory().get("/api/partners/", **headers)
+        return middleware(request).content.decode() or "primary"
+
+    def test_a_write_pins_the_client_to_the_primary_in_every_worker(self):
+        middleware = ReplicaRoutingMiddleware(lambda request: HttpResponse(status=201))
+        response = middleware(RequestFactory().post("/api/partners/"))
+        pin = response[PIN_HEADER]
+        self.assertEqual(response.cookies[PIN_COOKIE].value, pin)
+
+        self.assertEqual(self.routed_alias(), "default")
+        self.assertEqual(self.routed_alias(HTTP_PRIMARY_PIN=pin), "primary")
+        cookie = f"{PIN_COOKIE}={pin}"
+        self.assertEqual(self.routed_alias(HTTP_COOKIE=cookie), "primary")
+        self.assertEqual(self.routed_alias(HTTP_PRIMARY_PIN=pin + "x"), "default")
+        with override_settings(REPLICA_PIN_SECONDS=-1):
+            self.assertEqual(self.routed_alias(HTTP_PRIMARY_PIN=pin), "default")
+
+
+# *************************
+# Metrics
+# *************************
+class MetricsTests(QuietTimingLogMixin, TestCase):
+    def test_the_endpoint_needs_the_token_even_locally(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        with override_settings(METRICS_TOKEN="scrape"):
+            self.assertEqual(self.client.get("/metrics").status_code, 403)
+            response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b"# TYPE api_postings_total counter", response.content)
+
+    def test_files_of_exited_workers_fold_into_the_aggregate(self):
+        exited = subprocess.Popen([sys.executable, "-c", "pass"])
+        exited.wait()
+        sample = [["api_postings_total", [["model", "x"]], 2.0]]
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(METRICS_DIR=directory):
+                for name in (f"metrics-{exited.pid}.json", metrics.AGGREGATE_FILE):
+                    with open(os.path.join(directory, name), "w") as fh:
+                        json.dump(sample, fh)
+                key = ("api_postings_total", (("model", "x"),))
+                self.assertEqual(metrics.collect()[key], 4.0)
+                self.assertEqual(metrics.collect()[key], 4.0)
+                left = os.listdir(directory)
+                self.assertNotIn(f"metrics-{exited.pid}.json", left)
+
+    def test_counting_writes_no_file_and_concurrent_flushes_do_not_collide(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(METRICS_DIR=directory, METRICS_FLUSH_SECONDS=60):
+                metrics.POSTINGS.inc(model="x", type="t", currency="USD", action="a")
+                self.assertEqual(os.listdir(directory), [])
+
+                errors = []
+
+                def flush_repeatedly():
+                    try:
+                        for _ in range(50):
+                            metrics.flush()
+                    except OSError as exc:
+                        errors.append(exc)
+
+                threads = [threading.Thread(target=flush_repeatedly) for _ in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(errors, [])
+                left = os.listdir(directory)
+                self.assertIn(f"metrics-{os.getpid()}.json", left)
+                self.assertEqual([name for name in left if name.endswith(".tmp")], [])
+
+
+# *************************
+# Change feed
+# *************************
+class ChangeEventFeedTests(QuietTimingLogMixin, TestCase):
+    def setUp(self):
+        user = User.objects.create(username="feed", is_staff=True)
+        self.token = str(AccessToken.for_user(user))
+
+    def log(self, *topics):
+        return [
+            ChangeEvent.objects.create(topic=topic, action="updated", object_id=1)
+            for topic in topics
+        ]
+
+    def test_an_id_gap_holds_later_events_back_for_the_commit_window(self):
+        first, missing, last = self.log("incomingmoney", "incomingmoney", "safepartner")
+        missing.delete()  # inserted, not committed yet
+        events = list(ChangeEvent.objects.order_by("pk"))
+
+        self.assertEqual(ready_events(events, first.pk - 1), [first])
+        ChangeEvent.objects.filter(pk=last.pk).update(
+            created_at=timezone.now() - timedelta(minutes=1)
+        )
+        events = list(ChangeEvent.objects.order_by("pk"))
+        self.assertEqual(ready_events(events, first.pk - 1), [first, last])
+
+    def ticket(self):
+        response = self.client.post(
+            "/api/events/ticket/", HTTP_AUTHORIZATION=f"Bearer {self.token}"
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()["ticket"]
+
+    def test_wsgi_request_gets_one_batch_and_a_retry(self):
+        first, other, last = self.log("incomingmoney", "safepartner", "incomingmoney")
+
+        response = self.client.get(
+            f"/api/events/?ticket={self.ticket()}&topics=incomingmoney",
+            HTTP_LAST_EVENT_ID=str(first.pk - 1),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.streaming)
+        body = response.content.decode()
+        self.assertTrue(body.startswith("retry: "))
+        self.assertEqual(
+            [line for line in body.splitlines() if line.startswith("id: ")],
+            [f"id: {first.pk}", f"id: {last.pk}", f"id: {last.pk}"],
+        )
+        self.assertNotIn("event: safepartner", body)
+
+    def test_a_ticket_opens_one_stream_and_tokens_stay_out_of_the_url(self):
+        path = f"/api/events/?ticket={self.ticket()}"
+        self.assertEqual(self.client.get(path).status_code, 200)
+        self.assertEqual(self.client.get(path).status_code, 401)
+        self.assertEqual(
+            self.client.get(f"/api/events/?token={self.token}").status_code, 401
+        )
+        bearer = self.client.get(
+            "/api/events/", HTTP_AUTHORIZATION=f"Bearer {self.token}"
+        )
+        self.assertEqual(bearer.status_code, 200)
+
+    @override_settings(SSE_POLL_INTERVAL=0.01, SSE_COMMIT_WINDOW=0)
+    async def test_streams_share_one_poller(self):
+        logged = await ChangeEvent.objects.acreate(
+            topic="incomingmoney", action="created", object_id=1
+        )
+        behind = async_views._event_stream(logged.pk - 1, [])
+        current = async_views._event_stream(logged.pk, [])
+        for stream in (behind, current):
+            self.assertTrue((await anext(stream)).startswith("retry: "))
+        # The stream that reconnected behind the poller catches up from the log.
+        self.assertIn(f"id: {logged.pk}\n", await anext(behind))
+        waiting = [asyncio.ensure_future(anext(stream)) for stream in (behind, current)]
+        await asyncio.sleep(0.05)
+        broadcaster = async_views._event_broadcaster()
+        self.assertEqual(len(broadcaster.feeds), 2)
+
+        new = await ChangeEvent.objects.acreate(
+            topic="safepartner", action="updated", object_id=2
+        )
+        messages = await asyncio.wait_for(asyncio.gather(*waiting), 5)
+        self.assertEqual([m.split("\n")[0] for m in messages], [f"id: {new.pk}"] * 2)
+
+        for stream in (behind, current):
+            await stream.aclose()
+        await asyncio.wait_for(broadcaster.task, 5)
+        self.assertEqual(broadcaster.feeds, set())
+        self.assertIsNone(broadcaster.last_id)
+
+
+# *************************
+# Ledger replay
+# *************************
+class LedgerReplayTests(QuietTimingLogMixin, TestCase):
+    def test_cross_currency_repayments_reconcile(self):
+        seed(*SMALL)
+        f = Fixture()
+        partner = SafePartner.objects.get(pk=f.safes[0])
+        cash = SafeType.objects.get(pk=f.cash)
+        crypto = SafeType.objects.get(pk=f.crypto)
+        usd = Debt.objects.create(
+            debt_safe=cash, safe_partner=partner, total_amount=Decimal("100.00")
+        )
+        iqd = Debt.objects.create(
+            debt_safe=cash,
+            safe_partner=partner,
+            total_amount=Decimal("150000"),
+            currency="IQD",
+        )
+        # IQD into a USD debt (the second overpays) and USD into an IQD debt,
+        # each into the debt's owner safe and into another one.
+        for debt, amount, currency, rate, safe_type in (
+            (usd, "72500", "IQD", "1450", crypto),
+            (usd, "58000", "IQD", "1450", cash),
+            (iqd, "33.33", "USD", "1457.5", cash),
+            (iqd, "20", "USD", "1450", crypto),
+        ):
+            DebtRepayment.objects.create(
+                debt=debt,
+                safe_type=safe_type,
+                amount=Decimal(amount),
+                currency=currency,
+                conversion_rate=Decimal(rate),
+            )
+
+        self.assertEqual(reconcile(replay()), [])
+
+
+# *************************
+# Archive
+# *************************
+class ArchiveTests(QuietTimingLogMixin, TestCase):
+    def safe_partner_balances(self):
+        return {
+            pk: balances
+            for pk, *balances in SafePartner.objects.values_list(
+                "pk", "total_usd", "total_usdt", "total_iqd"
+            )
+        }
+
+    def test_archiving_keeps_balances_and_the_replay(self):
+        seed(*SMALL)
+        # Back-date the rows (without signals) into last month.
+        last_month = month_start(add_months(current_month(), -1))
+        for model in ARCHIVED_MODELS.values():
+            model.objects.update(created_at=last_month + timedelta(days=3))
+        stored = self.safe_partner_balances()
+        before = replay()
+        self.assertEqual(reconcile(before), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            counts = archive(latest_allowed_cutoff(), batch_size=25)
+        archived = sum(counts.values())
+        self.assertTrue(all(counts.values()), counts)
+
+        after = replay()
+        self.assertEqual(self.safe_partner_balances(), stored)
+        self.assertEqual(
+            {pk: after.get(pk) for pk in stored}, {pk: before.get(pk) for pk in stored}
+        )
+        self.assertEqual(reconcile(after), [])
+        self.assertEqual(ArchivedTransaction.objects.count(), archived)
+        self.assertEqual(ChangeEvent.objects.filter(action="deleted").count(), archived)
+
+
+# *************************
+# Partitioning (PostgreSQL)
+# *************************
+@unittest.skipUnless(
+    connection.vendor == "postgresql", "Partitioning needs PostgreSQL."
+)
+class PartitionTableTests(QuietTimingLogMixin, TestCase):
+    """partition_tables forward and back on seeded data loses nothing."""
+
+    def snapshot(self):
+        state = {"history": SafePartner.history.count()}
+        with connection.cursor() as cursor:
+            for table in partitioned_tables(apps):
+                cursor.execute(f'SELECT COUNT(*), MAX(id) FROM "{table}"')
+                rows, highest = cursor.fetchone()
+                cursor.execute(
+                    "SELECT array_agg(pg_get_constraintdef(oid) ORDER BY conname) "
+                    "FROM pg_constraint WHERE conrelid = to_regclass(%s) "
+                    "AND contype = 'f'",
+                    [table],
+                )
+                state[table] = {"rows": rows, "fks": cursor.fetchone()[0]}
+                state[table]["highest"] = highest
+        return state
+
+    def assert_next_ids_follow(self, state):
+        with connection.cursor() as cursor:
+            for table in partitioned_tables(apps):
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, 'id'))", [table]
+                )
+                self.assertGreater(cursor.fetchone()[0], state[table]["highest"])
+
+    def assert_partitioned(self, expected):
+        with connection.cursor() as cursor:
+            for table in partitioned_tables(apps):
+                self.assertEqual(is_partitioned(cursor, table), expected)
+
+    def test_forward_and_back_keep_rows_keys_history_and_sequences(self):
+        seed(*SMALL)
+        before = self.snapshot()
+        self.assertTrue(all(before[t]["fks"] for t in partitioned_tables(apps)))
+
+        call_command("partition_tables", stdout=StringIO())
+        self.assert_partitioned(True)
+        self.assertEqual(self.snapshot(), before)
+        self.assert_next_ids_follow(before)
+
+        # New rows go through the ORM into the partitions.
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="p", is_staff=True))
+        payloads = create_payloads(Fixture())
+        for basename in ("crypto-transactions", "incoming-money", "outgoing-money"):
+            path, payload = f"/api/{basename}/", payloads[basename]
+            response = client.post(path, payload, format="json")
+            self.assertEqual(response.status_code, 201, response.content)
+        partitioned = self.snapshot()
+
+        call_command("partition_tables", reverse=True, stdout=StringIO())
+        self.assert_partitioned(False)
+        self.assertEqual(self.snapshot(), partitioned)
+        self.assert_next_ids_follow(partitioned)
+
+    def test_new_partitions_take_over_rows_from_the_default(self):
+        seed(*SMALL)
+        call_command("partition_tables", months=0, stdout=StringIO())
+        table = CryptoTransaction._meta.db_table
+        ahead = add_months(timezone.localdate().replace(day=1), 2)
+        moved = CryptoTransaction.objects.order_by("pk").first()
+        CryptoTransaction.objects.filter(pk=moved.pk).update(
+            created_at=month_start(ahead) + timedelta(days=3)
+        )
+        query = 'SELECT array_agg(id) FROM "{}"'
+        with connection.cursor() as cursor:
+            cursor.execute(query.format(f"{table}_default"))
+            self.assertEqual(cursor.fetchone()[0], [moved.pk])
+
+            call_command("create_partitions", months=2, stdout=StringIO())
+            cursor.execute(query.format(f"{table}_default"))
+            self.assertIsNone(cursor.fetchone()[0])
+            cursor.execute(query.format(f"{table}_p{ahead:%Y%m}"))
+            self.assertEqual(cursor.fetchone()[0], [moved.pk])
+        self.assertTrue(CryptoTransaction.objects.filter(pk=moved.pk).exists())
+
+
+# *************************
+# Exchange rates
+# *************************
+class RateBookTests(QuietTimingLogMixin, TestCase):
+    def setUp(self):
+        invalidate_rate_book()  # rates below are written without the signals
+
+    def rate(self, pair, rate, days_ago, source_id):
+        ExchangeRate.objects.create(
+            pair=pair,
+            rate=Decimal(rate),
+            observed_at=timezone.now() - timedelta(days=days_ago),
+            source="exchange",
+            source_id=source_id,
+        )
+
+    def test_as_of_lookups(self):
+        self.rate("USD_IQD", "1400", 10, 1)
+        self.rate("USD_IQD", "1500", 5, 2)
+        self.rate("USDT_USD", "1.01", 5, 3)
+        book = rate_book()
+        with self.assertNumQueries(1):  # the version check
+            self.assertEqual(rate_book().rate("USD_IQD"), Decimal("1500"))
+        week_ago = timezone.now() - timedelta(days=7)
+        self.assertEqual(book.rate("USD_IQD", week_ago), Decimal("1400"))
+        # Nothing was known before the first observation.
+        with self.assertRaises(MissingRate):
+            book.rate("USD_IQD", week_ago.replace(year=2000))
+        with self.assertRaises(MissingRate):
+            book.convert(Decimal("1"), "USD", "IQD", week_ago.replace(year=2000))
+        self.assertEqual(
+            book.convert(Decimal("100"), "USDT", "IQD"), Decimal("151500")
+        )
+        self.assertEqual(book.convert(Decimal("2800"), "IQD", "USD", week_ago), 2)
+
+    def test_writes_of_other_processes_are_read_incrementally(self):
+        self.rate("USD_IQD", "1400", 10, 1)
+        self.rate("USDT_USD", "1.01", 5, 2)
+        book = rate_book()
+        # Another process: rows and version bumps, no signals in this one.
+        self.rate("USD_IQD", "1500", 5, 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_version(ExchangeRate)
+        with self.assertNumQueries(3):  # versions, row counts, the new row
+            self.assertIs(rate_book(), book)
+        self.assertEqual(book.rate("USD_IQD"), Decimal("1500"))
+
+        ExchangeRate.objects.filter(source_id=1).update(rate=Decimal("1300"))
+        ExchangeRate.objects.filter(source_id=2).delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_version(rewrites_label("USD_IQD"))
+            bump_version(ExchangeRate)
+        week_ago = timezone.now() - timedelta(days=7)
+        self.assertEqual(rate_book().rate("USD_IQD", week_ago), Decimal("1300"))
+        with self.assertRaises(MissingRate):
+            book.rate("USDT_USD")
+
+    def test_portfolio_values_balances_that_cancel_out(self):
+        self.rate("USDT_USD", "1.01", 1, 1)
+        safe_type = SafeType.objects.create(name="wallet", type="Crypto")
+        for name, usdt in (("A", "5.00"), ("B", "-5.00")):
+            SafePartner.objects.create(
+                partner=Partner.objects.create(name=name),
+                safe_type=safe_type,
+                total_usdt=Decimal(usdt),
+            )
+        result = portfolio_response(evaluate(portfolio_querysets()), rate_book())
+        self.assertEqual(
+            [row["value_usd"] for row in result["by_partner"]],
+            [Decimal("5.05"), Decimal("-5.05")],
+        )
+        self.assertEqual(result["total"]["value_usd"], Decimal("0.00"))
+
+    def test_recorded_from_exchanges(self):
+        with self.assertRaises(MissingRate):
+            rate_book().rate("USD_IQD")
+        seed(*SMALL)
+        exchange = TransferExchange.objects.earliest("pk")
+        exchange.exchange_rate = Decimal("1234.00")
+        exchange.save()
+        self.assertEqual(
+            ExchangeRate.objects.get(source="exchange", source_id=exchange.pk).rate,
+            Decimal("1234"),
+        )
+        exchange.delete()
+        self.assertFalse(
+            ExchangeRate.objects.filter(source_id=exchange.pk, source="exchange")
+        )
+        self.assertTrue(rate_book().rate("USD_IQD"))
+
+
+# *************************
+# Idempotency keys
+# *************************
+class IdempotencyKeyTests(QuietTimingLogMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed(*SMALL)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("retry", password="x"))
+        self.payload = create_payloads(Fixture())["incoming-money"]
+
+    def post(self, key, payload=None):
+        return self.client.post(
+            "/api/incoming-money/",
+            payload or self.payload,
+            format="json",
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retry_replays_without_writes(self):
+        rows = IncomingMoney.objects.count()
+        first = self.post("retry-1")
+        self.assertEqual(first.status_code, 201)
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.post("retry-1")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(
+            [query["sql"].split()[0] for query in queries.captured_queries],
+            ["SELECT"],
+        )
+        self.assertEqual(IncomingMoney.objects.count(), rows + 1)
+
+    def test_key_reused_for_another_request(self):
+        self.post("retry-2")
+        response = self.post("retry-2", {**self.payload, "money_amount": "26.00"})
+        self.assertEqual(response.status_code, 422)
+
+    def test_failed_request_releases_the_key(self):
+        invalid = {**self.payload, "currency": "XXX"}
+        self.assertEqual(self.post("retry-3", invalid).status_code, 400)
+        self.assertEqual(self.post("retry-3").status_code, 201)
+
+
+# *************************
+# Row versions (If-Match)
+# *************************
+class RowVersionTests(QuietTimingLogMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed(*SMALL)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("editor", password="x"))
+        self.row = OutgoingMoney.objects.filter(status="Pending").earliest("pk")
+        self.path = f"/api/outgoing-money/{self.row.pk}/"
+
+    def patch(self, if_match, body=None):
+        return self.client.patch(
+            self.path, body or {"note": "x"}, format="json", HTTP_IF_MATCH=if_match
+        )
+
+    def test_retrieve_etag_carries_the_row_version(self):
+        etag = self.client.get(self.path)["ETag"]
+        self.assertTrue(etag.startswith(f'"{self.row.version}.'))
+        response = self.patch(etag, {"my_bonus": "2.00"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], f'"{self.row.version + 1}"')
+
+    def test_stale_write_is_rejected(self):
+        self.assertEqual(self.patch(f'"{self.row.version}"').status_code, 200)
+        stale = self.patch(f'"{self.row.version}"')
+        self.assertEqual(stale.status_code, 412)
+        self.assertEqual(stale["ETag"], f'"{self.row.version + 1}"')
+        # Without If-Match writes stay unconditional.
+        response = self.client.patch(self.path, {}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+    def test_postings_bump_safe_partner_versions(self):
+        safe_partner = SafePartner.objects.get(pk=self.row.from_partner_id)
+        self.patch("*", {"status": "Completed"})
+        safe_partner.refresh_from_db()
+        self.assertGreater(safe_partner.version, 1)
+
+    def test_stale_copies_post_increments(self):
+        first = SafePartner.objects.earliest("pk")
+        second = SafePartner.objects.get(pk=first.pk)
+        first.total_usd += Decimal("11.00")
+        first.save()
+        second.total_usd += Decimal("5.00")
+        second.total_iqd += 1000
+        second.save()
+        stored = SafePartner.objects.get(pk=first.pk)
+        self.assertEqual(stored.total_usd, first.total_usd + Decimal("5.00"))
+        self.assertEqual(stored.total_iqd, second.total_iqd)
+        self.assertEqual(stored.version, 3)
+
+    def test_stale_checked_save_raises_a_conflict(self):
+        first = SafePartner.objects.earliest("pk")
+        second = SafePartner.objects.get(pk=first.pk)
+        first.total_usd = Decimal("11.00")
+        first.save()
+        second.total_usd = Decimal("99.00")
+        second.check_version = True
+        with self.assertRaises(VersionConflict), transaction.atomic():
+            second.save()
+        # The conflict refreshed the version: a deliberate retry goes through.
+        self.assertEqual(second.version, first.version)
+        stored = SafePartner.objects.get(pk=first.pk)
+        self.assertEqual((stored.total_usd, stored.version), (Decimal("11.00"), 2))
+
+    def test_posting_through_the_owner_safe(self):
+        # The handler holds the owner safe twice: as from_partner and as
+        # the owner's bonus safe.
+        owner_cash = SafePartner.objects.get(
+            partner__is_system_owner=True, safe_type__name=OWNER_CASH_SAFE
+        )
+        response = self.client.post(
+            "/api/incoming-money/",
+            {
+                "from_partner": owner_cash.pk,
+                "to_partner": self.row.to_partner_id,
+                "money_amount": "100.00",
+                "currency": "USD",
+                "status": "Completed",
+                "my_bonus": "3.00",
+                "partner_bonus": "2.00",
+                "bonus_currency": "USD",
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        stored = SafePartner.objects.get(pk=owner_cash.pk)
+        self.assertEqual(stored.total_usd, owner_cash.total_usd - Decimal("95.00"))
+        self.assertEqual(reconcile(), [])
+
+    def test_retrieve_answers_304_without_a_version_query(self):
+        etag = self.client.get(self.path)["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertFalse(
+            [q for q in queries if "api_outgoingmoney" in q["sql"]], queries
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patch(etag)
+        self.assertEqual(
+            self.client.get(self.path, HTTP_IF_NONE_MATCH=etag).status_code, 200
+        )
+
+
+# *************************
+# Background jobs
+# *************************
+@task("test_flaky")
+def flaky(fail_times):
+    if Job.objects.get(task="test_flaky").attempts <= fail_times:
+        raise RuntimeError("not yet")
+    return {"ok": True}
+
+
+class JobTests(QuietTimingLogMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("jobs", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_claim_follows_priority_and_run_after(self):
+        later = enqueue("prune_idempotency_keys", delay=timedelta(hours=1))
+        low = enqueue("prune_idempotency_keys")
+        high = enqueue("prune_idempotency_keys", priority=5)
+        self.assertEqual(claim("w").pk, high.pk)
+        self.assertEqual(claim("w").pk, low.pk)
+        self.assertIsNone(claim("w"))
+        later.refresh_from_db()
+        self.assertEqual(later.status, "queued")
+
+    def test_failed_job_is_retried_then_given_up(self):
+        job = enqueue("test_flaky", {"fail_times": 1})
+        self.assertFalse(run(claim("w")))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("queued", 1))
+        self.assertIn("not yet", job.error)
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertTrue(run(claim("w")))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), ("done", {"ok": True}))
+
+        job = enqueue("test_flaky", {"fail_times": 9}, max_attempts=1)
+        Job.objects.exclude(pk=job.pk).delete()
+        self.assertFalse(run(claim("w")))
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+
+    def test_only_jobs_with_a_quiet_heartbeat_are_given_back(self):
+        long_running = enqueue("prune_idempotency_keys", priority=1)
+        dead = enqueue("prune_idempotency_keys")
+        claim("alive")
+        claim("dead")
+        hour_ago = timezone.now() - timedelta(hours=1)
+        Job.objects.update(started_at=hour_ago)
+        Job.objects.filter(pk=dead.pk).update(heartbeat_at=hour_ago)
+
+        self.assertEqual(requeue_stale(), 1)
+        statuses = dict(Job.objects.values_list("pk", "status"))
+        self.assertEqual(statuses, {long_running.pk: "running", dead.pk: "queued"})
+
+    def test_a_given_back_attempt_does_not_overwrite_the_new_one(self):
+        enqueue("prune_idempotency_keys")
+        first = claim("w1")
+        Job.objects.filter(pk=first.pk).update(
+            heartbeat_at=timezone.now() - timedelta(hours=1)
+        )
+        requeue_stale()
+        second = claim("w2")
+
+        with self.assertLogs("api.jobs", "WARNING"):
+            self.assertFalse(run(first))
+        second.refresh_from_db()
+        self.assertEqual((second.status, second.locked_by), ("running", "w2"))
+        self.assertTrue(run(second))
+
+    def test_api_enqueues_allowed_tasks_only(self):
+        for name in ("reconcile", "test_flaky"):
+            response = self.client.post("/api/jobs/", {"task": name}, format="json")
+            self.assertEqual(response.status_code, 403)
+        response = self.client.post(
+            "/api/jobs/", {"task": "no_such_task"}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        other = enqueue("prune_idempotency_keys")
+        response = self.client.get("/api/jobs/")
+        self.assertNotIn(other.pk, [job["id"] for job in response.json()["results"]])
+
+    def test_background_export_writes_a_file(self):
+        seed(*SMALL)
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            JOB_OUTPUT_DIR=directory
+        ):
+            path = f"/api/outgoing-money/export/?export_format=csv&{ALL_DAYS}"
+            inline = self.client.get(path)
+            expected = b"".join(inline.streaming_content).decode().splitlines()
+            response = self.client.get(path + "&background=1")
+            self.assertEqual(response.status_code, 202)
+            call_command("run_jobs", once=True, stdout=StringIO())
+            job = Job.objects.get(pk=response.json()["job"])
+            self.assertEqual(job.status, "done", job.error)
+            download = self.client.get(f"/api/jobs/{job.pk}/download/")
+            self.assertEqual(download.status_code, 200)
+            lines = b"".join(download.streaming_content).decode().splitlines()
+            self.assertEqual(lines, expected)
+            self.assertGreater(len(lines), 1)
+
+
+# *************************
+# Partner statements
+# *************************
+class PartnerStatementTests(QuietTimingLogMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed(*SMALL)
+        cls.month = add_months(current_month(), -1)
+        # Back-date the outgoing rows (without signals) into last month.
+        OutgoingMoney.objects.update(
+            created_at=month_start(cls.month) + timedelta(days=14)
+        )
+        cls.row = OutgoingMoney.objects.earliest("pk")
+        cls.partner = SafePartner.objects.get(pk=cls.row.from_partner_id).partner
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("reader"))
+        self.path = f"/api/partners/{self.partner.pk}/statement/"
+
+    def get(self, month):
+        response = self.client.get(self.path, {"month": f"{month:%Y-%m}"})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_closed_month_is_stored_and_served(self):
+        first = self.get(self.month)
+        self.assertTrue(first["closed"])
+        self.assertEqual(
+            first["totals"]["outgoing_money"]["rows"], len(first["outgoing_money"])
+        )
+        self.assertIn(self.row.pk, [row["id"] for row in first["outgoing_money"]])
+        self.assertEqual(PartnerStatement.objects.count(), 1)
+        with CaptureQueriesContext(connection) as stored:
+            again = self.get(self.month)
+        self.assertEqual(again, first)
+        self.assertLessEqual(len(stored), 3)
+
+    def test_back_dated_change_drops_the_month(self):
+        self.get(self.month)
+        self.row.note = "corrected"
+        self.row.save()
+        self.assertFalse(PartnerStatement.objects.exists())
+        rows = {row["id"]: row for row in self.get(self.month)["outgoing_money"]}
+        self.assertEqual(rows[self.row.pk]["note"], "corrected")
+
+    def test_current_month_is_live(self):
+        body = self.get(current_month())
+        self.assertEqual((body["closed"], body["generated_at"]), (False, None))
+        self.assertEqual(body["outgoing_money"], [])
+        self.assertFalse(PartnerStatement.objects.exists())
+        future = self.client.get(self.path, {"month": "2999-01"})
+        self.assertEqual(future.status_code, 400)
+
+
+    def test_seed_clear_removes_stored_statements(self):
+        self.get(self.month)
+        seed(*SMALL)
+        self.assertFalse(PartnerStatement.objects.exists())
+        connection.check_constraints()
+
+# *************************
+# Worker warm-up
+# *************************
+class WarmUpTests(QuietTimingLogMixin, TestCase):
+    def test_warm_up_fills_the_process_caches(self):
+        seed(*SMALL)
+        reference_cache().clear()
+        with self.assertNoLogs("api.warmup", "WARNING"):
+            timings = warm_up(connect=False)
+        self.assertNotIn("connections", timings)
+        with self.assertNumQueries(2):  # only the version checks
+            get_system_owner()
+            rate_book()
+
+
+# *************************
+# Admin
+# *************************
+class AdminQueryCountTests(QuietTimingLogMixin, TestCase):
+    """Admin pages must cost the same number of queries on any table size."""
+
+    # Model -> filter for the change form's row: every SafePartner key set,
+    # since each selected one costs a query.
+    change_rows = {
+        SafePartner: {},
+        CryptoTransaction: {"partner__isnull": False, "partner_client__isnull": False},
+        Debt: {"safe_partner__isnull": False},
+        DebtRepayment: {},
+        TransferExchange: {},
+        IncomingMoney: {"from_partner__isnull": False, "to_partner__isnull": False},
+        OutgoingMoney: {"from_partner__isnull": False, "to_partner__isnull": False},
+        SafeTransaction: {"transaction_type": "TRANSFER"},
+    }
+    # (model name, autocomplete field) pairs; the targets are SafePartner/Debt.
+    autocompletes = (("cryptotransaction", "partner"), ("debtrepayment", "debt"))
+
+    def setUp(self):
+        self.client.force_login(
+            User.objects.create_superuser("admin", "admin@example.com", "x")
+        )
+
+    def count(self, path):
+        self.client.get(path)  # fills the session and reference caches
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200, path)
+        return len(queries)
+
+    def measure(self):
+        counts = {}
+        for model, row_filter in self.change_rows.items():
+            base = f"/admin/api/{model._meta.model_name}/"
+            counts[f"{base} list"] = self.count(base)
+            pk = model.objects.filter(**row_filter).values_list("pk", flat=True)[0]
+            counts[f"{base} change"] = self.count(f"{base}{pk}/change/")
+        for model_name, field in self.autocompletes:
+            path = (
+                f"/admin/autocomplete/?app_label=api&model_name={model_name}"
+                f"&field_name={field}"
+            )
+            counts[path] = self.count(path)
+        return counts
+
+    def test_pages_are_constant(self):
+        seed(*SMALL)
+        small = self.measure()
+        seed(*LARGE)
+        large = self.measure()
+        for name in small:
+            with self.subTest(name):
+                self.assertEqual(small[name], large[name])
+
+    def test_debt_remaining_matches_the_model(self):
+        seed(*SMALL)
+        debt = Debt.objects.filter(repayments__isnull=False).earliest("pk")
+        response = self.client.get("/admin/api/debt/?o=5")
+        remaining = debt.remaining_amount.quantize(Decimal("0.01"))
+        self.assertContains(response, f"{remaining} {debt.currency}")
+
+
+# *************************
+# HTTP benchmark
+# *************************
+class BenchHttpTests(QuietTimingLogMixin, LiveServerTestCase):
+    def test_every_route_answers_and_reports_its_queries(self):
+        seed(*SMALL)
+        user = User.objects.create(username="bench", is_staff=True)
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "bench.json")
+            options = dict(
+                base_url=f"{self.live_server_url}/api",
+                token=str(AccessToken.for_user(user)),
+                requests=2,
+                concurrency=1,
+                warmup=0,
+                output=output,
+                stdout=StringIO(),
+            )
+            with one_query_thread():
+                call_command("bench_http", **options)
+                with open(output) as fh:
+                    scenarios = json.load(fh)["scenarios"]
+                compared = StringIO()
+                options.update(no_writes=True, output=None, baseline=output)
+                call_command("bench_http", **dict(options, stdout=compared))
+
+        self.assertIn("GET crypto-transactions/ [list]", scenarios)
+        self.assertIn("POST debts/ [create]", scenarios)
+        for name, result in scenarios.items():
+            with self.subTest(name):
+                self.assertEqual(result["errors"], 0, result["error_statuses"])
+                self.assertIsNotNone(result["queries"])
+        self.assertIn("Not run this time: ", compared.getvalue())
+
+
+# *************************
+# Request profiling
+# *************************
+class ProfilingTests(QuietTimingLogMixin, TestCase):
+    path = "/api/partners/"
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        profiling = override_settings(PROFILE_DIR=self.directory, PROFILE_KEEP=2)
+        profiling.enable()
+        self.addCleanup(profiling.disable)
+        self.client = APIClient()
+        self.login(is_staff=True)
+
+    def login(self, is_staff):
+        user = User.objects.create(username=f"p{is_staff}", is_staff=is_staff)
+        token = AccessToken.for_user(user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def files(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_staff_request_is_profiled_and_downloadable(self):
+        response = self.client.get(f"{self.path}?profile=memory")
+        profile_id = response["X-Profile-Id"]
+        self.assertEqual(
+            self.files(),
+            [f"{profile_id}.{kind}" for kind in ("prof", "tracemalloc", "txt")],
+        )
+        summary = self.client.get(response["X-Profile-Url"])
+        self.assertEqual(summary.status_code, 200)
+        first_line = b"".join(summary.streaming_content).decode().splitlines()[0]
+        self.assertEqual(first_line, f"GET {self.path}?profile=memory -> 200")
+        self.assertEqual(
+            self.client.get("/api/profiles/not-an-id/txt/").status_code, 404
+        )
+
+    def test_only_the_newest_profiles_are_kept(self):
+        for _ in range(3):
+            self.client.get(self.path, HTTP_X_PROFILE="cpu")
+        self.assertEqual(len(self.files()), 4)  # .prof and .txt of two
+
+    def test_other_users_and_unset_dir_are_not_profiled(self):
+        with override_settings(PROFILE_DIR=None):
+            response = self.client.get(f"{self.path}?profile=1")
+            self.assertNotIn("X-Profile-Id", response)
+        self.login(is_staff=False)
+        response = self.client.get(f"{self.path}?profile=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(self.files(), [])
 
-# Create your tests here.
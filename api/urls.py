@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import *
+from . import async_views
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 router = DefaultRouter()
@@ -17,11 +18,32 @@ router.register(r"debt-repayments", DebtRepaymentViewSet)
 router.register(r"bonuses/today", TodayBonusViewSet, basename="bonus-today")
 router.register(r"bonuses/month", MonthBonusViewSet, basename="bonus-month")
 router.register("partners", PartnerReportViewSet, basename="partner-report")
+router.register(r"jobs", JobViewSet)
 
 
 urlpatterns = [
     path("", include(router.urls)),
     path("token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
+    path("events/", async_views.change_events, name="change-events"),
+    path("events/ticket/", StreamTicketView.as_view(), name="change-events-ticket"),
+    path("async/bonuses/today/", async_views.today_bonus, name="async-bonus-today"),
+    path("async/bonuses/month/", async_views.month_bonus, name="async-bonus-month"),
+    path(
+        "async/partners/<int:pk>/report/",
+        async_views.partner_report,
+        name="async-partner-report",
+    ),
+    path(
+        "async/outgoing/pending/total/",
+        async_views.pending_total,
+        name="async-total-pending-outgoing",
+    ),
+    path(
+        "profiles/<str:profile_id>/<str:kind>/",
+        ProfileDownloadView.as_view(),
+        name="profile-download",
+    ),
+    path("portfolio/", PortfolioValuationView.as_view(), name="portfolio-valuation"),
     path('outgoing/pending/total/', TotalPendingOutgoingMoneyView.as_view(), name='total-pending-outgoing'),
 ]
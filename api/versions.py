@@ -0,0 +1,80 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import DataVersion
+
+
+# Version tokens already read by the current request, keyed on the sorted
+# labels (see remembered_versions).
+_request_tokens = ContextVar("request_tokens", default=None)
+
+
+def model_label(model):
+    """A model's label; a string is a label of its own (see api.rates)."""
+    return model if isinstance(model, str) else model._meta.label_lower
+
+
+def bump_version(model):
+    """
+    Increment the DataVersion counter of ``model`` once the current
+    transaction commits, so readers never see the new version before the
+    data it describes.
+    """
+    label = model_label(model)
+    transaction.on_commit(lambda: _bump(label))
+
+
+def _bump(label):
+    tokens = _request_tokens.get()
+    if tokens:
+        for labels in [labels for labels in tokens if label in labels]:
+            del tokens[labels]
+    updated = DataVersion.objects.filter(model=label).update(
+        version=F("version") + 1, updated_at=timezone.now()
+    )
+    if not updated:
+        _, created = DataVersion.objects.get_or_create(
+            model=label, defaults={"version": 1}
+        )
+        if not created:
+            DataVersion.objects.filter(model=label).update(
+                version=F("version") + 1, updated_at=timezone.now()
+            )
+
+
+def current_versions(models):
+    """
+    A token for the given models, read in one query; it changes whenever
+    any of them changes.
+    """
+    labels = sorted(model_label(model) for model in models)
+    versions = dict(
+        DataVersion.objects.filter(model__in=labels).values_list("model", "version")
+    )
+    return ",".join(f"{label}:{versions.get(label, 0)}" for label in labels)
+
+
+@contextmanager
+def remembered_versions():
+    """
+    Within the block, ``version_token`` reads each token once: a request
+    sees one snapshot of the versions, except for those it bumps itself.
+    """
+    token = _request_tokens.set({})
+    try:
+        yield
+    finally:
+        _request_tokens.reset(token)
+
+
+def version_token(models):
+    """The ``current_versions`` token, read once per ``remembered_versions``."""
+    tokens = _request_tokens.get()
+    if tokens is None:
+        return current_versions(models)
+    labels = tuple(sorted(model_label(model) for model in models))
+    if labels not in tokens:
+        tokens[labels] = current_versions(models)
+    return tokens[labels]
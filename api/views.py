@@ -1,56 +1,76 @@
 from decimal import Decimal
 from django.forms import DecimalField
-from rest_framework import viewsets
+from rest_framework import mixins, viewsets
 from .models import *
 from .serializers import *
 from django.utils import timezone
-from django.db.models import Q
-from datetime import date, timedelta
+from django.db.models import Prefetch, Q
+from datetime import timedelta
 from .pagination import TenPerPagePagination
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from .reports import (
+    bonus_querysets,
+    bonus_response,
+    day_range,
+    evaluate,
+    get_today_range,
+    parse_as_of,
+    parse_day,
+    partner_report_querysets,
+    partner_report_response,
+    pending_total_querysets,
+    pending_total_response,
+    portfolio_querysets,
+    portfolio_response,
+    report_date_filter,
+)
+from .mixins import (
+    ExportMixin,
+    FastListMixin,
+    IdempotencyMixin,
+    ReferenceCacheMixin,
+    SparseFieldsQuerysetMixin,
+    VersionETagMixin,
+)
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from django.db.models import Sum, F, DecimalField, Case, When
 from rest_framework.response import Response
 from django.utils.dateparse import parse_datetime
 from rest_framework.decorators import action
-from datetime import datetime, time
 from rest_framework.views import APIView
-import pytz
-
-baghdad_tz = pytz.timezone("Asia/Baghdad")
-
-
-def get_today_range():
-    # Get current date in Baghdad timezone
-    now_baghdad = timezone.now().astimezone(baghdad_tz)
-    today_baghdad = now_baghdad.date()
-
-    # Create start and end of day in Baghdad timezone
-    start_baghdad = baghdad_tz.localize(datetime.combine(today_baghdad, time.min))
-    end_baghdad = baghdad_tz.localize(datetime.combine(today_baghdad, time.max))
-
-    # Convert to UTC for database queries (Django stores datetime in UTC)
-    start_utc = start_baghdad.astimezone(pytz.UTC)
-    end_utc = end_baghdad.astimezone(pytz.UTC)
-    return start_utc, end_utc
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.crypto import constant_time_compare
+from . import metrics
+from .authentication import issue_stream_ticket
+from .jobs import API_TASKS, TASKS, enqueue, output_dir
+from .profiling import profile_path
+from .rates import MissingRate, rate_book
+from .statements import current_month, get_statement, is_closed, parse_month
 
 
 # SafeType
-class SafeTypeViewSet(viewsets.ModelViewSet):
+class SafeTypeViewSet(VersionETagMixin, ReferenceCacheMixin, viewsets.ModelViewSet):
     queryset = SafeType.objects.all()
     serializer_class = SafeTypeSerializer
     permission_classes = [IsAuthenticated]
 
 
 # Partner
-class PartnerViewSet(viewsets.ModelViewSet):
+class PartnerViewSet(VersionETagMixin, ReferenceCacheMixin, viewsets.ModelViewSet):
     queryset = Partner.objects.all()
     serializer_class = PartnerSerializer
     permission_classes = [IsAuthenticated]
 
 
 # SafePartner
-class SafePartnerViewSet(viewsets.ModelViewSet):
+class SafePartnerViewSet(
+    VersionETagMixin,
+    FastListMixin,
+    SparseFieldsQuerysetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = SafePartner.objects.all()
+    etag_models = (SafePartner, Partner, SafeType)
     permission_classes = [IsAuthenticated]
 
     def get_serializer_class(self):
@@ -60,8 +80,32 @@ class SafePartnerViewSet(viewsets.ModelViewSet):
 
 
 # CryptoTransaction
-class CryptoTransactionViewSet(viewsets.ModelViewSet):
+class CryptoTransactionViewSet(
+    IdempotencyMixin,
+    VersionETagMixin,
+    ExportMixin,
+    FastListMixin,
+    SparseFieldsQuerysetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = CryptoTransaction.objects.all().order_by("-created_at")
+    etag_models = (CryptoTransaction, SafePartner, Partner, SafeType)
+    export_columns = (
+        ("id", "id"),
+        ("created_at", "created_at"),
+        ("transaction_type", "transaction_type"),
+        ("status", "status"),
+        ("partner", "partner__partner__name"),
+        ("partner_client", "partner_client__partner__name"),
+        ("client_name", "client_name"),
+        ("usdt_amount", "usdt_amount"),
+        ("usdt_price", "usdt_price"),
+        ("currency", "currency"),
+        ("crypto_safe", "crypto_safe__name"),
+        ("payment_safe", "payment_safe__name"),
+        ("bonus", "bonus"),
+        ("bonus_currency", "bonus_currency"),
+    )
     pagination_class = TenPerPagePagination
     permission_classes = [AllowAny]
 
@@ -105,30 +149,13 @@ class CryptoTransactionViewSet(viewsets.ModelViewSet):
             if partner_id:
                 queryset = queryset.filter(partner__id=partner_id)
 
-            # Apply date range filter
-            if start_date_str:
-                try:
-                    start_date = date.fromisoformat(start_date_str)
-                    queryset = queryset.filter(created_at__date__gte=start_date)
-                except ValueError:
-                    # Handle invalid date format if necessary
-                    pass
-
-            if end_date_str:
-                try:
-                    end_date = date.fromisoformat(end_date_str)
-                    queryset = queryset.filter(created_at__date__lte=end_date)
-                except ValueError:
-                    # Handle invalid date format if necessary
-                    pass
-
-            if end_date_str and not start_date_str:
-                try:
-                    end_date = date.fromisoformat(end_date_str)
-                    queryset = queryset.filter(created_at__date=end_date)
-                except ValueError:
-                    # Handle invalid date format if necessary
-                    pass
+            # Apply date range filter (invalid dates are ignored)
+            start_date = parse_day(start_date_str)
+            end_date = parse_day(end_date_str)
+            if end_date is not None and not start_date_str:
+                # Only an end date: that single day
+                start_date = end_date
+            queryset = queryset.filter(**day_range(start_date, end_date))
         else:
             start, end = get_today_range()
             queryset = queryset.filter(created_at__gte=start, created_at__lte=end)
@@ -139,8 +166,15 @@ class CryptoTransactionViewSet(viewsets.ModelViewSet):
 
 
 # TransferExchange
-class TransferExchangeViewSet(viewsets.ModelViewSet):
+class TransferExchangeViewSet(
+    IdempotencyMixin,
+    VersionETagMixin,
+    FastListMixin,
+    SparseFieldsQuerysetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = TransferExchange.objects.all().order_by("-created_at")
+    etag_models = (TransferExchange, SafePartner, Partner, SafeType)
     pagination_class = TenPerPagePagination
     permission_classes = [IsAuthenticated]
 
@@ -151,8 +185,32 @@ class TransferExchangeViewSet(viewsets.ModelViewSet):
 
 
 # IncomingMoney
-class IncomingMoneyViewSet(viewsets.ModelViewSet):
+class IncomingMoneyViewSet(
+    IdempotencyMixin,
+    VersionETagMixin,
+    ExportMixin,
+    FastListMixin,
+    SparseFieldsQuerysetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = IncomingMoney.objects.all().order_by("-created_at")
+    etag_models = (IncomingMoney, SafePartner, Partner, SafeType)
+    export_columns = (
+        ("id", "id"),
+        ("created_at", "created_at"),
+        ("status", "status"),
+        ("from_partner", "from_partner__partner__name"),
+        ("to_partner", "to_partner__partner__name"),
+        ("to_name", "to_name"),
+        ("to_number", "to_number"),
+        ("money_amount", "money_amount"),
+        ("currency", "currency"),
+        ("is_received", "is_received"),
+        ("my_bonus", "my_bonus"),
+        ("partner_bonus", "partner_bonus"),
+        ("bonus_currency", "bonus_currency"),
+        ("note", "note"),
+    )
     pagination_class = TenPerPagePagination
     permission_classes = [IsAuthenticated]
 
@@ -215,7 +273,11 @@ class IncomingMoneyViewSet(viewsets.ModelViewSet):
                 # Filter for transactions on or before the end date
                 queryset = queryset.filter(created_at__lte=end_date)
         elif start_date == end_date:
-            queryset = queryset.filter(created_at__date=start_date)
+            day = parse_day(start_date)
+            if day is not None:
+                queryset = queryset.filter(**day_range(day, day))
+            else:
+                queryset = queryset.filter(created_at__date=start_date)
 
         from_partner_id = query_params.get("from_partner")
         to_partner_id = query_params.get("to_partner")
@@ -228,8 +290,33 @@ class IncomingMoneyViewSet(viewsets.ModelViewSet):
 
 
 # OutgoingMoney
-class OutgoingMoneyViewSet(viewsets.ModelViewSet):
+class OutgoingMoneyViewSet(
+    IdempotencyMixin,
+    VersionETagMixin,
+    ExportMixin,
+    FastListMixin,
+    SparseFieldsQuerysetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = OutgoingMoney.objects.all().order_by("-created_at")
+    etag_models = (OutgoingMoney, SafePartner, Partner, SafeType)
+    export_columns = (
+        ("id", "id"),
+        ("created_at", "created_at"),
+        ("status", "status"),
+        ("from_partner", "from_partner__partner__name"),
+        ("to_partner", "to_partner__partner__name"),
+        ("from_name", "from_name"),
+        ("from_number", "from_number"),
+        ("taker_name", "taker_name"),
+        ("money_amount", "money_amount"),
+        ("currency", "currency"),
+        ("is_received", "is_received"),
+        ("my_bonus", "my_bonus"),
+        ("partner_bonus", "partner_bonus"),
+        ("bonus_currency", "bonus_currency"),
+        ("note", "note"),
+    )
     permission_classes = [IsAuthenticated]
 
     def get_serializer_class(self):
@@ -241,7 +328,7 @@ class OutgoingMoneyViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
 
-        queryset = OutgoingMoney.objects.all().order_by("-created_at")
+        queryset = super().get_queryset()
 
         # Get query parameters from the request
         query_params = self.request.query_params
@@ -272,7 +359,7 @@ class OutgoingMoneyViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(
                 Q(from_partner__partner__name__icontains=search_query)
                 | Q(to_partner__partner__name__icontains=search_query)
-                | Q(partner_client__partner__name__icontains=search_query)
+                | Q(taker_name__icontains=search_query)
                 | Q(from_name__icontains=search_query)
                 | Q(from_number__icontains=search_query)
                 | Q(money_amount__icontains=search_query)
@@ -296,7 +383,11 @@ class OutgoingMoneyViewSet(viewsets.ModelViewSet):
                 # Filter for transactions on or before the end date
                 queryset = queryset.filter(created_at__lte=end_date)
         elif start_date == end_date:
-            queryset = queryset.filter(created_at__date=start_date)
+            day = parse_day(start_date)
+            if day is not None:
+                queryset = queryset.filter(**day_range(day, day))
+            else:
+                queryset = queryset.filter(created_at__date=start_date)
 
         # 4. Handle partner filters
         from_partner_id = query_params.get("from_partner", None)
@@ -311,8 +402,27 @@ class OutgoingMoneyViewSet(viewsets.ModelViewSet):
 
 
 # SafeTransaction
-class SafeTransactionViewSet(viewsets.ModelViewSet):
+class SafeTransactionViewSet(
+    IdempotencyMixin,
+    VersionETagMixin,
+    ExportMixin,
+    FastListMixin,
+    SparseFieldsQuerysetMixin,
+    viewsets.ModelViewSet,
+):
     queryset = SafeTransaction.objects.all().order_by("-created_at")
+    etag_models = (SafeTransaction, SafePartner, Partner, SafeType)
+    export_columns = (
+        ("id", "id"),
+        ("created_at", "created_at"),
+        ("transaction_type", "transaction_type"),
+        ("partner", "partner__partner__name"),
+        ("from_safepartner", "from_safepartner__partner__name"),
+        ("to_safepartner", "to_safepartner__partner__name"),
+        ("money_amount", "money_amount"),
+        ("currency", "currency"),
+        ("note", "note"),
+    )
     permission_classes = [IsAuthenticated]
     pagination_class = TenPerPagePagination
 
@@ -322,7 +432,7 @@ class SafeTransactionViewSet(viewsets.ModelViewSet):
         return SafeTransactionGetSerializer
 
     def get_queryset(self):
-        queryset = SafeTransaction.objects.all().order_by("-created_at")
+        queryset = super().get_queryset()
         params = self.request.query_params
 
         search = params.get("search")
@@ -353,19 +463,35 @@ class SafeTransactionViewSet(viewsets.ModelViewSet):
                 # Filter for transactions on or before the end date
                 queryset = queryset.filter(created_at__lte=end_date)
         elif start_date == end_date:
-            queryset = queryset.filter(created_at__date=start_date)
+            day = parse_day(start_date)
+            if day is not None:
+                queryset = queryset.filter(**day_range(day, day))
+            else:
+                queryset = queryset.filter(created_at__date=start_date)
 
         return queryset
 
 
-class DebtViewSet(viewsets.ModelViewSet):
+class DebtViewSet(IdempotencyMixin, VersionETagMixin, viewsets.ModelViewSet):
     queryset = Debt.objects.all().order_by("-created_at")
+    etag_models = (Debt, DebtRepayment, SafePartner, Partner, SafeType)
     serializer_class = DebtSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = TenPerPagePagination
 
     def get_queryset(self):
-        queryset = Debt.objects.all().order_by("-created_at")
+        queryset = (
+            Debt.objects.select_related(
+                "debt_safe", "safe_partner__partner", "safe_partner__safe_type"
+            )
+            .prefetch_related(
+                Prefetch(
+                    "repayments",
+                    queryset=DebtRepayment.objects.select_related("safe_type"),
+                )
+            )
+            .order_by("-created_at")
+        )
         params = self.request.query_params
 
         search = params.get("search")
@@ -381,8 +507,13 @@ class DebtViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class DebtRepaymentViewSet(viewsets.ModelViewSet):
-    queryset = DebtRepayment.objects.all().order_by("-created_at")
+class DebtRepaymentViewSet(
+    IdempotencyMixin, VersionETagMixin, viewsets.ModelViewSet
+):
+    queryset = DebtRepayment.objects.select_related("debt", "safe_type").order_by(
+        "-created_at"
+    )
+    etag_models = (DebtRepayment, Debt, SafeType)
     serializer_class = DebtRepaymentSerializer
     permission_classes = [IsAuthenticated]
 
@@ -390,81 +521,12 @@ class DebtRepaymentViewSet(viewsets.ModelViewSet):
 # ** REPORT
 
 
-def calculate_bonus(queryset, date_field=None, start=None, end=None):
-    """
-    Helper to calculate total bonus, optionally filtered by date range.
-    """
-    if start and end:
-        queryset = queryset.filter(
-            **{f"{date_field}__gte": start, f"{date_field}__lte": end}
-        )
-
-    crypto_bonus = (
-        queryset[0]
-        .annotate(
-            adjusted_bonus=Case(
-                When(partner__isnull=False, then=F("bonus") / Decimal("2")),
-                default=F("bonus"),
-                output_field=DecimalField(max_digits=20, decimal_places=2),
-            )
-        )
-        .values("bonus_currency")
-        .annotate(total=Sum("adjusted_bonus"))
-        if queryset
-        else []
-    )
-
-    transfer_bonus = (
-        queryset[1].values("bonus_currency").annotate(total=Sum("my_bonus"))
-        if queryset
-        else []
-    )
-    incoming_bonus = (
-        queryset[2].values("bonus_currency").annotate(total=Sum("my_bonus"))
-        if queryset
-        else []
-    )
-    outgoing_bonus = (
-        queryset[3].values("bonus_currency").annotate(total=Sum("my_bonus"))
-        if queryset
-        else []
-    )
-
-    bonus_totals = {}
-    for entry in (
-        list(crypto_bonus)
-        + list(transfer_bonus)
-        + list(incoming_bonus)
-        + list(outgoing_bonus)
-    ):
-        currency = entry["bonus_currency"]
-        total = entry["total"] or 0
-        bonus_totals[currency] = bonus_totals.get(currency, 0) + total
-
-    return bonus_totals
-
-
 class TodayBonusViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
 
     def list(self, request):
         start, end = get_today_range()
-
-        crypto_qs = CryptoTransaction.objects.filter(
-            created_at__gte=start, created_at__lte=end
-        )
-        transfer_qs = TransferExchange.objects.filter(
-            created_at__gte=start, created_at__lte=end
-        )
-        incoming_qs = IncomingMoney.objects.filter(
-            created_at__gte=start, created_at__lte=end
-        )
-        outgoing_qs = OutgoingMoney.objects.filter(
-            created_at__gte=start, created_at__lte=end
-        )
-
-        bonuses = calculate_bonus([crypto_qs, transfer_qs, incoming_qs, outgoing_qs])
-        return Response(bonuses)
+        return Response(bonus_response(evaluate(bonus_querysets(start, end))))
 
 
 class MonthBonusViewSet(viewsets.ViewSet):
@@ -472,22 +534,7 @@ class MonthBonusViewSet(viewsets.ViewSet):
 
     def list(self, request):
         start, end = get_today_range()
-
-        crypto_qs = CryptoTransaction.objects.filter(
-            created_at__gte=start, created_at__lte=end
-        )
-        transfer_qs = TransferExchange.objects.filter(
-            created_at__gte=start, created_at__lte=end
-        )
-        incoming_qs = IncomingMoney.objects.filter(
-            created_at__gte=start, created_at__lte=end
-        )
-        outgoing_qs = OutgoingMoney.objects.filter(
-            created_at__gte=start, created_at__lte=end
-        )
-
-        bonuses = calculate_bonus([crypto_qs, transfer_qs, incoming_qs, outgoing_qs])
-        return Response(bonuses)
+        return Response(bonus_response(evaluate(bonus_querysets(start, end))))
 
 
 class PartnerReportViewSet(viewsets.ViewSet):
@@ -495,190 +542,192 @@ class PartnerReportViewSet(viewsets.ViewSet):
 
     @action(detail=True, methods=["get"], url_path="report")
     def report(self, request, pk=None):
-        start = request.query_params.get("start")
-        end = request.query_params.get("end")
-
         try:
             partner = Partner.objects.get(id=pk)
         except Partner.DoesNotExist:
             return Response({"error": "Partner not found"}, status=404)
 
-        date_filter = {}
-        # ... (Your date filtering logic remains the same)
-        if start:
-            try:
-                date_filter["created_at__gte"] = parse_datetime(
-                    start
-                ) or datetime.fromisoformat(start)
-            except:
-                pass
-        if end:
-            try:
-                end_date = parse_datetime(end) or datetime.fromisoformat(end)
-                date_filter["created_at__lte"] = end_date + timedelta(
-                    days=1
-                ) or datetime.fromisoformat(end)
-            except:
-                pass
-
-        partner_name = partner.name
-
-        # ✅ Crypto Transactions
-        # The key change is here: partner_client__partner__name
-        crypto_qs = (
-            CryptoTransaction.objects.filter(
-                Q(partner__partner__name=partner_name),
-                **date_filter,
-            )
-            .values()
-            .order_by("-created_at")
-        )
-        crypto_qs1 = (
-            CryptoTransaction.objects.filter(
-                Q(partner_client__partner__name=partner_name),
-                **date_filter,
-            )
-            .values()
-            .order_by("-created_at")
-        )
-
-        # ✅ Incoming Money
-        incoming_qs = (
-            IncomingMoney.objects.filter(
-                Q(to_partner__partner__name=partner_name),
-                **date_filter,
-            )
-            .values()
-            .order_by("-created_at")
-        )
-        incoming_qs1 = (
-            IncomingMoney.objects.filter(
-                Q(from_partner__partner__name=partner_name),
-                **date_filter,
-            )
-            .values()
-            .order_by("-created_at")
-        )
-
-        # ✅ Outgoing Money
-        outgoing_qs = (
-            OutgoingMoney.objects.filter(
-                Q(from_partner__partner__name=partner_name),
-                **date_filter,
-            )
-            .values()
-            .order_by("-created_at")
-        )
-        outgoing_qs1 = (
-            OutgoingMoney.objects.filter(
-                Q(to_partner__partner__name=partner_name),
-                **date_filter,
-            )
-            .values()
-            .order_by("-created_at")
+        date_filter = report_date_filter(
+            request.query_params.get("start"), request.query_params.get("end")
         )
+        querysets = partner_report_querysets(partner.name, date_filter)
+        return Response(partner_report_response(partner, evaluate(querysets)))
+
+    @action(detail=True, methods=["get"], url_path="statement")
+    def statement(self, request, pk=None):
+        """
+        The report of one month, ``?month=YYYY-MM`` (default: the current
+        one), with its totals. Closed months are served from storage
+        (api.statements).
+        """
+        try:
+            partner = Partner.objects.get(id=pk)
+        except Partner.DoesNotExist:
+            return Response({"error": "Partner not found"}, status=404)
 
+        month = current_month()
+        if request.query_params.get("month"):
+            month = parse_month(request.query_params["month"])
+            if month is None or month > current_month():
+                return Response(
+                    {"error": "month must be YYYY-MM and not in the future"},
+                    status=400,
+                )
+        body, generated_at = get_statement(partner, month)
         return Response(
-            {
-                "partner": partner.name,
-                "crypto_transactions": list(crypto_qs),
-                "crypto_transactions1": list(crypto_qs1),
-                "incoming_money": list(incoming_qs),
-                "incoming_money1": list(incoming_qs1),
-                "outgoing_money": list(outgoing_qs),
-                "outgoing_money1": list(outgoing_qs1),
-            }
+            {**body, "closed": is_closed(month), "generated_at": generated_at}
         )
 
 
 class TotalPendingOutgoingMoneyView(APIView):
     permission_classes = [AllowAny]
+    replica_reads = True
 
     def get(self, request, *args, **kwargs):
+        return Response(pending_total_response(evaluate(pending_total_querysets())))
 
-        pending_records = OutgoingMoney.objects.filter(status="Pending").annotate(
-            partner_type=F("to_partner__safe_type__name")
-        )
-        incoming_pending = IncomingMoney.objects.filter(status="Pending").annotate(
-            partner_type=F("from_partner__safe_type__name")
-        )
-        crypto_pending = CryptoTransaction.objects.filter(
-            status="Pending",
-            transaction_type="Sell",
-            partner_client__isnull=False,
-        ).annotate(partner_type=F("payment_safe__name"))
-        crypto_pending1 = CryptoTransaction.objects.filter(
-            status="Pending",
-            transaction_type="Buy",
-            partner_client__isnull=False,
-        ).annotate(partner_type=F("payment_safe__name"))
-        # Aggregate the total money, grouping by both currency and the annotated partner_type
-        outgoing_total_by_currency_and_type = (
-            pending_records.values("currency", "partner_type")
-            .annotate(total_money=Sum("money_amount"))
-            .order_by("currency", "partner_type")
-        )
-        incoming_total_by_currency_and_type = (
-            incoming_pending.values("currency", "partner_type")
-            .annotate(total_money=Sum("money_amount"))
-            .order_by("currency", "partner_type")
-        )
-        crypto_total_by_currency_and_type = (
-            crypto_pending.values("currency", "partner_type")
-            .annotate(total_money=Sum("usdt_price"))
-            .order_by("currency", "partner_type")
+
+class PortfolioValuationView(APIView):
+    """
+    Every SafePartner balance valued in USD: totals for the owner and third
+    parties, per safe type and per partner. ``?at=`` values them at the
+    rates of that date or datetime instead of the latest ones.
+    """
+
+    permission_classes = [IsAuthenticated]
+    replica_reads = True
+
+    def get(self, request, *args, **kwargs):
+        at = None
+        if request.query_params.get("at"):
+            at = parse_as_of(request.query_params["at"])
+            if at is None:
+                return Response(
+                    {"error": "at must be YYYY-MM-DD or an ISO datetime"}, status=400
+                )
+        try:
+            body = portfolio_response(evaluate(portfolio_querysets()), rate_book(), at)
+        except MissingRate as exc:
+            return Response({"error": str(exc)}, status=404)
+        return Response(body)
+
+
+# *************************
+# Change feed tickets
+# *************************
+class StreamTicketView(APIView):
+    """
+    ``POST /api/events/ticket/`` — a single-use ticket for opening the
+    /events/ stream as ``?ticket=``, valid for SSE_TICKET_TTL seconds.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        return Response(
+            {
+                "ticket": issue_stream_ticket(request.user),
+                "expires_in": getattr(settings, "SSE_TICKET_TTL", 30),
+            },
+            status=201,
         )
-        crypto_total_by_currency_and_type1 = (
-            crypto_pending1.values("currency", "partner_type")
-            .annotate(total_money=Sum("usdt_price"))
-            .order_by("currency", "partner_type")
+
+
+# *************************
+# Prometheus metrics
+# *************************
+def metrics_view(request):
+    """
+    Prometheus text exposition of api.metrics. The scraper must send
+    ``Authorization: Bearer <METRICS_TOKEN>``; without METRICS_TOKEN the
+    endpoint is off.
+    """
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if not token or not constant_time_compare(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return HttpResponse(status=403)
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+# *************************
+# Request profiles
+# *************************
+class ProfileDownloadView(APIView):
+    """Files written by api.middleware.ProfilingMiddleware (staff only)."""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, profile_id, kind):
+        path = profile_path(profile_id, kind)
+        if path is None or not path.exists():
+            return Response({"error": "Profile not found"}, status=404)
+        if kind == "txt":
+            return FileResponse(
+                open(path, "rb"), content_type="text/plain; charset=utf-8"
+            )
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=path.name)
+
+
+# *************************
+# Background jobs
+# *************************
+class JobViewSet(
+    mixins.CreateModelMixin,
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    Status of background jobs (api.jobs): staff see every job, other users
+    their own. POST ``{"task": ..., "kwargs": {...}}`` queues one of the
+    tasks listed in api.jobs.API_TASKS and answers 202.
+    """
+
+    queryset = Job.objects.order_by("-created_at")
+    serializer_class = JobSerializer
+    pagination_class = TenPerPagePagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        status = self.request.query_params.get("status")
+        if status:
+            queryset = queryset.filter(status=status)
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(created_by=self.request.user)
+        return queryset
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        name = serializer.validated_data["task"]
+        if name not in TASKS:
+            return Response({"error": f"Unknown task {name!r}"}, status=400)
+        allowed = API_TASKS.get(name)
+        if allowed is None or (allowed == "staff" and not request.user.is_staff):
+            return Response(
+                {"error": f"Task {name!r} cannot be queued here"}, status=403
+            )
+        job = enqueue(
+            name,
+            serializer.validated_data.get("kwargs"),
+            # Only staff may jump the queue.
+            priority=serializer.validated_data.get("priority", 0)
+            if request.user.is_staff
+            else 0,
+            user=request.user,
         )
-        # Prepare the response data in a more structured format
-        outgoing_response_data = {}
-        for item in outgoing_total_by_currency_and_type:
-            currency = item["currency"]
-            partner_type = item["partner_type"]
-            total = item["total_money"]
-
-            if currency not in outgoing_response_data:
-                outgoing_response_data[currency] = {}
-
-            outgoing_response_data[currency][partner_type] = total
-        incoming_response_data = {}
-        for item in incoming_total_by_currency_and_type:
-            currency = item["currency"]
-            partner_type = item["partner_type"]
-            total = item["total_money"]
-
-            if currency not in incoming_response_data:
-                incoming_response_data[currency] = {}
-
-            incoming_response_data[currency][partner_type] = total
-        crypto_response_data = {}
-        for item in crypto_total_by_currency_and_type:
-            currency = item["currency"]
-            partner_type = item["partner_type"]
-            total = item["total_money"]
-
-            if currency not in crypto_response_data:
-                crypto_response_data[currency] = {}
-
-            crypto_response_data[currency][partner_type] = total
-        crypto_response_data1 = {}
-        for item in crypto_total_by_currency_and_type1:
-            currency = item["currency"]
-            partner_type = item["partner_type"]
-            total = item["total_money"]
-
-            if currency not in crypto_response_data1:
-                crypto_response_data1[currency] = {}
-
-            crypto_response_data1[currency][partner_type] = total
-
-        final_response = {
-            "outgoing": outgoing_response_data,  # This is your existing outgoing data
-            "incoming": incoming_response_data,
-            "crypto": crypto_response_data,
-            "crypto1": crypto_response_data1,
-        }
-        return Response(final_response)
+        return Response(self.get_serializer(job).data, status=202)
+
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        """The file an export job wrote."""
+        job = self.get_object()
+        name = (job.result or {}).get("file") if job.status == "done" else None
+        path = output_dir() / name if name else None
+        if path is None or not path.exists():
+            return Response({"error": "File not found"}, status=404)
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=name)
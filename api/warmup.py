@@ -0,0 +1,111 @@
+import logging
+import time
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import QuerySet
+from django.http import HttpRequest
+from django.urls import get_resolver
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from .cache import get_rows, get_system_owner
+from .models import Partner, SafeType
+from .rates import rate_book
+
+# Server boot warm-up, run from the hooks in gunicorn.conf.py. preload()
+# runs once in the gunicorn master before it forks: the imports a first
+# request would pay for (URLconf, views, DRF, simplejwt) are then shared by
+# every worker. warm_up() runs in each worker and fills the per-process
+# state a first request would otherwise build: database connections, the
+# reference caches, the RateBook and the model/serializer metadata of every
+# routed viewset.
+
+logger = logging.getLogger("api.warmup")
+
+# DRF settings that import their classes on first access.
+DRF_CLASS_SETTINGS = (
+    "DEFAULT_AUTHENTICATION_CLASSES",
+    "DEFAULT_PERMISSION_CLASSES",
+    "DEFAULT_RENDERER_CLASSES",
+    "DEFAULT_PARSER_CLASSES",
+    "DEFAULT_THROTTLE_CLASSES",
+    "DEFAULT_CONTENT_NEGOTIATION_CLASS",
+    "DEFAULT_PAGINATION_CLASS",
+    "DEFAULT_FILTER_BACKENDS",
+)
+
+
+def preload():
+    """Import the URLconf and everything behind it; no database access."""
+    resolver = get_resolver()
+    resolver.reverse_dict  # imports api.urls and the views, builds the lookups
+    for name in DRF_CLASS_SETTINGS:
+        getattr(api_settings, name)
+
+
+# -----------------------------
+# Worker steps
+# -----------------------------
+def open_connections():
+    # With CONN_MAX_AGE = 0 the first request would close it again.
+    for alias in connections:
+        if connections[alias].settings_dict["CONN_MAX_AGE"] != 0:
+            connections[alias].ensure_connection()
+
+
+def prime_reference_caches():
+    get_rows(SafeType)
+    get_rows(Partner)
+    get_system_owner()
+
+
+def compile_query_paths():
+    """
+    Build the list queryset (compiled to SQL, not run) and the serializer
+    fields of every routed viewset, as a staff user's first list would.
+    """
+    from .urls import router
+
+    http_request = HttpRequest()
+    http_request.method = "GET"
+    request = Request(http_request)
+    request.user = User(username="warmup", is_staff=True)  # never saved
+    for _, viewset, _ in router.registry:
+        if getattr(viewset, "queryset", None) is None:
+            continue
+        view = viewset(request=request, action="list", format_kwarg=None, kwargs={})
+        queryset = view.get_queryset()
+        if isinstance(queryset, QuerySet):  # cached viewsets return lists
+            queryset.query.get_compiler(queryset.db).as_sql()
+        view.get_serializer().fields
+
+
+STEPS = (
+    ("connections", open_connections),
+    ("reference_caches", prime_reference_caches),
+    ("rate_book", rate_book),
+    ("query_paths", compile_query_paths),
+)
+
+
+def warm_up(connect=True):
+    """
+    Run the worker steps; ``connect=False`` skips the connections (threaded
+    and async workers serve requests from other threads). A failing step is
+    logged and skipped. Returns ``{step: milliseconds}``.
+    """
+    timings = {}
+    for name, step in STEPS:
+        if name == "connections" and not connect:
+            continue
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception:  # never keep a worker from booting
+            logger.warning("Warm-up step %s failed", name, exc_info=True)
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+    logger.info(
+        "Worker warmed up in %.1f ms (%s)",
+        sum(timings.values()),
+        ", ".join(f"{name} {ms} ms" for name, ms in timings.items()),
+    )
+    return timings
@@ -0,0 +1,51 @@
+import multiprocessing
+import os
+
+# gunicorn settings, read from the working directory:
+#     gunicorn Brwa.wsgi:application
+# For the ASGI app (the /api/events/ feed) run it under uvicorn workers:
+#     GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker \
+#         gunicorn Brwa.asgi:application
+# The app is imported once in the master (preload_app) and api.warmup
+# prepares each worker before it accepts requests.
+
+bind = os.environ.get("GUNICORN_BIND", f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(
+    os.environ.get("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 8))
+)
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "sync")
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+# Recycle workers now and then; the jitter keeps them from restarting together.
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", "200"))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "True") == "True"
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG") or None
+
+# Only a sync worker serves its requests on the thread that warm-up runs on,
+# so only there is the connection opened at boot worth keeping.
+SINGLE_THREADED = worker_class == "sync" and threads == 1
+if SINGLE_THREADED:
+    os.environ.setdefault("DB_CONN_MAX_AGE", "60")
+
+
+def when_ready(server):
+    # Runs in the master after the preload, before the first fork.
+    if not preload_app:
+        return
+    from django.db import connections
+    from api.warmup import preload
+
+    preload()
+    # Forked workers must not share the master's sockets.
+    connections.close_all()
+
+
+def post_worker_init(worker):
+    from api.warmup import preload, warm_up
+
+    if not preload_app:
+        preload()
+    warm_up(connect=SINGLE_THREADED)